@@ -4,9 +4,29 @@ import json
 import ctypes
 import random
 import itertools
+import functools
+import heapq
+import hashlib
+import tempfile
+import struct
+import argparse
+import string
+import time
+import zlib
+import array
+import collections
+import multiprocessing
+import concurrent.futures
+
+# NumPy is optional. Without it gravity is applied to one sprite at a time.
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # Constants you may want to play around with
 CHICKEN_MODE = False
+DIRTY_RECTS = False
 SHOW_START_SCREEN = True
 START_MINE = 1
 PLAYER_LIVES = 5
@@ -23,33 +43,102 @@ MAX_FALL_PIX = 100
 MAX_CONTROL_WHILE_FALLING_PIX = 10
 ELEVATOR_SPEED = 5
 ELEVATOR_PAUSE_MS = 3000
+LOD_INTERVAL = 3
+RENDER_FPS = 60
 WARNINGS_ANIMATION_FREQ_MS = 100
 WARNINGS_DURATION_MS = 1000
+AUTOSAVE_INTERVAL_MS = 10000
 
 # Constants you probably don't want to play around with
+ASSET_CACHE_FORMAT = "RGBX"
+ASSET_CACHE_MAX_MB = 256
+ATLAS_PAGE_SIZE = (2048, 2048)
+BENCHMARK_WARM_UP_FRAMES = 100
 CLIMBABLE_PIX = 1
 FPS = 25
+GRAVITY_BATCH_MIN_SPRITES = 24
 IMG_SEMI_TRANSPARENCY = 80
 IMG_FULLY_OPAQUE = 255
 IMG_TRANSPARENCY_INCREMENTATION = 1
+INPUT_LOG_MAGIC = b"GTIN"
+INPUT_LOG_VERSION = 1
+INTERPOLATION_MAX_PIX = 60
+MAX_FRAME_SKIP = 5
+NAV_GRID_PIX = 20
+NAV_PATH_CACHE_SIZE = 1024
+RANDOM_POLICY_HOLD_FRAMES = (5, 40)
+RANDOM_POLICY_INTERACT_CHANCE = 30
+SAVE_GAME_MAGIC = b"GTSV"
+SAVE_GAME_VERSION = 1
 SCREEN_SIZE = (1440, 1080)
+SPATIAL_HASH_CELL_PIX = 240
 SPRITE_SIZE = (120, 120)
+STATE_TRACE_MAGIC = b"GTST"
+STATE_TRACE_VERSION = 1
+TEXT_CACHE_SIZE = 64
 
-# Make sure we get the right screen resolution
-ctypes.windll.user32.SetProcessDPIAware()
+# Functions
+def animation_files(animation, sprite_name, multiply_x_by=1, multiply_y_by=1):
+    """
+    Find the image files of an animation
+
+    - animation -- (String. Mandatory) The name of the requested animation. Use Animation enum
+    - sprite_name -- (String. Optional) The name of the sprite. Use SpriteName enum.
+    - multiply_x_by -- (Integer. Optional. Defaults to 1) Multiply the horizontal size of the image with the given
+        number
+    - multiply_y_by -- (Integer. Optional. Defaults to 1) Multiply the vertical size of the image with the given number
 
-# Setup screen
-screen = pygame.display.set_mode(SCREEN_SIZE)
+    Returns: Tuple. (folder, size the images are scaled to, list of image files). The list is empty if the folder
+        doesn't exist.
+    """
+    folder = {
+        Animation.CLIMBING: Folder.CLIMBING_IMGS.format(sprite_name),
+        Animation.CLIMBING_UP: Folder.CLIMBING_UP_IMGS.format(sprite_name),
+        Animation.CLIMBING_DOWN: Folder.CLIMBING_DOWN_IMGS.format(sprite_name),
+        Animation.CLIMBING_WITH_GOLD: Folder.CLIMBING_WITH_GOLD_IMGS.format(sprite_name),
+        Animation.FALLING: Folder.IDLE_IMGS.format(sprite_name),
+        Animation.IDLE: Folder.IDLE_IMGS.format(sprite_name),
+        Animation.IDLE_CLIMBING: Folder.IDLE_CLIMBING_IMGS.format(sprite_name),
+        Animation.IDLE_CLIMBING_WITH_GOLD: Folder.IDLE_CLIMBING_WITH_GOLD_IMGS.format(sprite_name),
+        Animation.IDLE_RIDING_ELEVATOR: Folder.IDLE_RIDING_ELEVATOR_IMGS.format(sprite_name),
+        Animation.IDLE_WITH_EMPTY_WHEELBARROW: Folder.IDLE_WITH_EMPTY_WHEELBARROW_IMGS.format(sprite_name),
+        Animation.IDLE_WITH_GOLD: Folder.IDLE_WITH_GOLD_IMGS.format(sprite_name),
+        Animation.IDLE_WITH_LOADED_01_WHEELBARROW: Folder.IDLE_WITH_LOADED_01_WHEELBARROW_IMGS.format(sprite_name),
+        Animation.IDLE_WITH_LOADED_02_WHEELBARROW: Folder.IDLE_WITH_LOADED_02_WHEELBARROW_IMGS.format(sprite_name),
+        Animation.IDLE_WITH_LOADED_03_WHEELBARROW: Folder.IDLE_WITH_LOADED_03_WHEELBARROW_IMGS.format(sprite_name),
+        Animation.LOADED_01: Folder.LOADED_01.format(sprite_name),
+        Animation.LOADED_02: Folder.LOADED_02.format(sprite_name),
+        Animation.LOADED_03: Folder.LOADED_03.format(sprite_name),
+        Animation.LOADED_04: Folder.LOADED_04.format(sprite_name),
+        Animation.LOADED_05: Folder.LOADED_05.format(sprite_name),
+        Animation.PASSED_OUT: Folder.PASSED_OUT_IMGS.format(sprite_name),
+        Animation.PUSHING_EMPTY_WHEELBARROW: Folder.PUSHING_EMPTY_WHEELBARROW_IMGS.format(sprite_name),
+        Animation.PUSHING_LOADED_01_WHEELBARROW: Folder.PUSHING_LOADED_01_WHEELBARROW_IMGS.format(sprite_name),
+        Animation.PUSHING_LOADED_02_WHEELBARROW: Folder.PUSHING_LOADED_02_WHEELBARROW_IMGS.format(sprite_name),
+        Animation.PUSHING_LOADED_03_WHEELBARROW: Folder.PUSHING_LOADED_03_WHEELBARROW_IMGS.format(sprite_name),
+        Animation.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW:
+            Folder.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW_IMGS.format(sprite_name),
+        Animation.RIDING_ELEVATOR_WITH_GOLD: Folder.RIDING_ELEVATOR_WITH_GOLD_IMGS.format(sprite_name),
+        Animation.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW:
+            Folder.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW_IMGS.format(sprite_name),
+        Animation.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW:
+            Folder.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW_IMGS.format(sprite_name),
+        Animation.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW:
+            Folder.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW_IMGS.format(sprite_name),
+        Animation.WALKING: Folder.WALKING_IMGS.format(sprite_name),
+        Animation.WALKING_WITH_GOLD: Folder.WALKING_WITH_GOLD_IMGS.format(sprite_name)}[animation]
+    size = (SPRITE_SIZE[0] * multiply_x_by, SPRITE_SIZE[1] * multiply_y_by)
+    files = [folder + i for i in os.listdir(folder)] if os.path.exists(folder) else []
+    return folder, size, files
 
 
-# Functions
 def animation_loop(imgs):
     """
-    Generator function that will continuously loop through a list of pyGame images
+    Generator function that will continuously loop through a list of animation frames
 
-    - imgs -- (List. Mandatory) A list of images
+    - imgs -- (List. Mandatory) A list of animation frames as returned by load_images
 
-    Yields: image
+    Yields: Dict. An animation frame
     """
     i = 0
     while True:
@@ -57,19 +146,251 @@ def animation_loop(imgs):
         i = i + 1 if i + 1 < len(imgs) else 0
 
 
+def batch(runs, seed=0, policy=None, frames=None, workers=None):
+    """
+    Play through the start mine headless many times in parallel, one run per seed, and print a report. Every worker
+    process sets up its own world once and resets it for each run. The result of each run is printed as soon as it's
+    done and a summary of all runs is printed at the end.
+
+    - runs -- (Integer. Mandatory) The number of runs
+    - seed -- (Integer. Optional. Defaults to 0) The seed of the first run. The following runs use the next seeds.
+    - policy -- (String. Optional. Defaults to Policy.RANDOM) How the player is controlled. Use Policy enum.
+    - frames -- (Integer. Optional. Defaults to None) Stop each run after the given number of frames. If not provided
+        a run goes on until the mine is completed or the game is over.
+    - workers -- (Integer. Optional. Defaults to the number of CPUs) The number of worker processes
+
+    Returns: List. The results of the runs, in the order they were done. See play.
+    """
+    policy = policy or Policy.RANDOM
+    start_time = time.perf_counter()
+    results = []
+
+    # Workers are started with spawn rather than fork so that they don't inherit the PyGame state of this process. SDL
+    # catches the signal Pool.terminate sends so the workers are told to quit when they are done instead.
+    pool = multiprocessing.get_context("spawn").Pool(processes=workers, initializer=setup, initargs=(True,))
+    try:
+        for result in pool.imap_unordered(play_run, [(seed + i, policy, frames) for i in range(runs)]):
+            results.append(result)
+            frame_times = result["frame_times"]
+            print(
+                f"Seed {result['seed']}: Gold delivered: {result['gold_delivered']}/{result['no_of_gold_sacks']}. "
+                f"Caught: {result['times_caught']}. Time left: {int(result['seconds_remaining'])} s. "
+                f"Lives: {result['lives']}. Frames: {result['frames']}. Frame time p50/p99: "
+                f"{percentile(frame_times, 50):.1f}/{percentile(frame_times, 99):.1f} ms.", flush=True)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Summary of all runs
+    frame_times = sum((result["frame_times"] for result in results), collections.Counter())
+    completed = sum(result["gold_delivered"] >= result["no_of_gold_sacks"] for result in results)
+    print(
+        f"Played {len(results)} runs in {time.perf_counter() - start_time:.1f} s. Completed: {completed}. "
+        f"Average gold delivered: {sum(result['gold_delivered'] for result in results) / len(results):.2f}. "
+        f"Average caught: {sum(result['times_caught'] for result in results) / len(results):.2f}. "
+        f"Average time left: {sum(result['seconds_remaining'] for result in results) / len(results):.0f} s. "
+        f"Frame time p50/p90/p99/max: {percentile(frame_times, 50):.1f}/{percentile(frame_times, 90):.1f}/"
+        f"{percentile(frame_times, 99):.1f}/{percentile(frame_times, 100):.1f} ms.")
+    return results
+
+
+def benchmark_gravity(sprites_per_room, seed=0, frames=None):
+    """
+    Time the start mine headless with many sprites that can't climb in every room, with gravity applied to them one
+    at a time and in one pass (PassiveSprites), and print the mean frame times. Used to find how many sprites a room
+    needs before the pass is faster, see GRAVITY_BATCH_MIN_SPRITES. The player stands still. The state of the sprites
+    at the end of both ways is compared too, to check that the pass still follows the same rules as Sprite.move.
+
+    - sprites_per_room -- (Integer. Mandatory) The number of gold sacks, trucks and wheelbarrows in every room. Rooms
+        with fewer get gold sacks at random positions.
+    - seed -- (Integer. Optional. Defaults to 0) Seed the random number generators and the positions of the gold sacks
+    - frames -- (Integer. Optional. Defaults to 1000) The number of frames to time, after BENCHMARK_WARM_UP_FRAMES.
+        Fewer are timed if the game is over before.
+
+    Returns: Dict. The mean frame time in milliseconds by how gravity is applied: "one at a time" and, if NumPy is
+        installed, "in one pass"
+    """
+    ways = [("one at a time", float("inf"))] + ([("in one pass", 0)] if numpy else [])
+    results = {}
+    states = {}
+    try:
+        for way, min_batch in ways:
+            mine.reset(START_MINE)
+            warnings.empty()
+            random.seed(seed)
+            positions = random.Random(seed)
+            for r in sorted(mine.rooms, key=int):
+                groups = [mine.rooms[r][group] for group in ("gold_sacks", "trucks", "wheelbarrows")]
+                for _ in range(sprites_per_room - sum(len(group) for group in groups)):
+                    groups[0].add(Sprite(
+                        name=SpriteName.GOLD, position=(
+                            positions.randrange(SCREEN_SIZE[0]), positions.randrange(SCREEN_SIZE[1] - SPRITE_SIZE[1])),
+                        animation_freq_ms=500, org_room_no=int(r)))
+            # The first frames, while the gold sacks land and the tables of the walls are made, aren't timed
+            frame = -BENCHMARK_WARM_UP_FRAMES
+            for key_press, interact_key_pressed in input_policy(Policy.IDLE, seed):
+                if mine.is_game_over() or frame == (frames or 1000):
+                    break
+                if frame == 0:
+                    start_time = time.perf_counter()
+                simulate(interact_key_pressed, key_press, min_batch)
+                frame += 1
+            results[way] = (time.perf_counter() - start_time) * 1000 / frame if frame > 0 else 0.0
+            states[way] = dict(zip(StateTrace.FIELDS, StateTrace().hash_fields()))
+            print(f"{sprites_per_room} sprites per room, gravity applied {way}: {results[way]:.3f} ms per frame "
+                  f"({frame} frames)", flush=True)
+    finally:
+        mine.reset(START_MINE)
+
+    # Both ways must end with the sprites in the same state. The timers and the state of the mine hold the time of the
+    # game clock, which goes on from one way to the next.
+    if len(states) > 1:
+        one, other = states.values()
+        differ = [field for field in StateTrace.FIELDS[:-2] if one[field] != other[field]]
+        print(f"The sprites end in different states: {', '.join(differ)}" if differ else
+              "The sprites end in the same state")
+    return results
+
+
 def change_direction(direction):
     """
     Returns the opposite direction of received argument
 
-    - direction -- (String. Mandatory) Use Direction ENUM
+    - direction -- (Integer. Mandatory) Use Direction ENUM
 
-    Returns: String
+    Returns: Integer
     """
     return {
         Direction.RIGHT: Direction.LEFT, Direction.LEFT: Direction.RIGHT, Direction.UP: Direction.DOWN,
         Direction.DOWN: Direction.UP}[direction]
 
 
+def check_determinism(seed=0, policy=None, frames=None):
+    """
+    Play the same run twice in this process and report whether the results are the same. Batch runs reuse the world
+    of their worker process so a run must not depend on the runs played before it.
+
+    - seed -- (Integer. Optional. Defaults to 0) The seed of the run
+    - policy -- (String. Optional. Defaults to Policy.RANDOM) How the player is controlled. Use Policy enum.
+    - frames -- (Integer. Optional. Defaults to None) Stop the run after the given number of frames. If not provided
+        the run goes on until the mine is completed or the game is over.
+
+    Returns: Boolean. True if the results are the same
+    """
+    results = [play(seed, policy, frames) for _ in range(2)]
+    for result in results:
+        result.pop("frame_times")
+    if results[0] != results[1]:
+        print(f"Seed {seed} gave different results when played twice: {results[0]} vs. {results[1]}")
+        return False
+    print(f"Seed {seed} gave the same result when played twice")
+    return True
+
+
+def check_mines():
+    """
+    Report gold sacks and trucks that the player can't reach from the start position. Meant for mine designers.
+
+    Returns: Integer. The number of unreachable sprites in all mines.
+    """
+    unreachable = 0
+    for m in mine.tot_number_of_mines:
+        mine.load(m)
+        player = mine.rooms["1"]["player"]
+        for r in mine.rooms:
+            for spr in mine.rooms[r]["gold_sacks"].sprites() + mine.rooms[r]["trucks"].sprites():
+                reachable = mine.navigation.is_reachable(1, player.rect.midbottom, int(r), spr.rect.midbottom)
+                if not spr.is_placeholder and not reachable:
+                    unreachable += 1
+                    print(f"Mine {m}, room {r}: {spr.name} at {spr.rect.topleft} can't be reached by the player")
+    print(f"{unreachable} unreachable sprites found")
+    return unreachable
+
+
+def clear_asset_cache():
+    """
+    Delete all images in the asset cache
+
+    Returns: None
+    """
+    if os.path.exists(Folder.ASSET_CACHE):
+        for file_name in os.listdir(Folder.ASSET_CACHE):
+            os.remove(Folder.ASSET_CACHE + file_name)
+
+
+def collide_masks(left, right):
+    """
+    Check if the masks of two sprites overlap. Collisions between moving sprites are tested with the masks of their
+    current animation frames. Ladders, elevator shafts and exits are part of the room layout and are tested against
+    the body masks instead, just like the walls.
+
+    - left -- (Object. Mandatory) A sprite
+    - right -- (Object. Mandatory) Another sprite
+
+    Returns: Boolean
+    """
+    if left.is_static or right.is_static:
+        left_mask, right_mask = left.body_mask, right.body_mask
+    else:
+        left_mask, right_mask = left.mask, right.mask
+    return left_mask.overlap(right_mask, (right.rect.x - left.rect.x, right.rect.y - left.rect.y)) is not None
+
+
+def compare_traces(path_01, path_02):
+    """
+    Compare two world state traces, e.g. of the same replay before and after a change, and print the first frame where
+    the world states differ and in what fields
+
+    - path_01 -- (String. Mandatory) The first trace file
+    - path_02 -- (String. Mandatory) The second trace file
+
+    Returns: Integer. The first frame that differs, or None if the traces are identical
+    """
+    trace_01 = StateTrace.load(path_01)
+    trace_02 = StateTrace.load(path_02)
+    for frame, (record_01, record_02) in enumerate(zip(trace_01, trace_02), 1):
+        if record_01[0] != record_02[0]:
+            fields = [f for f, h_01, h_02 in zip(StateTrace.FIELDS, record_01[1:], record_02[1:]) if h_01 != h_02]
+            print(f"The traces differ from frame {frame} in: {', '.join(fields)}")
+            return frame
+    if len(trace_01) != len(trace_02):
+        print(f"The traces are identical for {min(len(trace_01), len(trace_02))} frames but one of them is longer: "
+              f"{len(trace_01)} vs. {len(trace_02)} frames")
+        return min(len(trace_01), len(trace_02)) + 1
+    print(f"The traces are identical for {len(trace_01)} frames")
+    return None
+
+
+def decode_image(path, size=None):
+    """
+    Read an image from the asset cache or decode the image file and scale it. Nothing is converted to the pixel format
+    of the screen so this is safe to run in a worker thread.
+
+    - path -- (String. Mandatory) The image file
+    - size -- (Tuple. Optional. Defaults to None) The size to scale the image to. Not scaled if not provided.
+
+    Returns: Tuple. (the file name in the asset cache, the image, whether the image was read from the asset cache)
+    """
+    with open(path, "rb") as file:
+        key = hashlib.sha1(file.read())
+    key.update(repr((size, ASSET_CACHE_FORMAT, pygame.display.get_surface().get_bitsize())).encode())
+    cached = Folder.ASSET_CACHE + key.hexdigest()
+
+    # The file may be missing or be deleted by another process while it's read, e.g. when the cache is trimmed. The
+    # image is then decoded as if it wasn't cached.
+    if ASSET_CACHE_MAX_MB:
+        try:
+            with open(cached, "rb") as file:
+                header = file.read(8)
+                pixels = file.read()
+            return cached, pygame.image.frombuffer(pixels, struct.unpack("<II", header), ASSET_CACHE_FORMAT), True
+        except (OSError, struct.error, ValueError):
+            pass
+
+    image = pygame.image.load(path)
+    return cached, pygame.transform.scale(image, size) if size else image, False
+
+
 def exit_room(exits_, sprites_):
     """
     Check whether a sprite walks through an exit and if so transport to a different room
@@ -96,6 +417,42 @@ def exit_room(exits_, sprites_):
                 spr.rect.x = e.leads_to["x"]
                 spr.rect.y = e.leads_to["y"]
                 spr.in_room = e.leads_to["room"]
+                spr.reindex()
+
+
+def first_overlap(mask, position, moving_mask, moving_position, x, y, pix):
+    """
+    Find the first pixel along a straight move where a moving mask overlaps a still one. Instead of testing every
+    pixel along the way the moving mask is swept over the whole distance and the first overlap is then found by
+    bisecting the swept distance.
+
+    - mask -- (pygame.mask.Mask. Mandatory) The still mask, e.g. the room walls
+    - position -- (Tuple. Mandatory) The position of the still mask
+    - moving_mask -- (pygame.mask.Mask. Mandatory) The mask of the moving sprite
+    - moving_position -- (Tuple. Mandatory) The position of the moving mask before the move
+    - x -- (Integer. Mandatory) Horizontal movement per pixel. -1, 0 or 1.
+    - y -- (Integer. Mandatory) Vertical movement per pixel. -1, 0 or 1.
+    - pix -- (Integer. Mandatory) The number of pixels to move
+
+    Returns: Integer. The number of pixels moved when the masks first overlap or pix + 1 if they don't overlap at all.
+    """
+    offset_x = moving_position[0] - position[0]
+    offset_y = moving_position[1] - position[1]
+    if pix < 1:
+        return pix + 1
+    if mask.overlap(moving_mask, (offset_x + x, offset_y + y)):
+        return 1
+    if not mask.overlap(swept_mask(moving_mask, x, y, pix), (offset_x + min(x, x * pix), offset_y + min(y, y * pix))):
+        return pix + 1
+    first, last = 2, pix
+    while first < last:
+        middle = (first + last) // 2
+        if mask.overlap(
+                swept_mask(moving_mask, x, y, middle), (offset_x + min(x, x * middle), offset_y + min(y, y * middle))):
+            last = middle
+        else:
+            first = middle + 1
+    return first
 
 
 def flatten_list(l):
@@ -109,19 +466,36 @@ def flatten_list(l):
     return [item for sublist in l for item in sublist]
 
 
+def free_pix_within(position, direction, limit):
+    """
+    Calculate how many pixels a position can be moved before it is no longer between 0 and limit (exclusive)
+
+    - position -- (Integer. Mandatory) The current position
+    - direction -- (Integer. Mandatory) Movement per pixel. -1, 0 or 1.
+    - limit -- (Integer. Mandatory) The upper limit
+
+    Returns: Integer or float (infinity)
+    """
+    if not 0 < position + direction < limit:
+        return 0
+    return {1: limit - position - 1, -1: position - 1, 0: float("inf")}[direction]
+
+
 def game_over():
     """Display the game over screen"""
     text = {mine.seconds_remaining <= 0: out_of_time, mine.player.lives <= 0: game_over_}[True]
-    screen.blit(text.text, text.rect)
-    pygame.display.flip()
+    if display.show_overlay(text):
+        screen.blit(text.text, text.rect)
+        pygame.display.flip()
 
 
 def get_caught():
     """Check whether the player is caught by a miner"""
-    for mi in mine.miners.sprites():
-        if mi.collides(mine.player) and not mine.player.is_passed_out() and not mi.is_passed_out() \
-                and not CHICKEN_MODE and not mine.player.immortality_timer:
+    for mi in mine.miners.collisions(mine.player):
+        if not mine.player.is_passed_out() and not mi.is_passed_out() \
+                and not CHICKEN_MODE and not mine.player.is_immortal():
             mine.player.pass_out()
+            mine.times_caught += 1
 
 
 def hit_miner():
@@ -129,21 +503,48 @@ def hit_miner():
     Check if a miner is hit by a falling gold sack
     """
     for gold_ in mine.gold_sacks.sprites():
-        for miner_ in mine.miners.sprites():
-            if miner_.collides(gold_) and gold_.is_falling() and not miner_.is_passed_out():
+        for miner_ in mine.miners.collisions(gold_):
+            if gold_.is_falling() and not miner_.is_passed_out():
                 miner_.pass_out()
                 mine.bonus += BONUS_POINTS
 
 
-def key_presses(interact_key_pressed):
+def input_policy(policy, seed=None):
+    """
+    Generate the input of a player that isn't a human, one frame at a time
+
+    - policy -- (String. Mandatory) How the player is controlled. Use Policy enum.
+    - seed -- (Integer. Optional. Defaults to None) Seed the random number generator of the policy. The policy has
+        its own random number generator so that it doesn't change the random numbers the game draws.
+
+    Returns: Generator. Yields tuples (key presses, True if an interact key is pressed) for key_presses
+    """
+    rng = random.Random(seed)
+    key_press = collections.defaultdict(bool)
+    hold = 0
+    while True:
+
+        # Random policy: Hold a random arrow key, or none, for a random number of frames and now and then interact
+        if policy == Policy.RANDOM and hold <= 0:
+            key_press.clear()
+            key = rng.choice((None, pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN))
+            if key:
+                key_press[key] = True
+            hold = rng.randrange(*RANDOM_POLICY_HOLD_FRAMES)
+        hold -= 1
+        yield key_press, policy == Policy.RANDOM and rng.randrange(RANDOM_POLICY_INTERACT_CHANCE) == 0
+
+
+def key_presses(interact_key_pressed, key_press=None):
     """
     Check key presses and control the player sprite
 
     - interact_key_pressed -- (Boolean. Mandatory) Specifies whether one of the interact keys were pressed
+    - key_press -- (Sequence. Optional. Defaults to the keyboard state) The state of all keys, indexed by key
     """
 
     # Get key presses
-    key_press = pygame.key.get_pressed()
+    key_press = pygame.key.get_pressed() if key_press is None else key_press
     down = key_press[pygame.K_DOWN] and mine.player.collides(mine.ladders)
     left = key_press[pygame.K_LEFT] and not mine.player.is_falling()
     right = key_press[pygame.K_RIGHT] and not mine.player.is_falling()
@@ -162,63 +563,23 @@ def key_presses(interact_key_pressed):
     if mine.player.is_passed_out():
         return
 
-    # Player is idle if no keys are pressed
+    # The player's next activity is looked up in the transition table by what the player carries, the control that is
+    # used and where the player is. The player is idle if no keys are pressed.
     if no_key_presses:
-        if mine.player.is_carrying_gold() and mine.player.is_climbing():
-            mine.player.update(Activity.IDLE_CLIMBING_WITH_GOLD)
-        elif mine.player.is_climbing():
-            mine.player.update(Activity.IDLE_CLIMBING)
-        elif mine.player.is_riding_elevator and mine.player.is_carrying_gold():
-            mine.player.update(Activity.RIDING_ELEVATOR_WITH_GOLD)
-        elif mine.player.is_carrying_gold():
-            mine.player.update(Activity.IDLE_WITH_GOLD)
-        elif mine.player.is_riding_elevator and mine.player.is_pushing_empty_wheelbarrow():
-            mine.player.update(Activity.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW)
-        elif mine.player.is_pushing_empty_wheelbarrow():
-            mine.player.update(Activity.IDLE_WITH_EMPTY_WHEELBARROW)
-        elif mine.player.is_riding_elevator and mine.player.is_pushing_loaded_01_wheelbarrow():
-            mine.player.update(Activity.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW)
-        elif mine.player.is_riding_elevator and mine.player.is_pushing_loaded_02_wheelbarrow():
-            mine.player.update(Activity.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW)
-        elif mine.player.is_riding_elevator and mine.player.is_pushing_loaded_03_wheelbarrow():
-            mine.player.update(Activity.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW)
-        elif mine.player.is_pushing_loaded_01_wheelbarrow():
-            mine.player.update(Activity.IDLE_WITH_LOADED_01_WHEELBARROW)
-        elif mine.player.is_pushing_loaded_02_wheelbarrow():
-            mine.player.update(Activity.IDLE_WITH_LOADED_02_WHEELBARROW)
-        elif mine.player.is_pushing_loaded_03_wheelbarrow():
-            mine.player.update(Activity.IDLE_WITH_LOADED_03_WHEELBARROW)
-        elif mine.player.is_riding_elevator:
-            mine.player.update(Activity.IDLE_RIDING_ELEVATOR)
-        else:
-            mine.player.update(Activity.IDLE)
+        context = Context.LADDER if mine.player.is_climbing() else \
+            Context.ELEVATOR if mine.player.is_riding_elevator else Context.FLOOR
+        mine.player.update(PLAYER_TRANSITIONS[mine.player.get_load(), Control.NONE, context])
 
     # Move up and down
     if move_vertical:
-        activity = Activity.CLIMBING_WITH_GOLD if mine.player.is_carrying_gold() else Activity.CLIMBING
+        activity = PLAYER_TRANSITIONS[mine.player.get_load(), Control.VERTICAL, Context.LADDER]
         mine.player.move(Direction.DOWN if down else Direction.UP, activity=activity)
 
     # Move left and right
     if move_horizontal:
-        if mine.player.is_carrying_gold():
-            activity = Activity.CLIMBING_WITH_GOLD \
-                if mine.player.is_climbing() and mine.player.collides(mine.ladders) \
-                else Activity.WALKING_WITH_GOLD
-        elif mine.player.is_pushing_empty_wheelbarrow():
-            activity = Activity.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW \
-                if mine.player.is_riding_elevator else Activity.PUSHING_EMPTY_WHEELBARROW
-        elif mine.player.is_pushing_loaded_01_wheelbarrow():
-            activity = Activity.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW \
-                if mine.player.is_riding_elevator else Activity.PUSHING_LOADED_01_WHEELBARROW
-        elif mine.player.is_pushing_loaded_02_wheelbarrow():
-            activity =  Activity.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW \
-                if mine.player.is_riding_elevator else Activity.PUSHING_LOADED_02_WHEELBARROW
-        elif mine.player.is_pushing_loaded_03_wheelbarrow():
-            activity = Activity.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW \
-                if mine.player.is_riding_elevator else Activity.PUSHING_LOADED_03_WHEELBARROW
-        else:
-            activity = \
-                Activity.CLIMBING if mine.player.is_climbing() and mine.player.collides(mine.ladders) else Activity.WALKING
+        context = Context.LADDER if mine.player.is_climbing() and mine.player.collides(mine.ladders) else \
+            Context.ELEVATOR if mine.player.is_riding_elevator else Context.FLOOR
+        activity = PLAYER_TRANSITIONS[mine.player.get_load(), Control.HORIZONTAL, context]
         mine.player.move(Direction.LEFT if left else Direction.RIGHT, activity=activity)
 
     # Pick up or drop another sprite
@@ -230,6 +591,35 @@ def key_presses(interact_key_pressed):
         mine.player.drop_sprite()
 
 
+@functools.lru_cache()
+def ladder_exit_masks(height):
+    """
+    Create masks covering the pixels that must all be free (white in the room layout) for a climbing sprite to be
+    able to exit a ladder. That is the top and bottom rows, both diagonals and the outer vertical line of the area
+    next to the sprite.
+
+    - height -- (Integer. Mandatory) The height of the climbing sprite
+
+    Returns: Tuple. The masks for exiting to the left and to the right. The left mask goes SPRITE_SIZE[0] pixels to the
+        left of the sprite's horizontal center and the right mask at the center. Both go at the top of the sprite.
+    """
+    width = SPRITE_SIZE[0]
+    left = pygame.mask.Mask((width, height))
+    right = pygame.mask.Mask((width + 1, height))
+    for i in range(width):
+        for m in (left, right):
+            m.set_at((i, 0))
+            m.set_at((i, height - 1))
+    for i in range(min(width, height - 1)):
+        for m in (left, right):
+            m.set_at((i, i))
+            m.set_at((i, height - 1 - i))
+    for i in range(height - 1):
+        left.set_at((0, i))
+        right.set_at((width, i))
+    return left, right
+
+
 def load_db(database):
     """
     Read a json file and return as dict
@@ -242,6 +632,69 @@ def load_db(database):
         return json.loads(f.read())
 
 
+@functools.lru_cache(maxsize=None)
+def load_font(size):
+    """
+    Load the font used for on-screen texts. All texts of the same size share the font.
+
+    - size -- (Integer. Mandatory) The font size
+
+    Returns: pygame.font.Font
+    """
+    default_font = "comicsansms"
+    font_name = default_font if default_font in pygame.font.get_fonts() else "freesansbold.ttf"
+    font = pygame.font.SysFont(font_name, size)
+    font.set_bold(True)
+    return font
+
+
+@functools.lru_cache(maxsize=None)
+def load_glyph_atlas(size):
+    """
+    Get the glyph atlas for the on-screen texts of a certain size
+
+    - size -- (Integer. Mandatory) The font size
+
+    Returns: GlyphAtlas
+    """
+    return GlyphAtlas(load_font(size))
+
+
+def load_image(path, size=None):
+    """
+    Load an image, convert it to the pixel format of the screen and optionally scale it. The result is kept in an
+    on-disk cache keyed on the content of the image file, the size and the pixel format so that the next time the
+    image is loaded the decoding and scaling is skipped. Images that have been prefetched (see prefetch_images) are
+    picked up from the loader thread pool. Requires the screen to be set up.
+
+    - path -- (String. Mandatory) The image file
+    - size -- (Tuple. Optional. Defaults to None) The size to scale the image to. Not scaled if not provided.
+
+    Returns: pygame.Surface
+    """
+    future = image_futures.pop((path, size), None)
+    cached, image, is_cached = future.result() if future else decode_image(path, size)
+    image = image.convert()
+
+    # The cache is only a speed-up so the game can run without it, e.g. from a read-only folder
+    try:
+        if is_cached:
+            # Touch the file so that the least recently used files are evicted first
+            os.utime(cached)
+        elif ASSET_CACHE_MAX_MB:
+            # Every writer has its own temporary file so that processes that cache the same image at the same time,
+            # e.g. batch workers, don't write into each other's files
+            os.makedirs(Folder.ASSET_CACHE, exist_ok=True)
+            descriptor, temporary = tempfile.mkstemp(suffix=".tmp", dir=Folder.ASSET_CACHE)
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(struct.pack("<II", *image.get_size()))
+                file.write(pygame.image.tostring(image, ASSET_CACHE_FORMAT))
+            os.replace(temporary, cached)
+    except OSError:
+        pass
+    return image
+
+
 def load_images(animation, sprite_name, multiply_x_by=1, multiply_y_by=1):
     """
     Read all image files in a folder and return as a list of pyGame images
@@ -252,85 +705,380 @@ def load_images(animation, sprite_name, multiply_x_by=1, multiply_y_by=1):
         number
     - multiply_y_by -- (Integer. Optional. Defaults to 1) Multiply the vertical size of the image with the given number
 
-    Returns: List
+    Returns: List. One dictionary per animation frame holding a tuple (image, mask) for each horizontal direction so
+        that sprites never need to flip images or create masks while the game is running. The images are packed in the
+        sprite atlas and folders that are requested more than once with the same size are only loaded once.
     """
-    folder = {
-        Animation.CLIMBING: Folder.CLIMBING_IMGS.format(sprite_name),
-        Animation.CLIMBING_UP: Folder.CLIMBING_UP_IMGS.format(sprite_name),
-        Animation.CLIMBING_DOWN: Folder.CLIMBING_DOWN_IMGS.format(sprite_name),
-        Animation.CLIMBING_WITH_GOLD: Folder.CLIMBING_WITH_GOLD_IMGS.format(sprite_name),
-        Animation.FALLING: Folder.IDLE_IMGS.format(sprite_name),
-        Animation.IDLE: Folder.IDLE_IMGS.format(sprite_name),
-        Animation.IDLE_CLIMBING: Folder.IDLE_CLIMBING_IMGS.format(sprite_name),
-        Animation.IDLE_CLIMBING_WITH_GOLD: Folder.IDLE_CLIMBING_WITH_GOLD_IMGS.format(sprite_name),
-        Animation.IDLE_RIDING_ELEVATOR: Folder.IDLE_RIDING_ELEVATOR_IMGS.format(sprite_name),
-        Animation.IDLE_WITH_EMPTY_WHEELBARROW: Folder.IDLE_WITH_EMPTY_WHEELBARROW_IMGS.format(sprite_name),
-        Animation.IDLE_WITH_GOLD: Folder.IDLE_WITH_GOLD_IMGS.format(sprite_name),
-        Animation.IDLE_WITH_LOADED_01_WHEELBARROW: Folder.IDLE_WITH_LOADED_01_WHEELBARROW_IMGS.format(sprite_name),
-        Animation.IDLE_WITH_LOADED_02_WHEELBARROW: Folder.IDLE_WITH_LOADED_02_WHEELBARROW_IMGS.format(sprite_name),
-        Animation.IDLE_WITH_LOADED_03_WHEELBARROW: Folder.IDLE_WITH_LOADED_03_WHEELBARROW_IMGS.format(sprite_name),
-        Animation.LOADED_01: Folder.LOADED_01.format(sprite_name),
-        Animation.LOADED_02: Folder.LOADED_02.format(sprite_name),
-        Animation.LOADED_03: Folder.LOADED_03.format(sprite_name),
-        Animation.LOADED_04: Folder.LOADED_04.format(sprite_name),
-        Animation.LOADED_05: Folder.LOADED_05.format(sprite_name),
-        Animation.PASSED_OUT: Folder.PASSED_OUT_IMGS.format(sprite_name),
-        Animation.PUSHING_EMPTY_WHEELBARROW: Folder.PUSHING_EMPTY_WHEELBARROW_IMGS.format(sprite_name),
-        Animation.PUSHING_LOADED_01_WHEELBARROW: Folder.PUSHING_LOADED_01_WHEELBARROW_IMGS.format(sprite_name),
-        Animation.PUSHING_LOADED_02_WHEELBARROW: Folder.PUSHING_LOADED_02_WHEELBARROW_IMGS.format(sprite_name),
-        Animation.PUSHING_LOADED_03_WHEELBARROW: Folder.PUSHING_LOADED_03_WHEELBARROW_IMGS.format(sprite_name),
-        Animation.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW:
-            Folder.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW_IMGS.format(sprite_name),
-        Animation.RIDING_ELEVATOR_WITH_GOLD: Folder.RIDING_ELEVATOR_WITH_GOLD_IMGS.format(sprite_name),
-        Animation.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW:
-            Folder.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW_IMGS.format(sprite_name),
-        Animation.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW:
-            Folder.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW_IMGS.format(sprite_name),
-        Animation.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW:
-            Folder.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW_IMGS.format(sprite_name),
-        Animation.WALKING: Folder.WALKING_IMGS.format(sprite_name),
-        Animation.WALKING_WITH_GOLD: Folder.WALKING_WITH_GOLD_IMGS.format(sprite_name)}[animation]
-    size = (SPRITE_SIZE[0] * multiply_x_by, SPRITE_SIZE[1] * multiply_y_by)
+    folder, size, files = animation_files(animation, sprite_name, multiply_x_by, multiply_y_by)
     if not os.path.exists(folder):
         return
-    return [pygame.transform.scale(pygame.image.load(folder + i).convert(), size) for i in os.listdir(folder)]
+    if (folder, size) not in atlas.animations:
+        prefetch_images([(f, size) for f in files])
+        frames = []
+        for f in files:
+            image = load_image(f, size)
+            right = atlas.add(image)
+            right.set_colorkey(Color.WHITE)
+            left = atlas.add(pygame.transform.flip(image, True, False))
+            left.set_colorkey(Color.WHITE)
+            frames.append({
+                Direction.RIGHT: (right, pygame.mask.from_surface(right)),
+                Direction.LEFT: (left, pygame.mask.from_surface(left))})
+        atlas.animations[(folder, size)] = frames
+    return atlas.animations[(folder, size)]
+
+
+def load_sprite_animations():
+    """
+    Set up the registry of the animations of all sprites. For each sprite and activity it holds the arguments for
+    load_images (except the sprite name) but no images are loaded until a sprite needs them.
+
+    Returns: SpriteAnimations
+    """
+    return SpriteAnimations({
+        SpriteName.ELEVATOR: {
+            Activity.IDLE: (Animation.IDLE,)},
+        SpriteName.GOLD: {
+            Activity.IDLE: (Animation.IDLE,),
+            Activity.FALLING: (Animation.IDLE,)},
+        SpriteName.MINER: {
+            Activity.CLIMBING: (Animation.CLIMBING,),
+            Activity.FALLING: (Animation.IDLE,),
+            Activity.IDLE: (Animation.IDLE,),
+            Activity.PASSED_OUT: (Animation.PASSED_OUT,),
+            Activity.WALKING: (Animation.WALKING,)},
+        SpriteName.PLAYER: {
+            Activity.CLIMBING: (Animation.CLIMBING,),
+            Activity.CLIMBING_WITH_GOLD: (Animation.CLIMBING_WITH_GOLD,),
+            Activity.FALLING: (Animation.IDLE,),
+            Activity.FALLING_WITH_GOLD: (Animation.IDLE_WITH_GOLD,),
+            Activity.FALLING_WITH_EMPTY_WHEELBARROW: (Animation.IDLE_WITH_EMPTY_WHEELBARROW, 2),
+            Activity.FALLING_WITH_LOADED_01_WHEELBARROW: (Animation.IDLE_WITH_LOADED_01_WHEELBARROW, 2),
+            Activity.FALLING_WITH_LOADED_02_WHEELBARROW: (Animation.IDLE_WITH_LOADED_02_WHEELBARROW, 2),
+            Activity.FALLING_WITH_LOADED_03_WHEELBARROW: (Animation.IDLE_WITH_LOADED_03_WHEELBARROW, 2),
+            Activity.IDLE: (Animation.IDLE,),
+            Activity.IDLE_CLIMBING: (Animation.IDLE_CLIMBING,),
+            Activity.IDLE_CLIMBING_WITH_GOLD: (Animation.IDLE_CLIMBING_WITH_GOLD,),
+            Activity.IDLE_RIDING_ELEVATOR: (Animation.IDLE_RIDING_ELEVATOR,),
+            Activity.IDLE_WITH_EMPTY_WHEELBARROW: (Animation.IDLE_WITH_EMPTY_WHEELBARROW, 2),
+            Activity.IDLE_WITH_GOLD: (Animation.IDLE_WITH_GOLD,),
+            Activity.IDLE_WITH_LOADED_01_WHEELBARROW: (Animation.IDLE_WITH_LOADED_01_WHEELBARROW, 2),
+            Activity.IDLE_WITH_LOADED_02_WHEELBARROW: (Animation.IDLE_WITH_LOADED_02_WHEELBARROW, 2),
+            Activity.IDLE_WITH_LOADED_03_WHEELBARROW: (Animation.IDLE_WITH_LOADED_03_WHEELBARROW, 2),
+            Activity.PASSED_OUT: (Animation.PASSED_OUT,),
+            Activity.PUSHING_EMPTY_WHEELBARROW: (Animation.PUSHING_EMPTY_WHEELBARROW, 2),
+            Activity.PUSHING_LOADED_01_WHEELBARROW: (Animation.PUSHING_LOADED_01_WHEELBARROW, 2),
+            Activity.PUSHING_LOADED_02_WHEELBARROW: (Animation.PUSHING_LOADED_02_WHEELBARROW, 2),
+            Activity.PUSHING_LOADED_03_WHEELBARROW: (Animation.PUSHING_LOADED_03_WHEELBARROW, 2),
+            Activity.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW: (Animation.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW,),
+            Activity.RIDING_ELEVATOR_WITH_GOLD: (Animation.RIDING_ELEVATOR_WITH_GOLD,),
+            Activity.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW: (
+                Animation.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW,),
+            Activity.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW: (
+                Animation.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW,),
+            Activity.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW: (
+                Animation.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW,),
+            Activity.WALKING: (Animation.WALKING,),
+            Activity.WALKING_WITH_GOLD: (Animation.WALKING_WITH_GOLD,)},
+        SpriteName.TRUCK: {
+            Activity.IDLE: (Animation.IDLE, 4, 4),
+            Activity.LOADED_01: (Animation.LOADED_01, 4, 4),
+            Activity.LOADED_02: (Animation.LOADED_02, 4, 4),
+            Activity.LOADED_03: (Animation.LOADED_03, 4, 4),
+            Activity.LOADED_04: (Animation.LOADED_04, 4, 4),
+            Activity.LOADED_05: (Animation.LOADED_05, 4, 4)},
+        SpriteName.WARNING: {
+            Activity.CLIMBING_UP: (Animation.CLIMBING_UP,),
+            Activity.CLIMBING_DOWN: (Animation.CLIMBING_DOWN,),
+            Activity.WALKING: (Animation.WALKING,)},
+        SpriteName.WHEELBARROW: {
+            Activity.IDLE: (Animation.IDLE, 2),
+            Activity.FALLING: (Animation.IDLE, 2),
+            Activity.LOADED_01: (Animation.LOADED_01, 2),
+            Activity.LOADED_02: (Animation.LOADED_02, 2),
+            Activity.LOADED_03: (Animation.LOADED_03, 2)}})
+
+
+@functools.lru_cache(maxsize=None)
+def load_static_image(path):
+    """
+    Load the image of a static sprite, e.g. a ladder or an exit. Static sprites never change their image so all sprites
+    with the same image share it.
+
+    - path -- (String. Mandatory) The image file
+
+    Returns: pygame.Surface
+    """
+    return load_image(path)
+
+
+def main(
+        frames=None, headless=False, dirty_rects=DIRTY_RECTS, recorder=None, replay=None, tracer=None, save_path=None):
+    """
+    Run the main loop
+
+    - frames -- (Integer. Optional. Defaults to None) Quit after the given number of frames. If not provided the game
+        runs until the user quits.
+    - headless -- (Boolean. Optional. Defaults to False) Run without drawing anything to the screen and without
+        waiting for the user. The game quits when the mine is completed or the game is over.
+    - dirty_rects -- (Boolean. Optional. Defaults to DIRTY_RECTS constant value) Only redraw and update the parts of
+        the screen that have changed instead of flipping the whole screen every frame
+    - recorder -- (InputLog. Optional. Defaults to None) Record the player's input in every simulation step
+    - replay -- (InputLog. Optional. Defaults to None) Play a recorded session back instead of reading the keyboard.
+        The game goes on to the next mine or starts over by itself and quits when the log ends.
+    - tracer -- (StateTrace. Optional. Defaults to None) Write a hash of the world state after every simulation step
+    - save_path -- (String. Optional. Defaults to None) Save the game to this file every AUTOSAVE_INTERVAL_MS of game
+        time and when the game quits. The file is deleted when the game is over.
+
+    Returns: None
+    """
+    display.dirty_rects = dirty_rects
+    game_is_running = True
+    game_is_paused = False
+    show_start_screen = SHOW_START_SCREEN and not headless and not replay
+    replay_input = replay.replay() if replay else None
+    if replay and replay.mine != mine.mine:
+        mine.reset(replay.mine)
+    frame = 0
+    steps = 0
+    lag_ms = 0
+    next_save_ms = clock.get_ticks() + AUTOSAVE_INTERVAL_MS
+    interact_key_pending = False
+    start_time = time.perf_counter()
+
+    while game_is_running and (frames is None or frame < frames):
+
+        # Wait for the next display frame. Running headless, every frame simulates exactly one step.
+        elapsed_ms = clock.step_ms if headless else clock.wait(RENDER_FPS)
+        frame += 1
+        player_pressed_interact_key = False
+        player_pressed_any_key = False
+        mine.score = int((mine.seconds_remaining * mine.player.lives * mine.bonus))
+
+        # Read events
+        for event in pygame.event.get():
+
+            # Check for quit or pause game request from user
+            game_is_running = \
+                not (event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE))
+            game_is_paused = (not game_is_paused) and (event.type == pygame.KEYUP and event.key == pygame.K_p)
+
+            # Check for specific key presses
+            l_control = event.type == pygame.KEYUP and event.key == pygame.K_LCTRL
+            l_alt = event.type == pygame.KEYUP and event.key == pygame.K_LALT
+            space = event.type == pygame.KEYUP and event.key == pygame.K_SPACE
+            r_control = event.type == pygame.KEYUP and event.key == pygame.K_RCTRL
+            r_alt = event.type == pygame.KEYUP and event.key == pygame.K_RALT
+            player_pressed_interact_key = any((l_control, l_alt, space, r_control, r_alt))
+            player_pressed_any_key = event.type == pygame.KEYDOWN
+
+        # Pause game
+        if game_is_paused:
+            if display.show_overlay(paused):
+                screen.blit(paused.text, paused.rect)
+                pygame.display.flip()
+            continue
+
+        # Check if player has collected all the gold in the mine. Get the next mine ready while waiting for the player.
+        if mine.is_completed():
+            if headless and not replay:
+                break
+            mine.prepare(mine.next_mine())
+            if player_pressed_any_key or replay:
+                mine.next()
+            continue
+
+        # Open the start screen
+        if show_start_screen:
+            show_start_screen = not player_pressed_any_key
+            start_screen()
+            continue
+
+        # Check if time is up or player has no lives left. A lost game can't be resumed so its save is deleted.
+        if mine.is_game_over():
+            if save_path and os.path.exists(save_path):
+                os.remove(save_path)
+            if headless and not replay:
+                break
+            game_over()
+            if player_pressed_any_key or replay:
+                mine.reset(START_MINE)
+            continue
+
+        # Check if the player has completed the whole game
+        if mine.is_game_completed():
+            if player_pressed_any_key or replay:
+                mine.scores = {}
+                mine.game_completed = False
+                show_start_screen = not replay
+            continue
+
+        # Catch up with the time passed in fixed steps. Skip drawing up to MAX_FRAME_SKIP steps if the computer is too
+        # slow, and let the game slow down beyond that. An interact key press is kept until a step has used it.
+        lag_ms = min(lag_ms + elapsed_ms, clock.step_ms * MAX_FRAME_SKIP)
+        interact_key_pending = interact_key_pending or player_pressed_interact_key
+        while lag_ms >= clock.step_ms and not mine.is_game_over() and mine.gold_delivered < mine.no_of_gold_sacks:
+
+            # Take the input from the recorded session if there is one, else from the keyboard
+            if replay:
+                key_press, interact_key_pending = next(replay_input, (None, False))
+                if key_press is None:
+                    game_is_running = False
+                    break
+            else:
+                key_press = pygame.key.get_pressed()
+            if recorder:
+                recorder.record(key_press, interact_key_pending)
+
+            display.remember_positions(mine.moving_sprites + [mine.players, mine.elevators])
+            simulate(interact_key_pending, key_press)
+            steps += 1
+            if tracer:
+                tracer.write()
+            interact_key_pending = False
+            lag_ms -= clock.step_ms
+
+        # Save the game now and then so that it can be resumed if the game crashes
+        if save_path and clock.get_ticks() >= next_save_ms:
+            mine.save(save_path)
+            next_save_ms = clock.get_ticks() + AUTOSAVE_INTERVAL_MS
+
+        # Nothing needs to be drawn when running headless
+        if headless:
+            continue
+
+        # Draw background, walls and static sprites. Moving sprites are drawn part of the way to the next step.
+        display.progress = lag_ms / clock.step_ms
+        display.draw_background(mine.static_layer)
+
+        # Draw sprites
+        for s in mine.moving_sprites:
+            display.draw(s)
+        display.draw(warnings)
+        display.draw(mine.players)
+        display.draw(mine.elevators)
+
+        # Draw text
+        display.blit(lives.update(mine.player.lives), lives.rect)
+        display.blit(gold_delivered.update(mine.gold_delivered, mine.no_of_gold_sacks), gold_delivered.rect)
+        display.blit(seconds_left.update(int(mine.seconds_remaining)), seconds_left.rect)
+        display.blit(bonus.update(mine.bonus), bonus.rect)
+        display.blit(title.text, title.rect)
+        display.blit(mine_no.update(mine.mine), mine_no.rect)
+
+        # Update the screen
+        display.update()
+
+    if save_path and not mine.is_game_over():
+        mine.save(save_path)
+    elif save_path and os.path.exists(save_path):
+        os.remove(save_path)
+
+    if headless:
+        print(
+            f"Simulated {steps} frames ({clock.get_ticks() / 1000:.1f} s of game time) in "
+            f"{time.perf_counter() - start_time:.2f} s. Gold delivered: {mine.gold_delivered}/{mine.no_of_gold_sacks}. "
+            f"Time left: {int(mine.seconds_remaining)} s. Lives: {mine.player.lives}.")
+
+
+@functools.lru_cache(maxsize=None)
+def mask_runs(mask, vertical):
+    """
+    Find the runs of set pixels in every column or row of a mask
+
+    - mask -- (pygame.mask.Mask. Mandatory) The mask
+    - vertical -- (Boolean. Mandatory) Find the runs in the columns if True, else in the rows
+
+    Returns: Tuple. (numpy.ndarray of the columns or rows of the runs, numpy.ndarray of where they start, numpy.ndarray
+        of where they end). The ends are inclusive.
+    """
+    pixels = mask_to_array(mask)
+    edges = numpy.diff(numpy.pad(pixels if vertical else pixels.T, ((0, 0), (1, 1))).astype(numpy.int8), axis=1)
+    lines, starts = numpy.nonzero(edges == 1)
+    ends = numpy.nonzero(edges == -1)[1] - 1
+    return lines, starts, ends
 
 
-def move_sprites():
+def mask_to_array(mask):
     """
-    Iterate though all rooms in the mine, move the miners and apply gravity to all applicable sprites
+    Copy a mask to a NumPy array
+
+    - mask -- (pygame.mask.Mask. Mandatory) The mask
+
+    Returns: numpy.ndarray. Booleans indexed by [x, y].
+    """
+    return pygame.surfarray.array_red(mask.to_surface()).astype(bool)
+
+
+def move_sprites(min_batch=GRAVITY_BATCH_MIN_SPRITES):
+    """
+    Iterate though all rooms in the mine, move the miners and apply gravity to all applicable sprites. The rooms the
+    player isn't in are simulated with a coarser time step: they take turns to be moved every LOD_INTERVAL frames and
+    then catch up on all the frames since they were moved last. Gold sacks, trucks and wheelbarrows are moved as far as
+    in all those frames in one go, while miners and elevators are moved one frame at a time so that they make the same
+    decisions as in the room the player is in. The warnings are only looked for once per turn. The room the player
+    enters catches up on the first frame the player is in it.
+
+    - min_batch -- (Number. Optional. Defaults to GRAVITY_BATCH_MIN_SPRITES) Apply gravity in one pass in rooms with at
+        least this many gold sacks, trucks and wheelbarrows
     """
 
+    # Fire the timers that are up, e.g. wake up passed out sprites
+    timers.run()
+
     # Remember original room, i.e. the room where the player is
     original_room = mine.room
+    mine.frame += 1
 
     # Start iteration
     for ro in range(1, mine.no_of_rooms + 1):
 
+        # Skip rooms the player isn't in until it's their turn
+        mine.rooms[str(ro)]["frames_behind"] += 1
+        if ro != original_room and (mine.frame + ro) % LOD_INTERVAL:
+            continue
+        steps = mine.rooms[str(ro)]["frames_behind"]
+        mine.rooms[str(ro)]["frames_behind"] = 0
+
         # Change room temporarily
         mine.set(mine_=mine.mine, room_=ro)
 
-        # Apply gravity to all sprites. This will also update sprite animations.
-        for sp in mine.affected_by_gravity + ([mine.players] if mine.room == original_room else []):
-            for spr in sp.sprites():
+        # Gold sacks, trucks and wheelbarrows make no decisions so in a room that is behind they are moved as far as in
+        # all the frames since it was moved last in one go. The swept moves find where they land on the way. Miners
+        # and elevators decide where to go in every frame so they are moved one frame at a time, gravity first.
+        for step in range(steps):
+
+            # In rooms with many sprites that can't climb, e.g. gold sacks, gravity is applied to all of them in one
+            # pass and only the ones the pass leaves out are moved one by one below
+            if step:
+                sprites = mine.miners.sprites()
+            elif numpy and len(mine.passive_sprites) >= min_batch:
+                sprites = mine.miners.sprites() + mine.passive_sprites.apply_gravity(steps)
+            else:
+                sprites = [spr for sp in mine.affected_by_gravity for spr in sp.sprites()]
+            sprites += mine.players.sprites() if mine.room == original_room and not step else []
+
+            # Apply gravity to all sprites. This will also update sprite animations.
+            for spr in sprites:
                 not_climbing_ladder = not (spr.can_climb_ladders and spr.collides(mine.ladders))
                 cant_climb_ladder = not spr.can_climb_ladders
                 is_passed_out = spr.is_passed_out()
                 apply_gravity = \
                     not spr.is_riding_elevator and (not_climbing_ladder or cant_climb_ladder or is_passed_out)
+                scale = 1 if spr.is_player or spr.is_miner else steps
                 if apply_gravity:
-                    spr.move(Direction.DOWN, GRAVITY)
+                    spr.move(Direction.DOWN, GRAVITY * scale)
                     if spr.is_falling():
-                        spr.move(spr.h_direction, HORIZONTAL_FALL_SPEED)
+                        spr.move(spr.h_direction, HORIZONTAL_FALL_SPEED * scale)
                 else:
                     spr.update()
 
-        # Move computer controlled sprites
-        for m in mine.miners.sprites() + mine.elevators.sprites():
-            m.move_cc()
+            # Move computer controlled sprites
+            for m in mine.miners.sprites() + mine.elevators.sprites():
+                m.move_cc()
 
-        # Check if a sprite collides with an exit point to another room
-        exit_room(mine.exits.sprites(), mine.miners.sprites())
+            # Check if a sprite collides with an exit point to another room
+            exit_room(mine.exits.sprites(), mine.miners.sprites())
 
         # Check if miner is close to an exit point leading to the same room as the player and if so present a warning
         for ex, mi in itertools.product(mine.exits.sprites(), mine.miners.sprites()):
@@ -372,64 +1120,328 @@ def move_sprites():
     mine.set(mine_=mine.mine, room_=original_room)
 
 
-def start_screen():
-    """Display the start screen"""
-    screen.blit(mine.background_img, (0, 0))
-    screen.blit(start_screen_01.text, start_screen_01.rect)
-    screen.blit(start_screen_02.text, start_screen_02.rect)
-    pygame.display.flip()
+def parse_arguments():
+    """
+    Parse the command line arguments
 
+    Returns: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(description="Gold Thief")
+    parser.add_argument(
+        "--headless", action="store_true",
+        help="Run without a window, as fast as possible and with a fixed time step of 1/FPS seconds per frame")
+    parser.add_argument(
+        "--frames", type=int, default=None, help="Quit after the given number of frames")
+    parser.add_argument(
+        "--seed", type=int, default=None, help="Seed the random number generator to make a run reproducible")
+    parser.add_argument(
+        "--clear-cache", action="store_true", help="Delete the cached images in the asset cache folder and quit")
+    parser.add_argument(
+        "--dirty-rects", action="store_true", default=DIRTY_RECTS,
+        help="Only redraw the parts of the screen that have changed instead of the whole screen every frame")
+    parser.add_argument(
+        "--check-mines", action="store_true",
+        help="Report gold sacks and trucks the player can't reach in any of the mines and quit")
+    parser.add_argument(
+        "--record", default=None, metavar="FILE",
+        help="Record the input in every frame and the random seed to a file so that the session can be replayed")
+    parser.add_argument(
+        "--replay", default=None, metavar="FILE",
+        help="Play a recorded session back, in real time or with --headless as fast as possible")
+    parser.add_argument(
+        "--trace", default=None, metavar="FILE",
+        help="Write a hash of the world state in every frame to a file, e.g. to check that a change doesn't change how "
+             "a replay plays out")
+    parser.add_argument(
+        "--compare-traces", nargs=2, default=None, metavar="FILE",
+        help="Report the first frame and the fields where two world state traces differ and quit")
+    parser.add_argument(
+        "--save", default=None, metavar="FILE",
+        help="Save the game to a file every AUTOSAVE_INTERVAL_MS of game time and when the game quits")
+    parser.add_argument(
+        "--resume", default=None, metavar="FILE", help="Resume a game saved with --save")
+    parser.add_argument(
+        "--batch", type=int, default=None, metavar="RUNS",
+        help="Play through the start mine headless the given number of times in parallel, with the seeds --seed, "
+             "--seed + 1 and so on, and report the results")
+    parser.add_argument(
+        "--benchmark-gravity", type=int, default=None, metavar="SPRITES",
+        help="Time the start mine headless with the given number of gold sacks, trucks and wheelbarrows in every room, "
+             "with gravity applied to them one at a time and in one pass, and quit")
+    parser.add_argument(
+        "--check-determinism", action="store_true",
+        help="Play the run of --seed twice in one process, report whether the results are the same and quit")
+    parser.add_argument(
+        "--policy", choices=(Policy.IDLE, Policy.RANDOM), default=Policy.RANDOM,
+        help="How the player is controlled in batch runs")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="The number of worker processes for batch runs. Defaults to the "
+                                                  "number of CPUs.")
+    arguments = parser.parse_args()
+
+    # A recorded session is played from the start mine so it can't start from a saved game
+    if arguments.resume and (arguments.record or arguments.replay):
+        parser.error("--resume can't be combined with --record or --replay")
+    return arguments
+
+
+def percentile(histogram, p):
+    """
+    Find a percentile of frame times
 
-# Classes
-class Mines(object):
-    """Class for loading all room layouts in a mine (level) and it's sprites"""
+    - histogram -- (collections.Counter. Mandatory) The number of frames per frame time, in tenths of milliseconds
+    - p -- (Number. Mandatory) The percentile, 0-100
 
-    def __init__(self):
+    Returns: Float. The frame time in milliseconds. 0 if there are no frames.
+    """
+    count = 0
+    rank = sum(histogram.values()) * p / 100
+    for tenths in sorted(histogram):
+        count += histogram[tenths]
+        if count >= rank:
+            return tenths / 10
+    return 0.0
 
-        self.mine = None
-        self.room = None
-        self.database = None
-        self.rooms = {}
-        self.background_img = None
-        self.layout = None
-        self.layouts = None
-        self.layout_img = None
-        self.layout_sprite = None
-        self.texture = None
-        self.texture_img = None
-        self.no_of_gold_sacks = 0
-        self.players = None
-        self.player = None
-        self.miners = None
-        self.gold_sacks = None
-        self.ladders = None
-        self.trucks = None
-        self.wheelbarrows = None
-        self.exits = None
-        self.elevators = None
-        self.elevator_shafts = None
-        self.all_sprites = None
-        self.not_player = None
-        self.affected_by_gravity = None
-        self.gold_delivered = 0
-        self.no_of_rooms = 0
-        self.time_limit_mins = 0
-        self.seconds_remaining = 0
-        self.bonus = 0
-        self.score = 0
-        self.tot_number_of_mines = range(1, len(os.listdir(Folder.MINES))+1)
-        self.game_completed = False
-        self.total_score = []
-        self.scores = {}
 
-    def set(self, mine_, room_):
-        """
-        Set what mine and room is currently displayed on screen
+def play(seed, policy=None, frames=None):
+    """
+    Play through the start mine headless, as fast as possible, with the player controlled by an input policy
 
-        - mine -- (Integer. Mandatory) The requested mine
-        - room_ -- (Integer. Mandatory) The requested room
+    - seed -- (Integer. Mandatory) Seed the random number generators of the game and the policy
+    - policy -- (String. Optional. Defaults to Policy.RANDOM) How the player is controlled. Use Policy enum.
+    - frames -- (Integer. Optional. Defaults to None) Stop after the given number of frames. If not provided the run
+        goes on until the mine is completed or the game is over.
 
-        returns: None
+    Returns: Dict. The result of the run: seed, gold_delivered, no_of_gold_sacks, times_caught, seconds_remaining,
+        lives, frames and frame_times, the number of frames per frame time in tenths of milliseconds
+    """
+    mine.reset(START_MINE)
+    warnings.empty()
+    random.seed(seed)
+    frame_times = collections.Counter()
+    frame = 0
+    for key_press, interact_key_pressed in input_policy(policy or Policy.RANDOM, seed):
+        if mine.is_game_over() or mine.gold_delivered >= mine.no_of_gold_sacks or frame == frames:
+            break
+        start_time = time.perf_counter()
+        simulate(interact_key_pressed, key_press)
+        frame_times[round((time.perf_counter() - start_time) * 10000)] += 1
+        frame += 1
+    return {
+        "seed": seed, "gold_delivered": mine.gold_delivered, "no_of_gold_sacks": mine.no_of_gold_sacks,
+        "times_caught": mine.times_caught, "seconds_remaining": mine.seconds_remaining, "lives": mine.player.lives,
+        "frames": frame, "frame_times": frame_times}
+
+
+def play_run(run):
+    """
+    Play a run in a batch worker process. See batch.
+
+    - run -- (Tuple. Mandatory) The arguments of play: (seed, policy, frames)
+
+    Returns: Dict. See play.
+    """
+    return play(*run)
+
+
+def prefetch_images(requests):
+    """
+    Start decoding images in the loader thread pool. Image decoding releases the GIL so the images are decoded in
+    parallel while the main thread goes on. load_image picks up the results.
+
+    - requests -- (Iterable. Mandatory) Tuples (image file, size) with the same arguments as for load_image
+
+    Returns: None
+    """
+    for path, size in requests:
+        if (path, size) not in image_futures:
+            image_futures[(path, size)] = loader.submit(decode_image, path, size)
+
+
+def setup(headless=False, seed=None, resume=None):
+    """
+    Initialize PyGame, set up the screen and load the start mine, which loads the animations of its sprites
+
+    - headless -- (Boolean. Optional. Defaults to False) Don't open a window
+    - seed -- (Integer. Optional. Defaults to None) Seed the random number generator
+    - resume -- (String. Optional. Defaults to None) Resume a game saved to this file instead of loading the start mine.
+        The start mine is loaded if the file doesn't exist, e.g. because the saved game is over.
+
+    Returns: None
+    """
+    global screen
+
+    # A dummy video driver needs to be selected before PyGame is initialized
+    if headless:
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+    pygame.init()
+
+    # Make sure we get the right screen resolution
+    if hasattr(ctypes, "windll"):
+        ctypes.windll.user32.SetProcessDPIAware()
+
+    # Setup screen
+    screen = pygame.display.set_mode(SCREEN_SIZE)
+
+    if seed is not None:
+        random.seed(seed)
+
+    if resume and os.path.exists(resume):
+        mine.resume(resume)
+    else:
+        mine.set(START_MINE, 1)
+
+
+def simulate(interact_key_pressed, key_press=None, min_batch=GRAVITY_BATCH_MIN_SPRITES):
+    """
+    Simulate one fixed time step of the game
+
+    - interact_key_pressed -- (Boolean. Mandatory) True if the player has pressed an interact key
+    - key_press -- (Sequence. Optional. Defaults to the keyboard state) The state of all keys, indexed by key
+    - min_batch -- (Number. Optional. Defaults to GRAVITY_BATCH_MIN_SPRITES) Apply gravity in one pass in rooms with at
+        least this many gold sacks, trucks and wheelbarrows. See move_sprites.
+
+    Returns: None
+    """
+    clock.tick()
+
+    # Read key presses and move the player
+    key_presses(interact_key_pressed, key_press)
+
+    # Move miners and apply gravity to all applicable sprites
+    move_sprites(min_batch)
+
+    # Check if the player is caught by a miner
+    get_caught()
+
+    # Check if the player exits the room
+    exit_room(mine.exits.sprites(), mine.players.sprites())
+
+    # Check if a miner is hit by a falling gold sack
+    hit_miner()
+
+    # Update remaining time
+    mine.seconds_remaining -= clock.get_time() / 1000
+
+
+def start_screen():
+    """Display the start screen"""
+    if not display.show_overlay(start_screen_01):
+        return
+    screen.blit(mine.background_img, (0, 0))
+    screen.blit(start_screen_01.text, start_screen_01.rect)
+    screen.blit(start_screen_02.text, start_screen_02.rect)
+    pygame.display.flip()
+
+
+@functools.lru_cache(maxsize=1024)
+def swept_mask(mask, x, y, pix):
+    """
+    Create a mask covering every position of another mask as it moves pixel by pixel in a straight line
+
+    - mask -- (pygame.mask.Mask. Mandatory) The mask to sweep
+    - x -- (Integer. Mandatory) Horizontal movement per pixel. -1, 0 or 1.
+    - y -- (Integer. Mandatory) Vertical movement per pixel. -1, 0 or 1.
+    - pix -- (Integer. Mandatory) The number of pixels to move
+
+    Returns: pygame.mask.Mask. Positioned relative to the start position of the swept mask by
+        (min(x, x * pix), min(y, y * pix))
+    """
+    width, height = mask.get_size()
+    swept = pygame.mask.Mask((width + abs(x) * (pix - 1), height + abs(y) * (pix - 1)))
+    for n in range(1, pix + 1):
+        swept.draw(mask, (x * n - min(x, x * pix), y * n - min(y, y * pix)))
+    return swept
+
+
+def trim_asset_cache(max_mb=ASSET_CACHE_MAX_MB):
+    """
+    Delete the least recently used images in the asset cache until it is within its size limit. Files that other
+    processes delete at the same time are skipped.
+
+    - max_mb -- (Integer. Optional. Defaults to ASSET_CACHE_MAX_MB) The size limit in megabytes
+
+    Returns: None
+    """
+    if not max_mb or not os.path.exists(Folder.ASSET_CACHE):
+        return
+    files = []
+    for file_name in os.listdir(Folder.ASSET_CACHE):
+        try:
+            stat = os.stat(Folder.ASSET_CACHE + file_name)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, Folder.ASSET_CACHE + file_name))
+    files.sort()
+    size = sum(file_size for _, file_size, _ in files)
+    while files and size > max_mb * 1024 * 1024:
+        _, file_size, path = files.pop(0)
+        size -= file_size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+# Classes
+class Mines(object):
+    """Class for loading all room layouts in a mine (level) and it's sprites"""
+
+    def __init__(self):
+
+        self.mine = None
+        self.room = None
+        self.database = None
+        self.rooms = {}
+        self.background_img = None
+        self.layout = None
+        self.layout_img = None
+        self.walls = None
+        self.ladder_exits = None
+        self.ladder_exits_cache = {}
+        self.navigation = None
+        self.navigation_cache = {}
+        self.prepared = {}
+        self.texture = None
+        self.texture_img = None
+        self.static_layer = None
+        self.passive_sprites = None
+        self.no_of_gold_sacks = 0
+        self.players = None
+        self.player = None
+        self.miners = None
+        self.gold_sacks = None
+        self.ladders = None
+        self.trucks = None
+        self.wheelbarrows = None
+        self.exits = None
+        self.elevators = None
+        self.elevator_shafts = None
+        self.all_sprites = None
+        self.moving_sprites = None
+        self.not_player = None
+        self.affected_by_gravity = None
+        self.gold_delivered = 0
+        self.no_of_rooms = 0
+        self.time_limit_mins = 0
+        self.seconds_remaining = 0
+        self.bonus = 0
+        self.times_caught = 0
+        self.frame = 0
+        self.score = 0
+        self.tot_number_of_mines = range(1, len(os.listdir(Folder.MINES))+1)
+        self.game_completed = False
+        self.total_score = []
+        self.scores = {}
+
+    def set(self, mine_, room_):
+        """
+        Set what mine and room is currently displayed on screen
+
+        - mine -- (Integer. Mandatory) The requested mine
+        - room_ -- (Integer. Mandatory) The requested room
+
+        returns: None
         """
 
         # Load a new mine if requested
@@ -442,8 +1454,10 @@ class Mines(object):
         self.layout = self.rooms[str(self.room)]["layout"]
         self.background_img = self.rooms[str(self.room)]["background_img"]
         self.layout_img = self.rooms[str(self.room)]["layout_img"]
-        self.layout_sprite = self.rooms[str(self.room)]["layout_sprite"]
-        self.layouts = self.rooms[str(self.room)]["layouts"]
+        self.static_layer = self.rooms[str(self.room)]["static_layer"]
+        self.walls = self.rooms[str(self.room)]["walls"]
+        self.passive_sprites = self.rooms[str(self.room)]["passive_sprites"]
+        self.ladder_exits = self.rooms[str(self.room)]["ladder_exits"]
         self.miners = self.rooms[str(self.room)]["miners"]
         self.gold_sacks = self.rooms[str(self.room)]["gold_sacks"]
         self.ladders = self.rooms[str(self.room)]["ladders"]
@@ -451,6 +1465,7 @@ class Mines(object):
         self.wheelbarrows = self.rooms[str(self.room)]["wheelbarrows"]
         self.exits = self.rooms[str(self.room)]["exits"]
         self.all_sprites = self.rooms[str(self.room)]["all_sprites"]
+        self.moving_sprites = self.rooms[str(self.room)]["moving_sprites"]
         self.not_player = self.rooms[str(self.room)]["not_player"]
         self.affected_by_gravity = self.rooms[str(self.room)]["affected_by_gravity"]
         self.player = self.rooms[str(self.room)]["player"] if not self.player else self.player
@@ -460,96 +1475,341 @@ class Mines(object):
 
     def load(self, mine_):
         """
-        Load all rooms in a mine (level)
+        Load all rooms in a mine (level). A mine that has been prepared in the background (see prepare) is used if
+        there is one, else the mine is loaded right away.
 
         - mine -- (Integer. Mandatory) The requested mine
 
         returns: None
         """
-        # Load mine database
+        prepared = self.prepared.pop(mine_, None)
+        if not isinstance(prepared, dict):
+            prepared = self.build(mine_, prepared.result() if prepared else self.read(mine_))
+
+        # Stop the timers of the sprites in the mine that is replaced
+        for r in self.rooms:
+            for group in self.rooms[r]["not_player"]:
+                for spr in group.sprites():
+                    spr.stop_timers()
+
         self.mine = mine_
-        self.database = load_db(FileName.MINE_DB.format(self.mine))
+        self.database = prepared["database"]
+        self.rooms = prepared["rooms"]
+        self.navigation = prepared["navigation"]
         self.gold_delivered = 0
         self.texture = Folder.TEXTURES + self.database["texture"]
         self.time_limit_mins = self.database["time_limit_mins"]
         self.seconds_remaining = self.time_limit_mins * 60
         self.bonus = 0
+        self.times_caught = 0
+        self.frame = 0
+        self.no_of_gold_sacks = len(flatten_list([
+            self.database["rooms"][r]["sprites"]["gold"] for r in self.database["rooms"]
+            if "gold" in self.database["rooms"][r]["sprites"]]))
+        self.no_of_rooms = len(self.database["rooms"])
+
+    def prepare(self, mine_):
+        """
+        Prepare a mine in the background so that a later load of it is instant. The database is read and the images
+        are decoded in the loader thread pool. Surfaces and sprites can only be created on the main thread so call this
+        repeatedly, e.g. once per frame, and the rest of the mine is built on the first call after the reading is done.
+
+        - mine -- (Integer. Mandatory) The mine to prepare
+
+        returns: None
+        """
+        prepared = self.prepared.get(mine_)
+        if prepared is None:
+            self.prepared[mine_] = loader.submit(self.read, mine_)
+        elif not isinstance(prepared, dict) and prepared.done():
+            self.prepared[mine_] = self.build(mine_, prepared.result())
+
+    def read(self, mine_):
+        """
+        Read a mine database and start decoding all images the mine needs. Safe to run in a worker thread.
+
+        - mine -- (Integer. Mandatory) The requested mine
+
+        returns: Dict. The mine database
+        """
+        database = load_db(FileName.MINE_DB.format(mine_))
+
+        # Start decoding the texture, all room layouts and the animations of the sprites used in the mine
+        prefetch_images([(Folder.TEXTURES + database["texture"], SCREEN_SIZE)] + [
+            (Folder.LAYOUTS + database["rooms"][r]["layout"], None) for r in database["rooms"]])
+        SPRITE_ANIMATIONS.prefetch(set(name for r in database["rooms"] for name in database["rooms"][r]["sprites"]))
+        return database
+
+    def build(self, mine_, database):
+        """
+        Create the surfaces, collision bitmaps and sprites of all rooms in a mine
+
+        - mine -- (Integer. Mandatory) The requested mine
+        - database -- (Dict. Mandatory) The mine database
+
+        returns: Dict. The database, the rooms and the navigation graph of the mine
+        """
+        # Load the animations of the sprites used in the mine up front so that they don't have to be loaded while
+        # playing
+        SPRITE_ANIMATIONS.preload(set(name for r in database["rooms"] for name in database["rooms"][r]["sprites"]))
 
         # Load layout for each room in the mine
         dark_overlay = pygame.Surface(SCREEN_SIZE, flags=pygame.SRCALPHA)
         dark_overlay.fill((90, 90, 90, 0))
-        for r in self.database["rooms"]:
-            self.rooms[r] = {}
-        for r in self.database["rooms"]:
-            self.rooms[r]["texture_img"] = pygame.image.load(self.texture)
-            self.rooms[r]["layout"] = Folder.LAYOUTS + self.database["rooms"][r]["layout"]
-            self.rooms[r]["background_img"] = pygame.image.load(self.texture)
-            self.rooms[r]["background_img"] = pygame.transform.scale(self.rooms[r]["texture_img"], SCREEN_SIZE)
-            self.rooms[r]["background_img"].blit(dark_overlay, (0, 0), special_flags=pygame.BLEND_RGBA_SUB)
-            self.rooms[r]["layout_img"] = pygame.image.load(self.rooms[r]["layout"]).convert()
-            self.rooms[r]["layout_img"].set_colorkey(Color.BLACK)
-            self.rooms[r]["texture_img"] = pygame.transform.scale(self.rooms[r]["texture_img"], SCREEN_SIZE)
-            self.rooms[r]["texture_img"].blit(self.rooms[r]["layout_img"], (0, 0))
-            self.rooms[r]["texture_img"].set_colorkey(Color.WHITE)
-            self.rooms[r]["layout_sprite"] = Sprite(SpriteName.LAYOUT, image=self.rooms[r]["layout"])
-            self.rooms[r]["layouts"] = pygame.sprite.Group()
-            self.rooms[r]["layouts"].add(self.rooms[r]["layout_sprite"])
-            self.no_of_gold_sacks = len(flatten_list([
-                self.database["rooms"][r]["sprites"]["gold"] for r in self.database["rooms"]
-                if "gold" in self.database["rooms"][r]["sprites"]]))
-            self.no_of_rooms = len(self.database["rooms"])
+        texture = load_image(Folder.TEXTURES + database["texture"], SCREEN_SIZE)
+        rooms = {r: {"frames_behind": 0} for r in database["rooms"]}
+        for r in database["rooms"]:
+            rooms[r]["layout"] = Folder.LAYOUTS + database["rooms"][r]["layout"]
+            rooms[r]["background_img"] = texture.copy()
+            rooms[r]["background_img"].blit(dark_overlay, (0, 0), special_flags=pygame.BLEND_RGBA_SUB)
+            rooms[r]["layout_img"] = load_image(rooms[r]["layout"])
+            rooms[r]["layout_img"].set_colorkey(Color.BLACK)
+            rooms[r]["texture_img"] = texture.copy()
+            rooms[r]["texture_img"].blit(rooms[r]["layout_img"], (0, 0))
+            rooms[r]["texture_img"].set_colorkey(Color.WHITE)
+
+            # Collision bitmap with one bit set for every pixel in the layout that isn't white, i.e. walls, floors and
+            # roofs. Sprites are tested against it with a single mask overlap.
+            rooms[r]["walls"] = pygame.mask.from_threshold(
+                rooms[r]["layout_img"], Color.WHITE, (1, 1, 1, 255))
+            rooms[r]["walls"].invert()
 
             # Load sprites
-            self.rooms[r]["players"] = self.generate_sprites(
-                r, SpriteName.PLAYER, animation_freq_ms=8, org_room_no=int(r))
-            self.rooms[r]["player"] = self.rooms[r]["players"].sprites()[0]
-            self.rooms[r]["miners"] = self.generate_sprites(
-                r, SpriteName.MINER, standard_speed=MINER_SPEED, animation_freq_ms=8, org_room_no=int(r))
-            self.rooms[r]["gold_sacks"] = self.generate_sprites(
-                r, SpriteName.GOLD, animation_freq_ms=500, org_room_no=int(r))
-            self.rooms[r]["ladders"] = self.generate_sprites(
-                r, SpriteName.LADDER, image=Folder.IDLE_IMGS.format(SpriteName.LADDER) + "001.png")
-            self.rooms[r]["elevator_shafts"] = self.generate_sprites(
-                r, SpriteName.ELEVATOR_SHAFT, image=Folder.IDLE_IMGS.format(SpriteName.ELEVATOR_SHAFT) + "001.png")
-            self.rooms[r]["trucks"] = self.generate_sprites(r, SpriteName.TRUCK, animation_freq_ms=100)
-            self.rooms[r]["wheelbarrows"] = self.generate_sprites(r, SpriteName.WHEELBARROW, org_room_no=int(r))
-            self.rooms[r]["exits"] = self.generate_sprites(
-                r, SpriteName.EXIT, image=Folder.IDLE_IMGS.format(SpriteName.EXIT) + "001.png")
-            self.rooms[r]["elevators"] = self.generate_sprites(
-                r, SpriteName.ELEVATOR, standard_speed=ELEVATOR_SPEED, org_room_no=int(r))
-            self.rooms[r]["all_sprites"] = [
-                self.rooms[r]["ladders"], self.rooms[r]["elevator_shafts"], self.rooms[r]["trucks"],
-                self.rooms[r]["gold_sacks"], self.rooms[r]["wheelbarrows"], self.rooms[r]["miners"]]
-            self.rooms[r]["not_player"] = (
-                self.rooms[r]["miners"], self.rooms[r]["gold_sacks"], self.rooms[r]["ladders"], self.rooms[r]["trucks"],
-                self.rooms[r]["wheelbarrows"], self.rooms[r]["elevator_shafts"], self.rooms[r]["elevators"])
-            self.rooms[r]["affected_by_gravity"] = [
-                self.rooms[r]["miners"], self.rooms[r]["gold_sacks"], self.rooms[r]["trucks"],
-                self.rooms[r]["wheelbarrows"]]
+            rooms[r]["players"] = self.generate_sprites(
+                database, r, SpriteName.PLAYER, animation_freq_ms=8, org_room_no=int(r))
+            rooms[r]["player"] = rooms[r]["players"].sprites()[0]
+            rooms[r]["miners"] = self.generate_sprites(
+                database, r, SpriteName.MINER, standard_speed=MINER_SPEED, animation_freq_ms=8, org_room_no=int(r))
+            rooms[r]["gold_sacks"] = self.generate_sprites(
+                database, r, SpriteName.GOLD, animation_freq_ms=500, org_room_no=int(r))
+            rooms[r]["ladders"] = self.generate_sprites(
+                database, r, SpriteName.LADDER, image=Folder.IDLE_IMGS.format(SpriteName.LADDER) + "001.png")
+            rooms[r]["elevator_shafts"] = self.generate_sprites(
+                database, r, SpriteName.ELEVATOR_SHAFT,
+                image=Folder.IDLE_IMGS.format(SpriteName.ELEVATOR_SHAFT) + "001.png")
+            rooms[r]["trucks"] = self.generate_sprites(database, r, SpriteName.TRUCK, animation_freq_ms=100)
+            rooms[r]["wheelbarrows"] = self.generate_sprites(database, r, SpriteName.WHEELBARROW, org_room_no=int(r))
+            rooms[r]["exits"] = self.generate_sprites(
+                database, r, SpriteName.EXIT, image=Folder.IDLE_IMGS.format(SpriteName.EXIT) + "001.png")
+            rooms[r]["elevators"] = self.generate_sprites(
+                database, r, SpriteName.ELEVATOR, standard_speed=ELEVATOR_SPEED, org_room_no=int(r))
+
+            # Tables of where miners can exit the ladders. They never change so they are kept between loads.
+            ladder_exits_key = (
+                rooms[r]["layout"], tuple(tuple(l.rect) for l in rooms[r]["ladders"].sprites()))
+            if ladder_exits_key not in self.ladder_exits_cache:
+                self.ladder_exits_cache[ladder_exits_key] = [
+                    LadderExits(l, rooms[r]["walls"]) for l in rooms[r]["ladders"].sprites()
+                    if not l.is_placeholder]
+            rooms[r]["ladder_exits"] = self.ladder_exits_cache[ladder_exits_key]
+            rooms[r]["all_sprites"] = [
+                rooms[r]["ladders"], rooms[r]["elevator_shafts"], rooms[r]["trucks"],
+                rooms[r]["gold_sacks"], rooms[r]["wheelbarrows"], rooms[r]["miners"]]
+            rooms[r]["static_sprites"] = [rooms[r]["ladders"], rooms[r]["elevator_shafts"]]
+            rooms[r]["moving_sprites"] = [
+                rooms[r]["trucks"], rooms[r]["gold_sacks"], rooms[r]["wheelbarrows"], rooms[r]["miners"]]
+            self.draw_static_layer(rooms[r])
+            rooms[r]["not_player"] = (
+                rooms[r]["miners"], rooms[r]["gold_sacks"], rooms[r]["ladders"], rooms[r]["trucks"],
+                rooms[r]["wheelbarrows"], rooms[r]["elevator_shafts"], rooms[r]["elevators"])
+            rooms[r]["affected_by_gravity"] = [
+                rooms[r]["miners"], rooms[r]["gold_sacks"], rooms[r]["trucks"],
+                rooms[r]["wheelbarrows"]]
+            rooms[r]["passive_sprites"] = PassiveSprites(
+                [rooms[r]["gold_sacks"], rooms[r]["trucks"], rooms[r]["wheelbarrows"]], rooms[r]["walls"]) \
+                if numpy else None
+
+            # Start state of the sprites that change while playing so that the mine can be reset without loading it
+            # again
+            rooms[r]["snapshot"] = {
+                group: [(spr, spr.snapshot()) for spr in rooms[r][group].sprites()]
+                for group in ("miners", "gold_sacks", "trucks", "wheelbarrows", "elevators")}
+            rooms[r]["player_snapshot"] = rooms[r]["player"].snapshot()
+
+        # Keep the asset cache within its size limit now that all images of the mine are loaded. It's trimmed once per
+        # mine rather than after every image that is written to it.
+        trim_asset_cache()
+
+        # Graph of how to get around in the mine. It only depends on the mine database and the layouts.
+        if mine_ not in self.navigation_cache:
+            self.navigation_cache[mine_] = NavigationGraph(rooms)
+        return {"database": database, "rooms": rooms, "navigation": self.navigation_cache[mine_]}
+
+    def draw_static_layer(self, room):
+        """
+        Draw everything in a room that never moves, i.e. the background, the walls and the static sprites, on the
+        room's static layer so that each frame can start with a single blit of it. Call again if any of it changes.
+
+        - room -- (Dict. Mandatory) A room in the rooms dictionary
+
+        returns: None
+        """
+        if "static_layer" not in room:
+            room["static_layer"] = room["background_img"].copy()
+        room["static_layer"].blit(room["background_img"], (0, 0))
+        room["static_layer"].blit(room["texture_img"], (0, 0))
+        for group in room["static_sprites"]:
+            group.draw(room["static_layer"])
+
+    def can_exit_ladder(self, x_pos, y_pos, height):
+        """
+        Check whether a climbing sprite can exit the ladder to the left and to the right in the current room
+
+        - x_pos -- (Integer. Mandatory) The horizontal center of the sprite
+        - y_pos -- (Integer. Mandatory) The top of the sprite
+        - height -- (Integer. Mandatory) The height of the sprite
+
+        Returns: Tuple. (can exit left, can exit right)
+        """
+        for exits in self.ladder_exits:
+            if exits.height == height and exits.rect.collidepoint(x_pos, y_pos):
+                return exits.can_exit(x_pos, y_pos)
+
+        # The sprite is not where the tables expect a climbing sprite to be so check the room layout directly
+        left, right = ladder_exit_masks(height)
+        can_exit_left = SPRITE_SIZE[0] <= x_pos and not self.walls.overlap(left, (x_pos - SPRITE_SIZE[0], y_pos))
+        can_exit_right = x_pos <= SCREEN_SIZE[0] - SPRITE_SIZE[0] and not self.walls.overlap(right, (x_pos, y_pos))
+        return can_exit_left, can_exit_right
 
     def reset(self, mine_=None):
         """
-        Reset all sprites in the mine to their start positions
+        Reset all sprites in the mine to their start positions. The current mine is restored from the snapshot taken
+        when it was loaded, any other mine is loaded.
 
         - mine_ -- (Integer or string. Mandatory. Optional) The requested mine. Will default to the current mine.
         """
         mine_ = self.mine if not mine_ else mine_
-        self.load(mine_)
+        if mine_ == self.mine:
+            self.restore()
+        else:
+            self.load(mine_)
+        self.set(mine_, 1)
+        self.player.restore(self.rooms["1"]["player_snapshot"])
+
+    def restore(self):
+        """
+        Put all sprites in the current mine back in the rooms and at the positions they had when the mine was loaded.
+        Surfaces, masks and sprites are reused.
+
+        returns: None
+        """
+        for r in self.rooms:
+            self.rooms[r]["frames_behind"] = 0
+            for group in self.rooms[r]["snapshot"]:
+                self.rooms[r][group].empty()
+        for r in self.rooms:
+            for group, sprites in self.rooms[r]["snapshot"].items():
+                for spr, snapshot in sprites:
+                    self.rooms[r][group].add(spr)
+                    spr.restore(snapshot)
+        self.gold_delivered = 0
+        self.seconds_remaining = self.time_limit_mins * 60
+        self.bonus = 0
+        self.times_caught = 0
+        self.frame = 0
+
+    def live_sprites(self):
+        """
+        List the sprites in the mine whose state changes while playing, i.e. all but the player and the static
+        sprites, in the order they were created
+
+        Returns: List. Tuples (room, group, sprite)
+        """
+        return [
+            (r, group, spr) for r in sorted(self.rooms, key=int) for group, sprites in self.rooms[r]["snapshot"].items()
+            for spr, _ in sprites]
+
+    def save(self, path):
+        """
+        Save the full live state of the mine to a compact binary file: the room and state of every sprite that can
+        move, what the player carries, the timers, the time left, the bonus and score and the player's lives. The file
+        is replaced in one go so that a crash while saving doesn't destroy the previous save.
+
+        - path -- (String. Mandatory) The file
+
+        returns: None
+        """
+        sprites = self.live_sprites()
+        sprite_numbers = {spr: i for i, (_, _, spr) in enumerate(sprites)}
+        rooms = sorted(self.rooms, key=int)
+        data = [
+            SAVE_GAME_HEADER.pack(SAVE_GAME_MAGIC, SAVE_GAME_VERSION, self.mine),
+            MINE_STATE.pack(
+                self.room, self.gold_delivered, self.seconds_remaining, self.bonus, self.times_caught, self.frame,
+                len(rooms), len(self.scores)),
+            struct.pack(f"<{len(rooms)}I", *(self.rooms[r]["frames_behind"] for r in rooms)),
+            b"".join(struct.pack("<Bq", m, sc) for m, sc in self.scores.items()),
+            struct.pack("<H", len(sprites))]
+
+        # The sprites in every group in every room, in the order they are moved. Sprites that are carried or have been
+        # delivered aren't in any group.
+        for r in rooms:
+            for group in self.rooms[r]["snapshot"]:
+                numbers = [sprite_numbers[spr] for spr in self.rooms[r][group].sprites()]
+                data.append(struct.pack(f"<H{len(numbers)}H", len(numbers), *numbers))
+        data.extend(spr.save_state(sprite_numbers) for _, _, spr in sprites)
+        data.append(self.player.save_state(sprite_numbers))
+        with open(path + ".tmp", "wb") as file:
+            file.write(b"".join(data))
+        os.replace(path + ".tmp", path)
+
+    def resume(self, path):
+        """
+        Restore the state of a mine saved with save. The mine is only loaded if it isn't the current one, else the
+        rooms, surfaces and sprites of the current mine are reused.
+
+        - path -- (String. Mandatory) The file
+
+        returns: None
+        """
+        with open(path, "rb") as file:
+            data = file.read()
+        if len(data) < SAVE_GAME_HEADER.size:
+            raise ValueError(f"{path} is not a save game")
+        magic, version, mine_ = SAVE_GAME_HEADER.unpack_from(data)
+        if magic != SAVE_GAME_MAGIC or version != SAVE_GAME_VERSION:
+            raise ValueError(f"{path} is not a save game of version {SAVE_GAME_VERSION}")
+        offset = SAVE_GAME_HEADER.size
+        if mine_ != self.mine:
+            self.load(mine_)
+
+        # The player is the one of room 1, the same as when a game is started, even if no mine was set up before
         self.set(mine_, 1)
-        self.player.lives = PLAYER_LIVES
-        player_db = self.database["rooms"]["1"]["sprites"]["player"][0]
-        self.player.rect.x = player_db["position"][0]
-        self.player.rect.y = player_db["position"][1]
-        self.player.activity = Activity.IDLE
-        self.player.h_direction = player_db["h_direction"]
-        self.player.saved_sprite = None
+        room, self.gold_delivered, self.seconds_remaining, self.bonus, self.times_caught, self.frame, no_of_rooms, \
+            no_of_scores = MINE_STATE.unpack_from(data, offset)
+        offset += MINE_STATE.size
+        for r, frames_behind in zip(sorted(self.rooms, key=int), struct.unpack_from(f"<{no_of_rooms}I", data, offset)):
+            self.rooms[r]["frames_behind"] = frames_behind
+        offset += no_of_rooms * 4
+        self.scores = dict(struct.iter_unpack("<Bq", data[offset:offset + no_of_scores * 9]))
+        self.total_score = sum(self.scores.values())
+        offset += no_of_scores * 9
+
+        # Take all sprites out of the rooms and put them back in the groups they were in when saved, in the same order
+        sprites = [spr for _, _, spr in self.live_sprites()]
+        if struct.unpack_from("<H", data, offset)[0] != len(sprites):
+            raise ValueError(f"{path} doesn't match mine {mine_}")
+        offset += 2
+        for r in sorted(self.rooms, key=int):
+            for group in self.rooms[r]["snapshot"]:
+                self.rooms[r][group].empty()
+                no_of_sprites = struct.unpack_from("<H", data, offset)[0]
+                numbers = struct.unpack_from(f"<{no_of_sprites}H", data, offset + 2)
+                self.rooms[r][group].add(*(sprites[i] for i in numbers))
+                offset += 2 + no_of_sprites * 2
+        for spr in sprites:
+            offset = spr.load_state(data, offset, sprites)
+        self.player.load_state(data, offset, sprites)
+        self.set(mine_, room)
+        warnings.empty()
 
     def generate_sprites(
-            self, room_, name, image=None, animation_freq_ms=0, standard_speed=STANDARD_SPEED, slow_speed=SLOW_SPEED,
-            org_room_no=None):
+            self, database, room_, name, image=None, animation_freq_ms=0, standard_speed=STANDARD_SPEED,
+            slow_speed=SLOW_SPEED, org_room_no=None):
         """
         Generate a sprites group from room setup dictionary
 
+        - database -- (Dict. Mandatory) The mine database
         - room_ - (String or Integer. Mandatory) Refers to the room/mine database
         - name -- (String. Mandatory) The name of the sprite to generate. Use SpriteNames enum.
         - image -- (String. Optional. Defaults to None) Use a specific image instead of an animation
@@ -563,23 +1823,23 @@ class Mines(object):
 
         returns: An instance of pygame.sprites.Group()
         """
-        if name not in self.database["rooms"][str(room_)]["sprites"]:
+        if name not in database["rooms"][str(room_)]["sprites"]:
             name = SpriteName.PLACEHOLDER
             sprites_db = [{"position": [-10, -10]}]
             image = FileName.PLACEHOLDER_IMG
         else:
-            sprites_db = self.database["rooms"][str(room_)]["sprites"][name]
+            sprites_db = database["rooms"][str(room_)]["sprites"][name]
         sprites = []
-        group = pygame.sprite.Group()
+        group = SpriteGroup()
         for i, spr in enumerate(sprites_db):
-            activity = spr["activity"] if "activity" in spr else Activity.IDLE
-            h_direction = spr["h_direction"] if "h_direction" in spr else Direction.RIGHT
-            v_direction = spr["v_direction"] if "v_direction" in spr else Direction.DOWN
+            activity = ACTIVITIES[spr["activity"]] if "activity" in spr else Activity.IDLE
+            h_direction = DIRECTIONS[spr["h_direction"]] if "h_direction" in spr else Direction.RIGHT
+            v_direction = DIRECTIONS[spr["v_direction"]] if "v_direction" in spr else Direction.DOWN
             height = spr["height"] if "height" in spr else None
             leads_to = spr["leads_to"] if "leads_to" in spr else None
-            exit_dir = spr["exit_dir"] if "exit_dir" in spr else None
+            exit_dir = DIRECTIONS[spr["exit_dir"]] if "exit_dir" in spr else None
             stops = spr["stops"] if "stops" in spr else None
-            stop_direction = spr["stop_direction"] if "stop_direction" in spr else None
+            stop_direction = DIRECTIONS[spr["stop_direction"]] if "stop_direction" in spr else None
             sprites.append(Sprite(
                 name=name, position=spr["position"], image=image, activity=activity, h_direction=h_direction,
                 v_direction=v_direction, height=height, animation_freq_ms=animation_freq_ms,
@@ -591,10 +1851,10 @@ class Mines(object):
 
     def is_completed(self):
         done = self.gold_delivered >= self.no_of_gold_sacks
-        if done:
-            if self.mine not in self.scores:
-                self.scores[self.mine] = self.score
-                self.total_score = sum([sc for sc in self.scores.values()])
+        if done and self.mine not in self.scores:
+            self.scores[self.mine] = self.score
+            self.total_score = sum([sc for sc in self.scores.values()])
+        if done and display.show_overlay(mine_is_completed_01):
             screen.blit(mine_is_completed_01.update(self.mine), mine_is_completed_01.rect)
             screen.blit(mine_is_completed_02.update(self.mine), mine_is_completed_02.rect)
             screen.blit(score.update(
@@ -606,15 +1866,16 @@ class Mines(object):
 
     def next(self):
         """Load the next mine"""
-        next_mine = self.mine + 1
-        if next_mine not in self.tot_number_of_mines:
-            next_mine = 1
-            self.game_completed = True
-        self.set(next_mine, 1)
-        self.reset()
+        next_mine = self.next_mine()
+        self.game_completed = next_mine == 1
+        self.reset(next_mine)
+
+    def next_mine(self):
+        """Returns: Integer. The number of the mine after the current one. Starts over at 1 after the last mine."""
+        return self.mine + 1 if self.mine + 1 in self.tot_number_of_mines else 1
 
     def is_game_completed(self):
-        if self.game_completed:
+        if self.game_completed and display.show_overlay(game_completed_01):
             screen.blit(mine.background_img, (0, 0))
             screen.blit(game_completed_01.text, game_completed_01.rect)
             screen.blit(game_completed_02.text, game_completed_02.rect)
@@ -629,21 +1890,22 @@ class Mines(object):
 class Sprite(pygame.sprite.Sprite):
 
     def __init__(
-            self, name, activity="idle", image=None, position=(0, 0), h_direction="right", v_direction="none",
+            self, name, activity=None, image=None, position=(0, 0), h_direction=None, v_direction=None,
             height=None, animation_freq_ms=0, standard_speed=STANDARD_SPEED, slow_speed=SLOW_SPEED, leads_to=None,
             exit_dir=None, longevity_ms=None, stops=None, stop_direction=None, id_number=None, org_room_no=None):
         """
         Create a new sprite
 
         - name -- (String. Mandatory) The sprite name. Use SpriteName enum
-        - activity -- (String. Optional. Defaults to "idle") The current activity of the sprite. Use Activity enum
+        - activity -- (Integer. Optional. Defaults to Activity.IDLE) The current activity of the sprite. Use Activity
+            enum
         - image -- (String. Optional. Defaults to None) Path to image file. If provided a static image will be used for
             the sprite and animations will be disabled.
         - position -- (Tuple. Optional. Defaults to (0, 0)) The current position of the sprite
-        - h_direction -- (String. Optional. Defaults to "right") The current horizontal direction the sprite is facing.
-            Use Direction enum.
-        - v_direction -- (String. Optional. Defaults to "right") The current vertical direction the sprite is moving in.
-            Use Direction enum.
+        - h_direction -- (Integer. Optional. Defaults to Direction.RIGHT) The current horizontal direction the sprite
+            is facing. Use Direction enum.
+        - v_direction -- (Integer. Optional. Defaults to Direction.NONE) The current vertical direction the sprite is
+            moving in. Use Direction enum.
         - height -- (Integer. Optional. Defaults to None) Crop the sprites image to a certain height. If this is
             provided the image will not be scaled.
         - animation_freq_ms -- (Integer. Optional. Defaults to 0) The update frequency of the sprite animation in
@@ -654,24 +1916,25 @@ class Sprite(pygame.sprite.Sprite):
             gold sack
         - leads_to -- (Dict. Optional. Defaults to None) Only valid for exit sprites. A dictionary containing the
             room number and x/y-position to where the exit leads
-        - exit_dir -- (String. Optional. Defaults to None) Only valid for exit sprites. The direction the player must be
-            facing to go through the exit.
+        - exit_dir -- (Integer. Optional. Defaults to None) Only valid for exit sprites. The direction the player must
+            be facing to go through the exit. Use Direction enum.
         - longevity_ms -- (Integer. Optional. Defaults to None) If set to a positive value the sprite will expire after
             the given number of milliseconds
         - stops -- (List. Optional. Defaults to None) Applicable for elevators (and carts?). Positions (in pix) where
             the sprite should pause.
-        - stop_direction -- (String. Optional. Defaults to None) Applicable for elevators. Will only stop when giong
-            in this direction ("up" or "down")
+        - stop_direction -- (Integer. Optional. Defaults to None) Applicable for elevators. Will only stop when giong
+            in this direction (Direction.UP or Direction.DOWN)
         - id_number -- (Integer. Optional. Defaults to None) Give the sprite a unique id number. Useful for
             distinguishing between sprites with the same name.
         - org_room_no -- (Integer. Optional. Defaults to None) The number of the room where the sprite originates.
         """
         pygame.sprite.Sprite.__init__(self)
 
-        self.activity = None
+        self.activity = Activity.NONE
         self.animation = None
-        self.h_direction = h_direction
-        self.v_direction = v_direction
+        self.mask = None
+        self.h_direction = h_direction or Direction.RIGHT
+        self.v_direction = v_direction or Direction.NONE
         self.is_facing_down = None
         self.is_facing_left = None
         self.is_facing_right = None
@@ -693,14 +1956,12 @@ class Sprite(pygame.sprite.Sprite):
         self.speed = standard_speed
         self.animation_freq_ms = animation_freq_ms
         self.next_img = 0
-        self.wake_up_time = 0
+        self.timers = {}
         self.fall_pix = 0
         self.lives = PLAYER_LIVES
         self.saved_sprite = None
         self.can_climb_ladders = self.name in (SpriteName.PLAYER, SpriteName.MINER)
         self.carries_gold_sacks = 0
-        self.group_single = pygame.sprite.GroupSingle()
-        self.group_single.add(self)
         self.is_computer_controlled = not self.is_player
         self.ladder_enter_selection = False
         self.ladder_exit_selection = [False, False]
@@ -712,10 +1973,10 @@ class Sprite(pygame.sprite.Sprite):
         self.leads_to = leads_to
         self.exit_direction = exit_dir
         self.max_control_while_falling_pix = 0 if self.name == SpriteName.GOLD else MAX_CONTROL_WHILE_FALLING_PIX
-        self.immortality_timer = 0
         self.image_transparency_val = 255
         self.longevity_ms = longevity_ms
-        self.expiration_ms = pygame.time.get_ticks() + self.longevity_ms if self.longevity_ms else 0
+        if self.longevity_ms:
+            self.start_timer("expiration", self.longevity_ms, self.kill)
         self.ignore_screen_boundaries = self.is_truck
         self.stops = sorted(stops) if stops else []
         self.can_climb_slopes = self.name in (SpriteName.PLAYER, SpriteName.MINER)
@@ -729,18 +1990,22 @@ class Sprite(pygame.sprite.Sprite):
         self.in_room = org_room_no
         if image:
             self.animations = None
-            self.image = pygame.image.load(image).convert()
+            self.image = load_static_image(image)
             if height:
-                cropped = pygame.Surface((self.image.get_size()[0], height))
-                cropped.blit(self.image, (0, 0))
-                self.image = cropped
+                self.image = self.image.subsurface(
+                    (0, 0, self.image.get_width(), min(height, self.image.get_height())))
             self.image.set_colorkey(Color.WHITE)
         else:
             self.animations = SPRITE_ANIMATIONS[name]
-            self.update(activity)
+            self.update(activity or Activity.IDLE)
         self.rect = self.image.get_rect()
         self.rect.x, self.rect.y = position
-        self.mask = pygame.mask.from_surface(self.image)
+        self.mask = pygame.mask.from_surface(self.image) if image else self.mask
+
+        # The mask of the current animation frame is used for collisions with other sprites. Walls, floors and roofs
+        # are tested against the mask of the first frame since the room layouts are designed around it, e.g. the
+        # climbing animations are wider than the ladder openings.
+        self.body_mask = self.mask
 
     def collides(self, sprites, return_sprite=False):
         """
@@ -753,11 +2018,16 @@ class Sprite(pygame.sprite.Sprite):
         Returns: Boolean or Tuple
         """
         sprites = [sprites] if type(sprites) not in (list, tuple) else sprites
-        sprites = [sprites[0].group_single] if type(sprites[0]) is not pygame.sprite.Group else sprites
+        sprites = [sprites[0]] if not isinstance(sprites[0], pygame.sprite.AbstractGroup) else sprites
         collisions = []
         collided_sprite = None
         for sprite in sprites:
-            collision = pygame.sprite.spritecollide(self, sprite, False, pygame.sprite.collide_mask)
+            if isinstance(sprite, SpriteGroup):
+                collision = sprite.collisions(self)
+            elif isinstance(sprite, pygame.sprite.AbstractGroup):
+                collision = pygame.sprite.spritecollide(self, sprite, False, collide_masks)
+            else:
+                collision = [sprite] if collide_masks(self, sprite) else []
             if collision:
                 collisions.append(collision[0])
                 collided_sprite = collision[0]
@@ -767,13 +2037,135 @@ class Sprite(pygame.sprite.Sprite):
         else:
             return result
 
+    def count_fall_pix(self, x, y, pix):
+        """
+        Add the pixels the sprite has just fallen to the fall distance count. Pixels where the sprite is on a ladder it
+        can climb are not counted.
+
+        - x -- (Integer. Mandatory) Horizontal movement per pixel. -1, 0 or 1.
+        - y -- (Integer. Mandatory) Vertical movement per pixel. -1, 0 or 1.
+        - pix -- (Integer. Mandatory) The number of pixels the sprite has just moved
+
+        Returns: Integer or None. The falling activity if the sprite has fallen far enough to lose control, else None.
+        """
+        falling_pix = pix
+        if self.can_climb_ladders and self.rect.inflate(pix * 2, pix * 2).collidelist(
+                [l.rect for l in mine.ladders.sprites()]) > -1:
+            self.rect.move_ip(-x * pix, -y * pix)
+            for _ in range(pix):
+                self.rect.move_ip(x, y)
+                falling_pix -= 1 if self.collides(mine.ladders) else 0
+        if not falling_pix:
+            return
+        self.fall_pix += falling_pix
+        if self.fall_pix >= self.max_control_while_falling_pix:
+            return self.get_falling_activity()
+
+    def free_pix(self, x, y, pix):
+        """
+        Calculate how many pixels the sprite can move before it hits something, i.e. before it ends up outside of the
+        screen, hits a wall or an elevator or reaches a stop point
+
+        - x -- (Integer. Mandatory) Horizontal movement per pixel. -1, 0 or 1.
+        - y -- (Integer. Mandatory) Vertical movement per pixel. -1, 0 or 1.
+        - pix -- (Integer. Mandatory) The number of pixels the sprite is about to move
+
+        Returns: Integer
+        """
+
+        # Walls. Most sprites stand on a floor and hit it on the very first pixel of the gravity move.
+        pix = first_overlap(mine.walls, (0, 0), self.body_mask, self.rect.topleft, x, y, pix) - 1
+        if not pix:
+            return 0
+
+        # Screen boundaries
+        if not self.ignore_screen_boundaries:
+            pix = min(
+                pix, free_pix_within(self.rect.center[0], x, SCREEN_SIZE[0]),
+                free_pix_within(self.rect.y, y, SCREEN_SIZE[1] - SPRITE_SIZE[1]))
+
+        # Stop points
+        if self.stops:
+            for n in range(1, pix + 1):
+                if self.rect.bottom + n * y in self.stops:
+                    pix = n - 1
+                    break
+
+        # Elevators
+        if self.is_player or self.is_miner:
+            for elevator in mine.elevators.sprites():
+                pix = min(pix, first_overlap(
+                    elevator.mask, elevator.rect.topleft, self.mask, self.rect.topleft, x, y, pix) - 1)
+
+        return max(pix, 0)
+
+    def get_falling_activity(self):
+        """
+        Returns: Integer. The activity of the sprite when it falls
+        """
+        if self.is_passed_out():
+            return Activity.PASSED_OUT
+        elif self.is_wheelbarrow and not self.get_load():
+            return self.activity
+        else:
+            return FALLING_ACTIVITIES[self.get_load()]
+
+    def get_load(self):
+        """
+        Returns: Integer. The Activity trait of what the sprite carries, i.e. a gold sack or an empty or loaded
+            wheelbarrow, or 0 if it doesn't carry anything
+        """
+        return self.activity & Activity.CARRIES
+
+    def get_stopped_activity(self):
+        """
+        Stop the sprite when it can't get past an obstacle. Computer controlled sprites turn around instead of stopping
+        if they can. PassiveSprites stops gold sacks, trucks and wheelbarrows by the same rules, so keep it in step
+        with any change here (python gold_thief.py --benchmark-gravity 64 checks that both end the same).
+
+        Returns: Integer or None. The activity of the stopped sprite or None if it hasn't changed
+        """
+        if self.is_carrying_gold() and self.is_climbing():
+            return Activity.CLIMBING_WITH_GOLD
+        elif self.is_climbing():
+            self.v_direction = change_direction(self.v_direction) if self.is_computer_controlled else self.v_direction
+            return Activity.CLIMBING
+        elif self.is_carrying_gold():
+            return Activity.IDLE_WITH_GOLD
+        elif self.is_passed_out():
+            return Activity.PASSED_OUT
+        elif self.is_loaded():
+            return self.activity
+        elif self.is_computer_controlled and self.is_walking():
+            self.h_direction = change_direction(self.h_direction)
+        elif self.is_pushing_empty_wheelbarrow():
+            return Activity.PUSHING_EMPTY_WHEELBARROW
+        elif self.is_pushing_loaded_01_wheelbarrow():
+            return Activity.PUSHING_LOADED_01_WHEELBARROW
+        elif self.is_pushing_loaded_02_wheelbarrow():
+            return Activity.PUSHING_LOADED_02_WHEELBARROW
+        elif self.is_pushing_loaded_03_wheelbarrow():
+            return Activity.PUSHING_LOADED_03_WHEELBARROW
+        elif self.is_elevator:
+            self.v_direction = change_direction(self.v_direction)
+        else:
+            return Activity.WALKING if self.is_miner else Activity.IDLE
+
+    def hits_wall(self):
+        """
+        Check if the sprite collides with a wall, floor or roof in the current room
+
+        Returns: Boolean
+        """
+        return mine.walls.overlap(self.body_mask, self.rect.topleft) is not None
+
     def move(self, direction, speed=None, activity=None):
         """
         Move the sprite
 
-        - direction -- (String. Mandatory) Use Direction enum
+        - direction -- (Integer. Mandatory) Use Direction enum
         - speed -- (Int or Float. Optional. Defaults to self.speed) The speed (number of pixels) to move the sprite in
-        - activity -- (String. Optional. Defaults to None) The activity (animation) of the sprite. Will not be updated
+        - activity -- (Integer. Optional. Defaults to None) The activity (animation) of the sprite. Will not be updated
             if set to None. Use Activity enum.
         """
         # Set variables
@@ -786,10 +2178,27 @@ class Sprite(pygame.sprite.Sprite):
         self.v_direction = direction if vertical else self.v_direction
         self.h_direction = direction if horizontal else self.h_direction
 
-        # Move the sprite one pixel at a time and check for wall collisions etc
-        for i in range(1, speed + 1):
+        # Move the sprite and check for wall collisions etc. The stretches where nothing can happen are skipped in one
+        # go and only the pixels where the sprite hits something are stepped through one at a time. PassiveSprites
+        # applies the same falling, drifting, bouncing and stopping rules to rooms with many sprites that can't climb,
+        # so keep it in step with any change here (python gold_thief.py --benchmark-gravity 64 checks that both end
+        # the same).
+        i = 0
+        while i < speed:
+
+            # Skip ahead to the first pixel where the sprite hits something
+            free_pix = self.free_pix(x, y, speed - i)
+            if free_pix:
+                self.rect.move_ip(x * free_pix, y * free_pix)
+                i += free_pix
+                if vertical and self.is_facing_down and not self.is_elevator:
+                    activity = self.count_fall_pix(x, y, free_pix) or activity
+                if i == speed:
+                    break
 
             # Move the sprite one pixel
+            i += 1
+            y_before_step = self.rect.y
             self.rect.move_ip(x, y)
 
             # Check if sprite is outside of screen
@@ -807,7 +2216,7 @@ class Sprite(pygame.sprite.Sprite):
                 break
 
             # Check for wall collision
-            if self.collides(mine.layouts):
+            if self.hits_wall():
                 climbed = False
 
                 # Check if the sprite has fallen too far
@@ -821,42 +2230,21 @@ class Sprite(pygame.sprite.Sprite):
                 if self.can_climb_slopes and (self.is_walking() or self.is_idle()):
                     for _ in range(CLIMBABLE_PIX):
                         self.rect.move_ip(0, -1)
-                        if not self.collides(mine.layouts):
+                        if not self.hits_wall():
                             climbed = True
                             break
-                    if climbed:
+                    # A sprite that climbs back up to where it was before this pixel would just repeat this pixel for
+                    # the rest of the move
+                    if climbed and self.rect.y == y_before_step and not self.is_passed_out():
+                        break
+                    elif climbed:
                         continue
                     else:
                         self.rect.move_ip(0, CLIMBABLE_PIX)
 
                 # Stop the sprite or change direction if impossible to get past obstacle
                 self.rect.move_ip(-(one_pixel * i) if horizontal else 0, -y)
-                if self.is_carrying_gold() and self.is_climbing():
-                    activity = Activity.CLIMBING_WITH_GOLD
-                elif self.is_climbing():
-                    activity = Activity.CLIMBING
-                    self.v_direction = \
-                        change_direction(self.v_direction) if self.is_computer_controlled else self.v_direction
-                elif self.is_carrying_gold():
-                    activity = Activity.IDLE_WITH_GOLD
-                elif self.is_passed_out():
-                    activity = Activity.PASSED_OUT
-                elif self.is_loaded():
-                    activity = self.activity
-                elif self.is_computer_controlled and self.is_walking():
-                    self.h_direction = change_direction(self.h_direction)
-                elif self.is_pushing_empty_wheelbarrow():
-                    activity = Activity.PUSHING_EMPTY_WHEELBARROW
-                elif self.is_pushing_loaded_01_wheelbarrow():
-                    activity = Activity.PUSHING_LOADED_01_WHEELBARROW
-                elif self.is_pushing_loaded_02_wheelbarrow():
-                    activity = Activity.PUSHING_LOADED_02_WHEELBARROW
-                elif self.is_pushing_loaded_03_wheelbarrow():
-                    activity = Activity.PUSHING_LOADED_03_WHEELBARROW
-                elif self.is_elevator:
-                    self.v_direction = change_direction(self.v_direction)
-                else:
-                    activity = Activity.WALKING if self.is_miner else Activity.IDLE
+                activity = self.get_stopped_activity() or activity
                 break
 
             # Check for collision with an elevator
@@ -873,22 +2261,7 @@ class Sprite(pygame.sprite.Sprite):
                     self.collides(mine.ladders) and self.can_climb_ladders) and not self.is_elevator:
                 self.fall_pix += 1
                 if self.fall_pix >= self.max_control_while_falling_pix:
-                    if self.is_passed_out():
-                        activity = Activity.PASSED_OUT
-                    elif self.is_carrying_gold():
-                        activity = Activity.FALLING_WITH_GOLD
-                    elif self.is_pushing_empty_wheelbarrow():
-                        activity = Activity.FALLING_WITH_EMPTY_WHEELBARROW
-                    elif self.is_pushing_loaded_01_wheelbarrow():
-                        activity = Activity.FALLING_WITH_LOADED_01_WHEELBARROW
-                    elif self.is_pushing_loaded_02_wheelbarrow():
-                        activity = Activity.FALLING_WITH_LOADED_02_WHEELBARROW
-                    elif self.is_pushing_loaded_03_wheelbarrow():
-                        activity = Activity.FALLING_WITH_LOADED_03_WHEELBARROW
-                    elif self.is_wheelbarrow:
-                        activity = self.activity
-                    else:
-                        activity = Activity.FALLING
+                    activity = self.get_falling_activity()
 
             # Check if the sprite has reached a stop point (applicable to elevators and carts) and if so pause
             # the sprite
@@ -901,6 +2274,7 @@ class Sprite(pygame.sprite.Sprite):
                     self.v_direction = {last_stop: Direction.UP, first_stop: Direction.DOWN}[True]
                 break
 
+        self.reindex()
         self.update(activity if activity else self.activity)
 
     def move_cc(self):
@@ -908,15 +2282,12 @@ class Sprite(pygame.sprite.Sprite):
 
         # Get sprite position and size and calculate different movement possibilities
         y_pos = self.rect.y
-        bottom_pos = self.rect.bottom - 1
         x_pos = self.rect.center[0]
         right = self.rect.right
         left = self.rect.x
-        r_range = x_pos + SPRITE_SIZE[0]
-        l_range = x_pos - SPRITE_SIZE[0]
         ladder_center = [l.rect.center[0] for l in mine.ladders.sprites() if l.collides(self)]
-        ladder_center = ladder_center[0] if ladder_center else -10
-        close_to_center = ladder_center in range(x_pos - self.speed, x_pos + self.speed)
+        ladder_center = ladder_center[0] if ladder_center else None
+        close_to_center = ladder_center is not None and ladder_center in range(x_pos - self.speed, x_pos + self.speed)
         can_climb_ladder = \
             close_to_center and not self.is_climbing() and not self.ladder_enter_selection and self.can_climb_ladders
         is_not_an_elevator = not (self.is_elevator or self.is_elevator_shaft)
@@ -978,33 +2349,9 @@ class Sprite(pygame.sprite.Sprite):
         # make a random selection whether to exit or keep climbing.
         elif self.is_climbing():
 
-            # Check whether the sprite can exit the ladder from the current position by checking if the background
-            # color in the room layout image to the left and right of the sprite is white.
-            can_exit_left = can_exit_right = False
-            if x_pos <= (SCREEN_SIZE[0]-SPRITE_SIZE[0]):
-                top_right = [mine.layout_img.get_at([i, y_pos])[:3] for i in range(x_pos, r_range)]
-                bottom_right = [mine.layout_img.get_at([i, bottom_pos])[:3] for i in range(x_pos, r_range)]
-                down_right_diagonal = [mine.layout_img.get_at(z)[:3] for z in zip([i for i in range(
-                    x_pos, x_pos + SPRITE_SIZE[0])], [n for n in range(y_pos, bottom_pos)])]
-                up_right_diagonal = [mine.layout_img.get_at(z)[:3] for z in zip([i for i in range(
-                    x_pos, x_pos + SPRITE_SIZE[0])], [n for n in range(bottom_pos, y_pos, -1)])]
-                right_vertical = [
-                    mine.layout_img.get_at([x_pos + SPRITE_SIZE[0], i])[:3] for i in range(y_pos, bottom_pos)]
-                can_exit_right = all([
-                    i == Color.WHITE for i in
-                    top_right + up_right_diagonal + bottom_right + down_right_diagonal + right_vertical])
-            if SPRITE_SIZE[0] <= x_pos:
-                top_left = [mine.layout_img.get_at([i, y_pos])[:3] for i in range(l_range, x_pos)]
-                bottom_left = [mine.layout_img.get_at([i, bottom_pos])[:3] for i in range(l_range, x_pos)]
-                down_left_diagonal = [mine.layout_img.get_at(z)[:3] for z in zip([i for i in range(
-                    x_pos - SPRITE_SIZE[0], x_pos)], [n for n in range(bottom_pos, y_pos, -1)])]
-                up_left_diagonal = [mine.layout_img.get_at(z)[:3] for z in zip([i for i in range(
-                    x_pos - SPRITE_SIZE[0], x_pos)], [n for n in range(y_pos, bottom_pos)])]
-                left_vertical = [
-                    mine.layout_img.get_at([x_pos - SPRITE_SIZE[0], i])[:3] for i in range(y_pos, bottom_pos)]
-                can_exit_left = all([
-                    i == Color.WHITE for i in
-                    top_left + bottom_left + up_left_diagonal + down_left_diagonal + left_vertical])
+            # Check whether the sprite can exit the ladder from the current position. Looked up in the tables of exit
+            # points that are calculated from the room layout when the mine is loaded.
+            can_exit_left, can_exit_right = mine.can_exit_ladder(x_pos, y_pos, self.rect.height)
 
             # Prevent the sprite from immediately exiting the ladder it just entered
             if self.just_entered_ladder and (can_exit_right or can_exit_left):
@@ -1048,12 +2395,13 @@ class Sprite(pygame.sprite.Sprite):
         # Check if a sprite is riding an elevator and if so move that sprite with the elevator
         if self.is_elevator:
             for spr in mine.all_sprites + [mine.players]:
+                on_elevator = spr.collisions(self)
                 for spt in spr.sprites():
                     if spt.in_room != self.in_room:
                         continue
                     if spt.is_elevator_shaft:
                         continue
-                    elevator_collision = spt.collides(self) and self.rect.bottom >= spt.rect.bottom - 5 \
+                    elevator_collision = spt in on_elevator and self.rect.bottom >= spt.rect.bottom - 5 \
                         and spt.rect.bottom >= self.rect.bottom - GRAVITY
                     riding_this_elevator = spt.is_riding_elevator == self.id_number
                     y = (self.rect.bottom - 5) - spt.rect.bottom
@@ -1087,73 +2435,230 @@ class Sprite(pygame.sprite.Sprite):
                     if not elevator_collision:
                         spt.is_riding_elevator = False if riding_this_elevator else spt.is_riding_elevator
 
-    def update(self, activity=None):
+    def reindex(self):
+        """Update the sprite's position in the spatial hashes of the groups it belongs to. Call after moving it."""
+        for group in self.groups():
+            if isinstance(group, SpriteGroup):
+                group.index(self)
+
+    def restore(self, snapshot):
         """
-        Update the sprite status
+        Put the sprite back in the state it had when a snapshot was taken. State that isn't part of the snapshot,
+        e.g. timers and carried sprites, is set to the same values as for a new sprite.
 
-        - activity -- (String. Optional. Defaults to None) The new activity to assign the sprite. If not provided
-            animation will be unchanged.
+        - snapshot -- (Dict. Mandatory) A snapshot taken with Sprite.snapshot
+
+        Returns: None
         """
-        # Static sprites can't be updated
-        if self.is_static:
-            return
+        self.rect.topleft = snapshot["position"]
+        self.h_direction = snapshot["h_direction"]
+        self.v_direction = snapshot["v_direction"]
+        self.carries_gold_sacks = snapshot["carries_gold_sacks"]
+        self.in_room = snapshot["in_room"]
+        self.speed = self.standard_speed
+        self.next_img = 0
+        self.stop_timers()
+        self.fall_pix = 0
+        self.lives = PLAYER_LIVES
+        self.saved_sprite = None
+        self.ladder_enter_selection = False
+        self.ladder_exit_selection = [False, False]
+        self.just_entered_ladder = False
+        self.image_transparency_val = 255
+        self.is_riding_elevator = False
+        self.is_waiting_for_elevator = False
+        self.enter_elevator_selection = False
+        self.elevator_entry_pos = None
 
-        activity = self.activity if not activity else activity
-        now = pygame.time.get_ticks()
-        self.is_facing_down = self.v_direction == Direction.DOWN
-        self.is_facing_left = self.h_direction == Direction.LEFT
-        self.is_facing_right = self.h_direction == Direction.RIGHT
-        self.is_facing_up = self.v_direction == Direction.UP
+        # Start the animation over
+        if not self.is_static:
+            self.activity = Activity.NONE
+            self.update(snapshot["activity"])
+        self.reindex()
 
-        # Kill sprite if it has expired
-        if now >= self.expiration_ms and self.longevity_ms:
-            self.kill()
+    def snapshot(self):
+        """
+        Take a snapshot of the sprite's position, directions, activity and number of gold sacks it carries
+
+        Returns: Dict
+        """
+        return {
+            "position": self.rect.topleft, "h_direction": self.h_direction, "v_direction": self.v_direction,
+            "activity": self.activity, "carries_gold_sacks": self.carries_gold_sacks, "in_room": self.in_room}
+
+    def save_state(self, sprite_numbers):
+        """
+        Pack the full live state of the sprite for a save game, see Mines.save
+
+        - sprite_numbers -- (Dict. Mandatory) The number of every sprite in Mines.live_sprites, by sprite
+
+        Returns: Bytes
+        """
+        flags = sum(bool(flag) << i for i, flag in enumerate((
+            self.is_waiting_for_elevator, self.enter_elevator_selection, self.ladder_enter_selection,
+            self.ladder_exit_selection[0], self.ladder_exit_selection[1], self.just_entered_ladder)))
+        now = clock.get_ticks()
+        timers_ = [(name, timer[3][1]) for name, timer in self.timers.items()]
+        return SPRITE_STATE.pack(
+            self.rect.x, self.rect.y, self.activity, self.h_direction, self.v_direction, self.fall_pix,
+            self.carries_gold_sacks, self.in_room or 0, self.is_riding_elevator or 0, flags, self.speed,
+            self.image_transparency_val, -1 if self.elevator_entry_pos is None else self.elevator_entry_pos,
+            sprite_numbers[self.saved_sprite] if self.saved_sprite else -1, self.next_img - now, self.lives,
+            len(timers_)) + b"".join(
+            TIMER_STATE.pack(
+                TIMER_NAMES.index(name), TIMER_CALLBACKS.index(callback.__name__ if callback else None),
+                self.timers[name][0] - now)
+            for name, callback in timers_)
+
+    def load_state(self, data, offset, sprites):
+        """
+        Put the sprite in a state packed by save_state. The sprite must be in the groups it was in when it was saved.
+
+        - data -- (Bytes. Mandatory) The save game
+        - offset -- (Integer. Mandatory) Where the sprite's state starts in data
+        - sprites -- (List. Mandatory) The sprites in Mines.live_sprites, by number
+
+        Returns: Integer. Where the sprite's state ends in data
+        """
+        (x, y, activity, h_direction, v_direction, fall_pix, carries_gold_sacks, in_room, riding, flags, speed,
+         transparency, elevator_entry_pos, saved_sprite, next_img_ms, lives, no_of_timers) = \
+            SPRITE_STATE.unpack_from(data, offset)
+        offset += SPRITE_STATE.size
+        self.restore({
+            "position": (x, y), "h_direction": h_direction, "v_direction": v_direction, "activity": activity,
+            "carries_gold_sacks": carries_gold_sacks, "in_room": in_room or None})
+        self.is_riding_elevator = riding or False
+        self.is_waiting_for_elevator, self.enter_elevator_selection, self.ladder_enter_selection, \
+            self.ladder_exit_selection[0], self.ladder_exit_selection[1], self.just_entered_ladder = \
+            (bool(flags & (1 << i)) for i in range(6))
+        self.fall_pix = fall_pix
+        self.speed = speed
+        self.elevator_entry_pos = None if elevator_entry_pos < 0 else elevator_entry_pos
+        self.saved_sprite = sprites[saved_sprite] if saved_sprite >= 0 else None
+        self.next_img = clock.get_ticks() + next_img_ms
+        self.lives = lives
+        self.image_transparency_val = transparency
+        if not self.is_static:
+            self.image.set_alpha(self.image_transparency_val)
+
+        # Timers started by restore, e.g. when the sprite is passed out, are replaced by the saved ones
+        self.stop_timers()
+        for _ in range(no_of_timers):
+            name, callback, delay_ms = TIMER_STATE.unpack_from(data, offset)
+            offset += TIMER_STATE.size
+            callback = TIMER_CALLBACKS[callback]
+            self.start_timer(TIMER_NAMES[name], delay_ms, getattr(self, callback) if callback else None)
+        return offset
+
+    def update(self, activity=None):
+        """
+        Update the sprite status
+
+        - activity -- (Integer. Optional. Defaults to None) The new activity to assign the sprite. If not provided
+            animation will be unchanged.
+        """
+        # Static sprites can't be updated
+        if self.is_static:
             return
 
+        activity = self.activity if not activity else activity
+        now = clock.get_ticks()
+        self.is_facing_down = self.v_direction == Direction.DOWN
+        self.is_facing_left = self.h_direction == Direction.LEFT
+        self.is_facing_right = self.h_direction == Direction.RIGHT
+        self.is_facing_up = self.v_direction == Direction.UP
+
         # Check if the sprite activity has changed and if so change animation
         if activity != self.activity:
 
-            # Activate timer for paused or passed out sprites
+            # Start the wake up timer for paused or passed out sprites
             if activity == Activity.PASSED_OUT:
-                self.wake_up_time = now + WAKE_UP_TIME_MS
+                self.start_timer("wake_up", WAKE_UP_TIME_MS, self.wake_up)
             elif activity == Activity.PAUSED:
-                self.wake_up_time = now + ELEVATOR_PAUSE_MS
+                self.start_timer("wake_up", ELEVATOR_PAUSE_MS)
                 activity = self.activity
 
             # Load new animation
             self.animation = animation_loop(self.animations[activity])
 
-        # Check if it's time to wake up the sprite from passed out state
-        elif self.is_passed_out() and now >= self.wake_up_time:
-            if self.is_computer_controlled and self.collides(mine.ladders):
-                activity = Activity.CLIMBING
-            elif self.is_computer_controlled:
-                activity = Activity.WALKING
-            else:
-                activity = Activity.IDLE
-            self.animation = animation_loop(self.animations[activity])
-            self.immortality_timer = IMMORTAL_TIME if self.is_player else 0
-            self.image_transparency_val = IMG_SEMI_TRANSPARENCY if self.is_player else IMG_FULLY_OPAQUE
+        # Fade in the sprite while it's in immortal state after waking up from passed out state
+        if self.is_immortal():
+            self.image_transparency_val = min(self.image_transparency_val + IMG_TRANSPARENCY_INCREMENTATION,
+                                              IMG_FULLY_OPAQUE)
 
-        # Update immortality timer if sprite is in immortal state after waking up from passed out state
-        if self.immortality_timer > 0:
-            self.immortality_timer -= clock.get_time()
-            self.image_transparency_val += IMG_TRANSPARENCY_INCREMENTATION
-        else:
-            self.immortality_timer = 0
-            self.image_transparency_val = IMG_FULLY_OPAQUE
-
-        # Load the next image in the animation
+        # Load the next image in the animation together with its mask
         if (now >= self.next_img) or (activity != self.activity):
-            self.image = next(self.animation)
+            mask_size = self.mask.get_size() if self.mask else None
+            self.image, self.mask = next(self.animation)[Direction.LEFT if self.is_facing_left else Direction.RIGHT]
             self.next_img = now + self.animation_freq_ms
-            self.image.set_colorkey(Color.WHITE)
-            if self.is_facing_left:
-                self.image = pygame.transform.flip(self.image, True, False)
             self.image.set_alpha(self.image_transparency_val)
+            if mask_size and self.mask.get_size() != mask_size:
+                self.reindex()
 
         self.activity = activity
 
+    def start_timer(self, name, delay_ms, callback=None):
+        """
+        Start a timer. A timer with the same name that is already running is restarted.
+
+        - name -- (String. Mandatory) The name of the timer
+        - delay_ms -- (Integer. Mandatory) The number of game milliseconds until the timer is up
+        - callback -- (Callable. Optional. Defaults to None) Called without arguments when the timer is up
+
+        Returns: None
+        """
+        self.stop_timer(name)
+        self.timers[name] = timers.start(delay_ms, self.timer_is_up, name, callback)
+
+    def stop_timer(self, name):
+        """
+        Stop a timer if it's running
+
+        - name -- (String. Mandatory) The name of the timer
+
+        Returns: None
+        """
+        if name in self.timers:
+            timers.stop(self.timers.pop(name))
+
+    def stop_timers(self):
+        """Stop all running timers of the sprite"""
+        for name in list(self.timers):
+            self.stop_timer(name)
+
+    def timer_is_up(self, name, callback):
+        """
+        Called by the timer queue when a timer is up
+
+        - name -- (String. Mandatory) The name of the timer
+        - callback -- (Callable or None. Mandatory) The callback given when the timer was started
+
+        Returns: None
+        """
+        del self.timers[name]
+        if callback:
+            callback()
+
+    def wake_up(self):
+        """Wake the sprite up from passed out state. Called when the wake up timer is up."""
+        if not self.is_passed_out():
+            return
+        if self.is_computer_controlled and self.collides(mine.rooms[str(self.in_room)]["ladders"]):
+            activity = Activity.CLIMBING
+        elif self.is_computer_controlled:
+            activity = Activity.WALKING
+        else:
+            activity = Activity.IDLE
+        if self.is_player:
+            self.start_timer("immortality", IMMORTAL_TIME, self.end_immortality)
+        self.image_transparency_val = IMG_SEMI_TRANSPARENCY if self.is_player else IMG_FULLY_OPAQUE
+        self.update(activity)
+
+    def end_immortality(self):
+        """Make the sprite fully opaque again. Called when the immortality timer is up."""
+        self.image_transparency_val = IMG_FULLY_OPAQUE
+        self.image.set_alpha(self.image_transparency_val)
+
     def pass_out(self):
         """Make the sprite pass out, remove one life etc"""
         if self.is_passed_out():
@@ -1195,6 +2700,7 @@ class Sprite(pygame.sprite.Sprite):
                 elif sprite.is_wheelbarrow:
                     activity = activities[sprite.carries_gold_sacks]
                     self.rect.x -= 120 if self.is_facing_left else 0
+                    self.reindex()
 
                 break
 
@@ -1253,7 +2759,8 @@ class Sprite(pygame.sprite.Sprite):
                 self.saved_sprite.h_direction = self.h_direction
                 self.saved_sprite.rect.x = self.rect.x
                 self.saved_sprite.rect.y = self.rect.y
-                if self.is_facing_left and not self.collides(mine.layout_sprite):
+                self.saved_sprite.reindex()
+                if self.is_facing_left and not self.hits_wall():
                     self.move(Direction.RIGHT, 120)
                     self.h_direction = Direction.LEFT
 
@@ -1270,67 +2777,49 @@ class Sprite(pygame.sprite.Sprite):
         return self.activity == Activity.PASSED_OUT
 
     def is_paused(self):
-        return pygame.time.get_ticks() < self.wake_up_time
+        return "wake_up" in self.timers
+
+    def is_immortal(self):
+        return "immortality" in self.timers
 
     def is_walking(self):
-        return self.activity in (
-            Activity.WALKING, Activity.WALKING_WITH_GOLD, Activity.PUSHING_EMPTY_WHEELBARROW,
-            Activity.PUSHING_LOADED_01_WHEELBARROW, Activity.PUSHING_LOADED_02_WHEELBARROW,
-            Activity.PUSHING_LOADED_03_WHEELBARROW)
+        return self.activity & Activity.WALKS
 
     def is_climbing(self):
-        return self.activity in (
-            Activity.CLIMBING, Activity.CLIMBING_WITH_GOLD, Activity.IDLE_CLIMBING, Activity.IDLE_CLIMBING_WITH_GOLD)
+        return self.activity & Activity.CLIMBS
 
     def is_falling(self):
-        return self.activity in (
-            Activity.FALLING, Activity.FALLING_WITH_GOLD, Activity.FALLING_WITH_EMPTY_WHEELBARROW,
-            Activity.FALLING_WITH_LOADED_01_WHEELBARROW, Activity.FALLING_WITH_LOADED_02_WHEELBARROW,
-            Activity.FALLING_WITH_LOADED_03_WHEELBARROW)
+        return self.activity & Activity.FALLS
 
     def is_idle(self):
-        return self.activity in (
-            Activity.IDLE, Activity.IDLE_CLIMBING_WITH_GOLD, Activity.IDLE_CLIMBING, Activity.IDLE_WITH_GOLD,
-            Activity.IDLE_WITH_EMPTY_WHEELBARROW, Activity.IDLE_WITH_LOADED_01_WHEELBARROW,
-            Activity.IDLE_WITH_LOADED_02_WHEELBARROW, Activity.IDLE_WITH_LOADED_03_WHEELBARROW)
+        return self.activity & Activity.IDLES
 
     def is_carrying_gold(self):
-        return self.activity in (
-            Activity.WALKING_WITH_GOLD, Activity.IDLE_WITH_GOLD, Activity.IDLE_CLIMBING_WITH_GOLD,
-            Activity.CLIMBING_WITH_GOLD, Activity.FALLING_WITH_GOLD, Activity.RIDING_ELEVATOR_WITH_GOLD)
+        return self.activity & Activity.WITH_GOLD
 
     def is_pulling_up(self):
         return self.activity == Activity.PULLING_UP
 
     def is_pushing_empty_wheelbarrow(self):
-        return self.activity in (
-            Activity.PUSHING_EMPTY_WHEELBARROW, Activity.IDLE_WITH_EMPTY_WHEELBARROW,
-            Activity.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW, Activity.FALLING_WITH_EMPTY_WHEELBARROW)
+        return self.activity & Activity.WITH_EMPTY_WHEELBARROW
 
     def is_pushing_loaded_01_wheelbarrow(self):
-        return self.activity in (
-            Activity.PUSHING_LOADED_01_WHEELBARROW, Activity.IDLE_WITH_LOADED_01_WHEELBARROW,
-            Activity.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW, Activity.FALLING_WITH_LOADED_01_WHEELBARROW)
+        return self.activity & Activity.WITH_LOADED_01_WHEELBARROW
 
     def is_pushing_loaded_02_wheelbarrow(self):
-        return self.activity in (
-            Activity.PUSHING_LOADED_02_WHEELBARROW, Activity.IDLE_WITH_LOADED_02_WHEELBARROW,
-            Activity.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW, Activity.FALLING_WITH_LOADED_02_WHEELBARROW)
+        return self.activity & Activity.WITH_LOADED_02_WHEELBARROW
 
     def is_pushing_loaded_03_wheelbarrow(self):
-        return self.activity in (
-            Activity.PUSHING_LOADED_03_WHEELBARROW, Activity.IDLE_WITH_LOADED_03_WHEELBARROW,
-            Activity.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW, Activity.FALLING_WITH_LOADED_03_WHEELBARROW)
+        return self.activity & Activity.WITH_LOADED_03_WHEELBARROW
 
     def is_pushing_loaded_wheelbarrow(self):
-        return self.is_pushing_loaded_01_wheelbarrow() or self.is_pushing_loaded_02_wheelbarrow() \
-            or self.is_pushing_loaded_03_wheelbarrow()
+        return self.activity & Activity.WITH_LOADED_WHEELBARROW
 
     def is_pushing_wheelbarrow(self):
-        return self.is_pushing_empty_wheelbarrow() or self.is_pushing_loaded_wheelbarrow()
+        return self.activity & Activity.WITH_WHEELBARROW
 
     def is_loaded(self):
-        return "loaded" in self.activity
+        return self.activity & Activity.LOADED
 
     def is_moving_right(self):
         return self.h_direction == Direction.RIGHT
@@ -1345,6 +2834,878 @@ class Sprite(pygame.sprite.Sprite):
         return self.v_direction == Direction.DOWN
 
 
+class SpriteGroup(pygame.sprite.Group):
+    """
+    Sprite group that keeps its sprites in a spatial hash, i.e. a uniform grid of cells, so that collision queries only
+    need to test the sprites in the cells the querying sprite covers instead of every sprite in the group. Sprites that
+    move must be reindexed (Sprite.reindex) whenever their position changes. The version of the group is counted up
+    whenever a sprite is added, removed or reindexed.
+    """
+
+    def __init__(self, *sprites, cell_size=SPATIAL_HASH_CELL_PIX):
+        """
+        - sprites -- (Objects. Optional) Sprites to add to the group
+        - cell_size -- (Integer. Optional. Defaults to SPATIAL_HASH_CELL_PIX) The width and height of a grid cell
+        """
+        self.cell_size = cell_size
+        self.cells = {}
+        self.sprite_cells = {}
+        self.order = {}
+        self.counter = itertools.count()
+        self.version = 0
+        super().__init__(*sprites)
+
+    def add_internal(self, sprite, *args):
+        super().add_internal(sprite, *args)
+        self.order[sprite] = next(self.counter)
+        self.index(sprite)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        for cell in self.sprite_cells.pop(sprite, ()):
+            self.cells[cell].discard(sprite)
+        self.order.pop(sprite, None)
+        self.version += 1
+
+    def cells_covered(self, sprite):
+        """
+        Get the grid cells covered by a sprite's masks
+
+        - sprite -- (Object. Mandatory) The sprite
+
+        Returns: Tuple. The (column, row) of each cell.
+        """
+        x, y = sprite.rect.topleft
+        width, height = map(max, sprite.mask.get_size(), sprite.body_mask.get_size())
+        return tuple(itertools.product(
+            range(x // self.cell_size, (x + width - 1) // self.cell_size + 1),
+            range(y // self.cell_size, (y + height - 1) // self.cell_size + 1)))
+
+    def collisions(self, sprite):
+        """
+        Find the sprites in the group that collide with a sprite
+
+        - sprite -- (Object. Mandatory) The sprite to check for collision against
+
+        Returns: List. The colliding sprites in the order they were added to the group, same as
+            pygame.sprite.spritecollide.
+        """
+        candidates = set()
+        for cell in self.cells_covered(sprite):
+            candidates.update(self.cells.get(cell, ()))
+        return sorted((s for s in candidates if collide_masks(sprite, s)), key=self.order.get)
+
+    def index(self, sprite):
+        """
+        Put a sprite in the grid cells it covers
+
+        - sprite -- (Object. Mandatory) A sprite in the group
+
+        Returns: None
+        """
+        self.version += 1
+        cells = self.cells_covered(sprite)
+        old_cells = self.sprite_cells.get(sprite, ())
+        if cells == old_cells:
+            return
+        for cell in old_cells:
+            self.cells[cell].discard(sprite)
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(sprite)
+        self.sprite_cells[sprite] = cells
+
+
+class PassiveSprites(object):
+    """
+    Array-backed state of the sprites in a room that can't climb, i.e. gold sacks, trucks and wheelbarrows, so that
+    gravity, the drift of falling sprites and the screen boundaries are applied to all of them in one pass. Positions,
+    directions, fall distances, activities and animation times are held in NumPy arrays, one element per sprite, and a
+    pass works on the arrays against tables of where the walls of the room are. The sprites are views of the arrays:
+    only the ones whose state changes in a pass are written to, and their animations are only updated when they change
+    or the next animation frame is due.
+
+    The arrays are read from the sprites again when a sprite is added to, removed from or moved in one of the groups
+    outside of a pass, see SpriteGroup. Activities, e.g. of a truck gold is dropped in, and whether a sprite rides an
+    elevator are changed in place by the rest of the game and are therefore read in every pass.
+    """
+    NO_WALL = 2 ** 15 - 1
+
+    def __init__(self, groups, walls):
+        """
+        - groups -- (List. Mandatory) The sprite groups, e.g. the gold sacks, trucks and wheelbarrows of a room
+        - walls -- (pygame.mask.Mask. Mandatory) The collision bitmap of the room
+        """
+        self.groups = groups
+        self.walls = walls
+        self.walls_below = None
+        self.walls_left = None
+        self.walls_right = None
+        self.activities = {}
+        self.versions = None
+        self.sprites = []
+        self.masks = []
+        self.mask_ids = None
+        self.runs = {}
+        self.x = None
+        self.y = None
+        self.half_width = None
+        self.h_direction = None
+        self.v_direction = None
+        self.is_facing_down = None
+        self.fall_pix = None
+        self.max_control = None
+        self.activity = None
+        self.next_img = None
+        self.looked_up_activity = None
+        self.falling_activity = None
+        self.stopped_activity = None
+        self.is_bounded = None
+        self.is_never_passive = None
+        self.is_fresh = None
+
+    def __len__(self):
+        return sum(len(group) for group in self.groups)
+
+    def find_runs(self, vertical):
+        """
+        Make the tables of the runs of set pixels in the body masks of all sprites, one after the other. A mask without
+        any is given one far outside of the room.
+
+        - vertical -- (Boolean. Mandatory) True for runs along the columns of the masks, False for runs along the rows
+
+        Returns: Tuple. (sprites, lines, starts, ends, offsets), numpy.ndarrays. For each run the index of its sprite,
+            the column or row it's on and its first and last pixel along it, and for each sprite where its runs start.
+        """
+        runs = []
+        for mask in self.masks:
+            lines, starts, ends = mask_runs(mask, vertical)
+            runs.append((lines, starts, ends) if len(lines) else ([-self.NO_WALL], [0], [0]))
+        counts = numpy.array([len(runs[mask_id][0]) for mask_id in self.mask_ids.tolist()], dtype=int)
+        sprites = numpy.repeat(numpy.arange(len(counts)), counts)
+        lines, starts, ends = (numpy.concatenate(
+            [runs[mask_id][i] for mask_id in self.mask_ids.tolist()] + [[]]).astype(int) for i in range(3))
+        return sprites, lines, starts, ends, numpy.cumsum(counts) - counts
+
+    def find_walls(self):
+        """
+        Make the tables of the nearest wall pixel below, to the left of and to the right of every pixel in the room, or
+        NO_WALL if there is none. They take a few MB per room so they are made the first time they are needed.
+        """
+        walls = mask_to_array(self.walls)
+        xs = numpy.arange(walls.shape[0], dtype=numpy.int16)[:, None]
+        ys = numpy.arange(walls.shape[1], dtype=numpy.int16)[None, :]
+        self.walls_below = numpy.minimum.accumulate(
+            numpy.where(walls, ys, self.NO_WALL).astype(numpy.int16)[:, ::-1], axis=1)[:, ::-1]
+        self.walls_right = numpy.minimum.accumulate(
+            numpy.where(walls, xs, self.NO_WALL).astype(numpy.int16)[::-1], axis=0)[::-1]
+        self.walls_left = numpy.maximum.accumulate(numpy.where(walls, xs, -self.NO_WALL).astype(numpy.int16), axis=0)
+
+    def read(self):
+        """Read the state of the sprites in the groups into the arrays. All of them are updated in the next pass."""
+        self.sprites = [spr for group in self.groups for spr in group.sprites()]
+        masks = {}
+        self.mask_ids = numpy.array([masks.setdefault(spr.body_mask, len(masks)) for spr in self.sprites], dtype=int)
+        self.masks = list(masks)
+        self.runs = {vertical: self.find_runs(vertical) for vertical in (True, False)}
+        self.x = numpy.array([spr.rect.x for spr in self.sprites], dtype=int)
+        self.y = numpy.array([spr.rect.y for spr in self.sprites], dtype=int)
+        self.half_width = numpy.array([spr.rect.width // 2 for spr in self.sprites], dtype=int)
+        self.h_direction = numpy.array([spr.h_direction for spr in self.sprites], dtype=int)
+        self.v_direction = numpy.array([spr.v_direction for spr in self.sprites], dtype=int)
+        self.is_facing_down = numpy.array([bool(spr.is_facing_down) for spr in self.sprites], dtype=bool)
+        self.fall_pix = numpy.array([spr.fall_pix for spr in self.sprites], dtype=int)
+        self.max_control = numpy.array([spr.max_control_while_falling_pix for spr in self.sprites], dtype=int)
+        self.activity = numpy.array([spr.activity for spr in self.sprites], dtype=int)
+        self.next_img = numpy.array([spr.next_img for spr in self.sprites], dtype=int)
+        self.looked_up_activity = self.activity.copy()
+        self.falling_activity, self.stopped_activity = self.find_activities(
+            numpy.arange(len(self.sprites)), self.activity)
+        self.is_bounded = numpy.array([not spr.ignore_screen_boundaries for spr in self.sprites], dtype=bool)
+        self.is_never_passive = numpy.array([bool(spr.stops) for spr in self.sprites], dtype=bool) | (
+            (self.h_direction & Direction.HORIZONTAL) == 0)
+        self.is_fresh = numpy.ones(len(self.sprites), dtype=bool)
+        self.versions = [group.version for group in self.groups]
+
+    def apply_gravity(self, steps):
+        """
+        Apply gravity to all sprites in one pass, and move the ones that are falling sideways. Does the same to each
+        sprite as a move downwards with Sprite.move followed, if the sprite is falling, by a move in the direction it's
+        facing, see move_sprites.
+
+        - steps -- (Integer. Mandatory) The number of frames to move the sprites for
+
+        Returns: List. The sprites that are left out and must be moved one at a time, i.e. the ones that ride an
+            elevator, walk, climb or stop at stop points.
+        """
+        if self.versions != [group.version for group in self.groups]:
+            self.read()
+        if not self.sprites:
+            return []
+        if self.walls_below is None:
+            self.find_walls()
+        activity = numpy.array([spr.activity for spr in self.sprites], dtype=int)
+        is_looked_up = activity == self.looked_up_activity
+        if not is_looked_up.all():
+            rows = numpy.flatnonzero(~is_looked_up)
+            self.falling_activity[rows], self.stopped_activity[rows] = self.find_activities(rows, activity[rows])
+            self.looked_up_activity[rows] = activity[rows]
+        is_left_out = self.is_never_passive | ((activity & (Activity.CLIMBS | Activity.WALKS)) != 0) | numpy.array(
+            [bool(spr.is_riding_elevator) for spr in self.sprites], dtype=bool)
+
+        # Every sprite is moved in the arrays, but the ones that are left out are neither written nor kept
+        x, y, is_bounded = self.x, self.y, self.is_bounded
+        center = x + self.half_width
+        bottom_limit = SCREEN_SIZE[1] - SPRITE_SIZE[1]
+
+        # Move down to the first pixel where the sprite hits a floor or ends up outside of the screen
+        speed = GRAVITY * steps
+        free = self.first_overlaps(x, y, Direction.DOWN, speed) - 1
+        free = numpy.maximum(numpy.where(is_bounded, numpy.minimum(free, numpy.minimum(
+            self.free_pix_within(center, 0, SCREEN_SIZE[0]), self.free_pix_within(y, 1, bottom_limit))), free), 0)
+        new_y = y + free
+        is_counted = self.is_facing_down & (free > 0)
+        fall_pix = self.fall_pix + numpy.where(is_counted, free, 0)
+        fallen_activity = numpy.where(is_counted & (fall_pix >= self.max_control), self.falling_activity, activity)
+        is_stopped = free < speed
+        is_outside = is_bounded & (
+            (center <= 0) | (center >= SCREEN_SIZE[0]) | (new_y + 1 <= 0) | (new_y + 1 >= bottom_limit))
+        has_landed = is_stopped & ~is_outside
+        has_bounced = is_stopped & is_outside
+        fall_pix[has_landed] = 0
+        fallen_activity = numpy.where(has_landed & (self.stopped_activity != 0), self.stopped_activity, fallen_activity)
+        v_direction = numpy.where(has_bounced, Direction.UP, Direction.DOWN)
+        h_direction = numpy.where(has_bounced, self.h_direction ^ Direction.HORIZONTAL, self.h_direction)
+
+        # Falling sprites drift sideways in the direction they're facing. A sprite that hits a wall stays where it was.
+        is_drifting = ((fallen_activity & Activity.FALLS) != 0) & ~is_left_out
+        new_x, new_h_direction, new_v_direction = x, h_direction, v_direction
+        new_activity = fallen_activity
+        if is_drifting.any():
+            drifting = numpy.flatnonzero(is_drifting)
+            new_x, new_h_direction, new_v_direction = x.copy(), h_direction.copy(), v_direction.copy()
+            new_activity = fallen_activity.copy()
+            speed = HORIZONTAL_FALL_SPEED * steps
+            sign = numpy.where(h_direction[drifting] == Direction.RIGHT, 1, -1)
+            free = numpy.empty(len(drifting), dtype=int)
+            for direction, members in (
+                    (Direction.RIGHT, numpy.flatnonzero(sign > 0)), (Direction.LEFT, numpy.flatnonzero(sign < 0))):
+                free[members] = self.first_overlaps(x, new_y, direction, speed, drifting[members]) - 1
+            drift_center, drift_y = center[drifting], new_y[drifting]
+            free = numpy.maximum(numpy.where(is_bounded[drifting], numpy.minimum(free, numpy.minimum(
+                self.free_pix_within(drift_center, sign, SCREEN_SIZE[0]),
+                self.free_pix_within(drift_y, 0, bottom_limit))), free), 0)
+            is_stopped = free < speed
+            step_center = drift_center + sign * (free + 1)
+            is_outside = is_bounded[drifting] & (
+                (step_center <= 0) | (step_center >= SCREEN_SIZE[0]) | (drift_y <= 0) | (drift_y >= bottom_limit))
+            has_hit_wall = is_stopped & ~is_outside
+            has_bounced = is_stopped & is_outside
+            new_x[drifting] = numpy.where(has_hit_wall, x[drifting], x[drifting] + sign * free)
+            new_h_direction[drifting] = numpy.where(
+                has_bounced, h_direction[drifting] ^ Direction.HORIZONTAL, h_direction[drifting])
+            new_v_direction[drifting] = numpy.where(
+                has_bounced, v_direction[drifting] ^ Direction.VERTICAL, v_direction[drifting])
+            _, stopped_activity = self.find_activities(drifting, fallen_activity[drifting])
+            new_activity[drifting] = numpy.where(
+                has_hit_wall & (stopped_activity != 0), stopped_activity, fallen_activity[drifting])
+
+        # Write the new state to the sprites that have changed or whose next animation frame is due
+        has_moved = (new_x != x) | (new_y != y)
+        is_changed = has_moved | is_drifting | self.is_fresh | (fallen_activity != activity) | (
+            activity != self.activity) | (self.next_img <= clock.get_ticks()) | (
+            new_h_direction != self.h_direction) | (new_v_direction != self.v_direction) | (fall_pix != self.fall_pix)
+        changed = numpy.flatnonzero(is_changed & ~is_left_out)
+        for i, spr_x, spr_y, h, v, new_h, new_v, spr_fall_pix, fallen, new, drifts, moved in zip(
+                changed.tolist(), new_x[changed].tolist(), new_y[changed].tolist(), h_direction[changed].tolist(),
+                v_direction[changed].tolist(), new_h_direction[changed].tolist(), new_v_direction[changed].tolist(),
+                fall_pix[changed].tolist(), fallen_activity[changed].tolist(), new_activity[changed].tolist(),
+                is_drifting[changed].tolist(), has_moved[changed].tolist()):
+            spr = self.sprites[i]
+            spr.rect.y = spr_y
+            spr.fall_pix = spr_fall_pix
+            spr.h_direction, spr.v_direction = h, v
+            spr.update(fallen)
+            if drifts:
+                spr.rect.x = spr_x
+                spr.h_direction, spr.v_direction = new_h, new_v
+                spr.update(new)
+            if moved:
+                spr.reindex()
+
+        # Keep the arrays in step with the sprites. They are read again if any sprites were left out.
+        if is_left_out.any():
+            self.versions = None
+            return [self.sprites[i] for i in numpy.flatnonzero(is_left_out).tolist()]
+        self.x, self.y, self.fall_pix = new_x, new_y, fall_pix
+        self.h_direction, self.v_direction = new_h_direction, new_v_direction
+        self.is_facing_down = new_v_direction == Direction.DOWN
+        self.activity = activity
+        if len(changed):
+            self.activity[changed] = [self.sprites[i].activity for i in changed.tolist()]
+            self.next_img[changed] = [self.sprites[i].next_img for i in changed.tolist()]
+        self.is_fresh[:] = False
+        self.versions = [group.version for group in self.groups]
+        return []
+
+    def find_activities(self, indexes, activities):
+        """
+        Look up the activity of each sprite when it loses control while falling and when it's stopped, see
+        Sprite.get_falling_activity and Sprite.get_stopped_activity. For sprites that don't walk or climb they only
+        depend on the activity and on whether the sprite is a wheelbarrow so they are worked out once per combination.
+
+        - indexes -- (numpy.ndarray. Mandatory) The sprites, by their index in the arrays
+        - activities -- (numpy.ndarray. Mandatory) The activity of each sprite
+
+        Returns: Tuple. (numpy.ndarray of falling activities, numpy.ndarray of stopped activities). A stopped activity
+            is 0 if the activity doesn't change. Both are 0 for sprites that walk or climb.
+        """
+        falling, stopped = [], []
+        for i, activity in zip(indexes.tolist(), activities.tolist()):
+            spr = self.sprites[i]
+            key = (spr.is_wheelbarrow, activity)
+            if key not in self.activities:
+                if activity & (Activity.CLIMBS | Activity.WALKS):
+                    self.activities[key] = (0, 0)
+                else:
+                    current_activity = spr.activity
+                    spr.activity = activity
+                    self.activities[key] = (spr.get_falling_activity(), spr.get_stopped_activity() or 0)
+                    spr.activity = current_activity
+            falling_activity, stopped_activity = self.activities[key]
+            falling.append(falling_activity)
+            stopped.append(stopped_activity)
+        return numpy.array(falling, dtype=int), numpy.array(stopped, dtype=int)
+
+    def first_overlaps(self, x, y, direction, pix, indexes=None):
+        """
+        Find the first pixel along a straight move where the body mask of each sprite overlaps the walls, for many
+        sprites at once. Same as first_overlap, but instead of sweeping the masks the nearest wall is looked up for
+        the pixel in front of every run of set pixels in the masks, see find_runs.
+
+        - x -- (numpy.ndarray. Mandatory) The horizontal positions of all sprites before the move
+        - y -- (numpy.ndarray. Mandatory) The vertical positions of all sprites before the move
+        - direction -- (Integer. Mandatory) Direction.DOWN, Direction.LEFT or Direction.RIGHT
+        - pix -- (Integer. Mandatory) The number of pixels to move
+        - indexes -- (numpy.ndarray. Optional. Defaults to None) The sprites to return the result for, by their index
+            in the arrays. All of them if None.
+
+        Returns: numpy.ndarray. The number of pixels moved when each mask first overlaps the walls or pix + 1 if it
+            doesn't overlap at all.
+        """
+        width, height = self.walls_below.shape
+        sprites, lines, starts, ends, offsets = self.runs[direction == Direction.DOWN]
+        x, y = x[sprites], y[sprites]
+        if direction == Direction.DOWN:
+            columns, rows = x + lines, y + starts + 1
+            is_inside = (columns >= 0) & (columns < width) & (rows < height)
+            walls = self.look_up_walls(self.walls_below, columns, rows)
+            pixels = numpy.where(is_inside, walls, self.NO_WALL) - (y + ends)
+        elif direction == Direction.RIGHT:
+            columns, rows = x + starts + 1, y + lines
+            is_inside = (rows >= 0) & (rows < height) & (columns < width)
+            walls = self.look_up_walls(self.walls_right, columns, rows)
+            pixels = numpy.where(is_inside, walls, self.NO_WALL) - (x + ends)
+        else:
+            columns, rows = x + ends - 1, y + lines
+            is_inside = (rows >= 0) & (rows < height) & (columns >= 0)
+            walls = self.look_up_walls(self.walls_left, columns, rows)
+            pixels = (x + starts) - numpy.where(is_inside, walls, -self.NO_WALL)
+        first = numpy.minimum(numpy.minimum.reduceat(numpy.maximum(pixels, 1), offsets), pix + 1)
+        return first if indexes is None else first[indexes]
+
+    @classmethod
+    def free_pix_within(cls, positions, direction, limit):
+        """
+        Same as free_pix_within, for many positions at once
+
+        - positions -- (numpy.ndarray. Mandatory) The current positions
+        - direction -- (Integer or numpy.ndarray. Mandatory) Movement per pixel. -1, 0 or 1.
+        - limit -- (Integer. Mandatory) The upper limit
+
+        Returns: numpy.ndarray. NO_WALL stands in for infinity.
+        """
+        moved = positions + direction
+        if isinstance(direction, int):
+            free = limit - positions - 1 if direction == 1 else positions - 1 if direction == -1 else cls.NO_WALL
+        else:
+            free = numpy.where(
+                direction == 1, limit - positions - 1, numpy.where(direction == -1, positions - 1, cls.NO_WALL))
+        return numpy.where((moved > 0) & (moved < limit), free, 0)
+
+    @staticmethod
+    def look_up_walls(walls, columns, rows):
+        """
+        Look up pixels in one of the tables of the nearest walls. Pixels outside of the room are moved to its edge.
+
+        - walls -- (numpy.ndarray. Mandatory) The table, e.g. walls_below
+        - columns -- (numpy.ndarray. Mandatory) The horizontal positions of the pixels
+        - rows -- (numpy.ndarray. Mandatory) The vertical positions of the pixels
+
+        Returns: numpy.ndarray. The values in the table.
+        """
+        width, height = walls.shape
+        return walls[
+            numpy.minimum(numpy.maximum(columns, 0), width - 1), numpy.minimum(numpy.maximum(rows, 0), height - 1)]
+
+
+class SpriteAtlas(object):
+    """
+    A few large surfaces (pages) holding all animation frames. Frames are packed row by row (shelf packing) and handed
+    out as subsurfaces, so all frames share the pixel buffers of the pages and are blitted from the same source
+    surfaces.
+    """
+
+    def __init__(self, page_size=ATLAS_PAGE_SIZE):
+        """
+        - page_size -- (Tuple. Optional. Defaults to ATLAS_PAGE_SIZE) The width and height of each page
+        """
+        self.page_size = page_size
+        self.pages = []
+        self.animations = {}
+        self.x = 0
+        self.y = 0
+        self.shelf_height = 0
+
+    def add(self, image):
+        """
+        Copy an image into the atlas. Requires the screen to be set up.
+
+        - image -- (pygame.Surface. Mandatory) The image to add
+
+        Returns: pygame.Surface. A subsurface of the page where the image was put. Images larger than a page are
+            returned as they are.
+        """
+        width, height = image.get_size()
+        if width > self.page_size[0] or height > self.page_size[1]:
+            return image
+
+        # Start a new shelf when the current one is full and a new page when there's no room for another shelf
+        if self.x + width > self.page_size[0]:
+            self.x, self.y, self.shelf_height = 0, self.y + self.shelf_height, 0
+        if not self.pages or self.y + height > self.page_size[1]:
+            self.pages.append(pygame.Surface(self.page_size).convert())
+            self.pages[-1].fill(Color.WHITE)
+            self.x, self.y, self.shelf_height = 0, 0, 0
+
+        self.pages[-1].blit(image, (self.x, self.y))
+        frame = self.pages[-1].subsurface((self.x, self.y, width, height))
+        self.x += width
+        self.shelf_height = max(self.shelf_height, height)
+        return frame
+
+
+class SpriteAnimations(dict):
+    """
+    Registry of the animations of all sprites, by sprite name. The animations of a sprite are looked up the first time
+    the sprite name is requested and the images of each animation are loaded the first time a sprite needs them.
+    """
+
+    def __init__(self, specs):
+        """
+        - specs -- (Dict. Mandatory) The arguments for load_images (except the sprite name) by activity by sprite name
+        """
+        super().__init__()
+        self.specs = specs
+
+    def __missing__(self, name):
+        if name not in self.specs:
+            raise KeyError(name)
+        self[name] = AnimationSet(name, self.specs[name])
+        return self[name]
+
+    def activities(self, name, names):
+        """
+        List the activities of a sprite that can happen in a mine with the given sprites. The player only pushes a
+        wheelbarrow in mines with wheelbarrows and only rides an elevator in mines with elevators.
+
+        - name -- (String. Mandatory) The name of the sprite. Use SpriteName enum.
+        - names -- (Collection. Mandatory) The names of all sprites in the mine
+
+        Returns: List. Activity codes. Empty if the sprite has no animations.
+        """
+        activities = list(self.specs.get(name, {}))
+        if name == SpriteName.PLAYER and SpriteName.WHEELBARROW not in names:
+            activities = [a for a in activities if not a & Activity.WITH_WHEELBARROW]
+        if name == SpriteName.PLAYER and SpriteName.ELEVATOR not in names:
+            riding_elevator = (
+                Activity.IDLE_RIDING_ELEVATOR, Activity.RIDING_ELEVATOR_WITH_GOLD,
+                Activity.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW, Activity.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW,
+                Activity.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW,
+                Activity.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW)
+            activities = [a for a in activities if a not in riding_elevator]
+        return activities
+
+    def prefetch(self, names):
+        """
+        Start decoding the images of the animations the given sprites can use in a mine with them in the loader thread
+        pool. Safe to call from a worker thread.
+
+        - names -- (Collection. Mandatory) The names of all sprites in the mine. Names without animations are ignored.
+
+        Returns: None
+        """
+        for name in names:
+            for activity in self.activities(name, names):
+                spec = self.specs[name][activity]
+                folder, size, files = animation_files(spec[0], name, *spec[1:])
+                if (folder, size) not in atlas.animations:
+                    prefetch_images([(f, size) for f in files])
+
+    def preload(self, names):
+        """
+        Load the animations the given sprites can use in a mine with them, see activities. All images are decoded in
+        parallel in the loader thread pool. Any other animation is still loaded the first time a sprite needs it.
+
+        - names -- (Collection. Mandatory) The names of all sprites in the mine. Names without animations are ignored.
+
+        Returns: None
+        """
+        self.prefetch(names)
+        for name in names:
+            if name in self.specs:
+                self[name].preload(self.activities(name, names))
+
+
+class AnimationSet(dict):
+    """The animations of a sprite, by activity. An animation is loaded the first time it is requested."""
+
+    def __init__(self, name, specs):
+        """
+        - name -- (String. Mandatory) The name of the sprite. Use SpriteName enum.
+        - specs -- (Dict. Mandatory) The arguments for load_images (except the sprite name) by activity
+        """
+        super().__init__()
+        self.name = name
+        self.specs = specs
+
+    def __missing__(self, activity):
+        if activity not in self.specs:
+            raise KeyError(activity)
+        self[activity] = load_images(self.specs[activity][0], self.name, *self.specs[activity][1:])
+        return self[activity]
+
+    def preload(self, activities=None):
+        """
+        Load animations that haven't been loaded yet
+
+        - activities -- (Iterable. Optional. Defaults to all activities of the sprite) The activities to load
+
+        Returns: None
+        """
+        for activity in self.specs if activities is None else activities:
+            self[activity]
+
+
+class LadderExits(object):
+    """Table of the positions along a ladder where a climbing sprite can exit the ladder to the left or to the right"""
+
+    def __init__(self, ladder, walls, height=SPRITE_SIZE[1], max_offset=MINER_SPEED):
+        """
+        - ladder -- (Object. Mandatory) The ladder sprite
+        - walls -- (pygame.mask.Mask. Mandatory) The collision bitmap of the room
+        - height -- (Integer. Optional. Defaults to SPRITE_SIZE[1]) The height of the climbing sprites
+        - max_offset -- (Integer. Optional. Defaults to MINER_SPEED) The maximum distance between the horizontal center
+            of the ladder and the horizontal center of a sprite that climbs it. Sprites start climbing when they are
+            closer to the center than their speed.
+        """
+        self.height = height
+
+        # The positions (horizontal center and top of the sprite) a sprite can have while climbing the ladder
+        self.rect = pygame.Rect(
+            ladder.rect.center[0] - max_offset + 1, ladder.rect.y - height, max_offset * 2,
+            ladder.rect.height + height + 1)
+
+        # One bit for each position. Set if the way out is blocked.
+        left, right = ladder_exit_masks(height)
+        self.left_blocked = self.blocked_positions(walls, left, -SPRITE_SIZE[0])
+        self.right_blocked = self.blocked_positions(walls, right, 0)
+
+    def blocked_positions(self, walls, exit_mask, x_offset):
+        """
+        Find the positions where an exit mask overlaps the walls
+
+        - walls -- (pygame.mask.Mask. Mandatory) The collision bitmap of the room
+        - exit_mask -- (pygame.mask.Mask. Mandatory) The exit mask to check
+        - x_offset -- (Integer. Mandatory) The horizontal position of the exit mask relative to the sprite's center
+
+        Returns: pygame.mask.Mask. A bit is set for each position within self.rect where the exit is blocked.
+        """
+        x, y = self.rect.x + x_offset, self.rect.y
+        width, height = exit_mask.get_size()
+        area = pygame.mask.Mask((self.rect.width + width - 1, self.rect.height + height - 1))
+        area.draw(walls, (-x, -y))
+        return area.convolve(exit_mask, None, (1 - width, 1 - height))
+
+    def can_exit(self, x_pos, y_pos):
+        """
+        Check whether a climbing sprite can exit the ladder to the left and to the right
+
+        - x_pos -- (Integer. Mandatory) The horizontal center of the sprite. Must be within self.rect.
+        - y_pos -- (Integer. Mandatory) The top of the sprite. Must be within self.rect.
+
+        Returns: Tuple. (can exit left, can exit right)
+        """
+        position = (x_pos - self.rect.x, y_pos - self.rect.y)
+        can_exit_left = SPRITE_SIZE[0] <= x_pos and not self.left_blocked.get_at(position)
+        can_exit_right = x_pos <= SCREEN_SIZE[0] - SPRITE_SIZE[0] and not self.right_blocked.get_at(position)
+        return can_exit_left, can_exit_right
+
+
+class NavigationGraph(object):
+    """
+    Graph of the places in a mine where a sprite can stand and the ways between them, i.e. walking along floors,
+    climbing ladders, riding elevators and going through exits. Nodes are tuples (room number, x, y) where x is the
+    horizontal center and y the bottom of a sprite standing there.
+    """
+
+    def __init__(self, rooms, height=SPRITE_SIZE[1]):
+        """
+        - rooms -- (Dictionary. Mandatory) The rooms of a mine as loaded by Mines.load
+        - height -- (Integer. Optional. Defaults to SPRITE_SIZE[1]) The height of the sprites that use the graph
+        """
+        self.height = height
+        self.edges = {}
+        self.floors = {}
+        self.nodes = {}
+        for r in rooms:
+            self.add_floors(int(r), rooms[r]["walls"])
+        for r in rooms:
+            for ladder in rooms[r]["ladders"].sprites():
+                if not ladder.is_placeholder:
+                    self.add_ladder(int(r), ladder)
+            for elevator in rooms[r]["elevators"].sprites():
+                self.add_shaft(int(r), elevator.rect.center[0], elevator.stops)
+        for r in rooms:
+            for exit_ in rooms[r]["exits"].sprites():
+                if not exit_.is_placeholder:
+                    self.add_exit(int(r), exit_)
+
+        # Paths are looked up far more often than the mine changes so keep the most recent ones
+        self.shortest_path = functools.lru_cache(maxsize=NAV_PATH_CACHE_SIZE)(self.find_shortest_path)
+        self.reachable = functools.lru_cache(maxsize=NAV_PATH_CACHE_SIZE)(self.find_reachable)
+
+    def add_edge(self, node_01, node_02, cost, both_ways=True):
+        """
+        Connect two nodes
+
+        - node_01 -- (Tuple. Mandatory) The node the edge starts in
+        - node_02 -- (Tuple. Mandatory) The node the edge ends in
+        - cost -- (Integer. Mandatory) The cost of going between the nodes, e.g. the distance in pixels
+        - both_ways -- (Boolean. Optional. Defaults to True) Also connect node_02 to node_01. Exits only lead one way.
+
+        Returns: None
+        """
+        self.edges[node_01][node_02] = cost
+        if both_ways:
+            self.edges[node_02][node_01] = cost
+
+    def add_floors(self, room_no, walls):
+        """
+        Add a node in every NAV_GRID_PIX:th pixel column where there is a floor with enough headroom to stand on, and
+        connect nodes in neighbouring columns that are close enough in height to walk between
+
+        - room_no -- (Integer. Mandatory) The room number
+        - walls -- (pygame.mask.Mask. Mandatory) The collision bitmap of the room
+
+        Returns: None
+        """
+        # Floor pixels, i.e. wall pixels with a free pixel above, in the sampled columns
+        floors = walls.copy()
+        floors.erase(walls, (0, 1))
+        column = pygame.mask.Mask((1, SCREEN_SIZE[1]), fill=True)
+        columns = pygame.mask.Mask(SCREEN_SIZE)
+        for x in range(NAV_GRID_PIX // 2, SCREEN_SIZE[0], NAV_GRID_PIX):
+            columns.draw(column, (x, 0))
+        floors = floors.overlap_mask(columns, (0, 0))
+
+        headroom = pygame.mask.Mask((1, self.height), fill=True)
+        self.floors[room_no] = {}
+        for rect in floors.get_bounding_rects():
+            x, y = rect.topleft
+            if y >= self.height and not walls.overlap(headroom, (x, y - self.height)):
+                self.floors[room_no].setdefault(x, []).append((room_no, x, y))
+                self.add_node((room_no, x, y))
+
+        for x, nodes in self.floors[room_no].items():
+            for node_01, node_02 in itertools.product(nodes, self.floors[room_no].get(x + NAV_GRID_PIX, [])):
+                if abs(node_01[2] - node_02[2]) <= NAV_GRID_PIX:
+                    self.add_edge(node_01, node_02, NAV_GRID_PIX + abs(node_01[2] - node_02[2]))
+
+    def add_exit(self, room_no, exit_):
+        """
+        Connect the nodes where a sprite touches an exit with the node closest to where the exit leads to
+
+        - room_no -- (Integer. Mandatory) The room number
+        - exit_ -- (Object. Mandatory) The exit sprite
+
+        Returns: None
+        """
+        to_room = exit_.leads_to["room"]
+        target = self.nearest_node(
+            to_room, exit_.leads_to["x"] + SPRITE_SIZE[0] // 2, exit_.leads_to["y"] + self.height)
+        if not target:
+            return
+        # Floor nodes are sampled so allow for the last few pixels up to a side exit
+        exit_rect = exit_.rect.inflate(NAV_GRID_PIX * 2, 0)
+        for node in self.nodes[room_no]:
+            _, x, y = node
+            if exit_rect.colliderect((x - SPRITE_SIZE[0] // 2, y - self.height, SPRITE_SIZE[0], self.height)):
+                self.add_edge(node, target, NAV_GRID_PIX, both_ways=False)
+
+    def add_ladder(self, room_no, ladder):
+        """
+        Add a node at both ends of the ladder and where it passes each floor next to it and connect the nodes along
+        the ladder
+
+        - room_no -- (Integer. Mandatory) The room number
+        - ladder -- (Object. Mandatory) The ladder sprite
+
+        Returns: None
+        """
+        levels = set(
+            y for _, x, y in self.floor_nodes(room_no) if abs(x - ladder.rect.center[0]) <= SPRITE_SIZE[0]
+            and ladder.rect.top - NAV_GRID_PIX <= y <= ladder.rect.bottom + NAV_GRID_PIX)
+        levels.update((ladder.rect.top, ladder.rect.bottom))
+        self.add_shaft(room_no, ladder.rect.center[0], levels)
+
+    def add_shaft(self, room_no, x_pos, levels):
+        """
+        Add nodes at the given levels of a ladder or an elevator shaft, chain them vertically and connect each of them
+        with the floors next to it
+
+        - room_no -- (Integer. Mandatory) The room number
+        - x_pos -- (Integer. Mandatory) The horizontal center of the ladder or the shaft
+        - levels -- (Iterable. Mandatory) The vertical positions where sprites can get on and off
+
+        Returns: None
+        """
+        nodes = [(room_no, x_pos, y) for y in sorted(levels)]
+        for node in nodes:
+            self.add_node(node)
+            for floor in self.floor_nodes(room_no):
+                if abs(floor[1] - x_pos) <= SPRITE_SIZE[0] and abs(floor[2] - node[2]) <= NAV_GRID_PIX:
+                    self.add_edge(node, floor, abs(floor[1] - x_pos) + abs(floor[2] - node[2]))
+        for node_01, node_02 in zip(nodes, nodes[1:]):
+            self.add_edge(node_01, node_02, node_02[2] - node_01[2])
+
+    def find_reachable(self, start):
+        """
+        Find every node that can be reached from a node
+
+        - start -- (Tuple. Mandatory) The start node
+
+        Returns: Frozenset. The reachable nodes including the start node
+        """
+        found = {start}
+        to_visit = [start]
+        while to_visit:
+            for node in self.edges.get(to_visit.pop(), {}):
+                if node not in found:
+                    found.add(node)
+                    to_visit.append(node)
+        return frozenset(found)
+
+    def find_shortest_path(self, start, end):
+        """
+        Find the shortest path between two nodes (Dijkstra)
+
+        - start -- (Tuple. Mandatory) The start node
+        - end -- (Tuple. Mandatory) The end node
+
+        Returns: Tuple. The nodes along the path including start and end. Empty if there is no path.
+        """
+        costs = {start: 0}
+        previous = {}
+        queue = [(0, start)]
+        while queue:
+            cost, node = heapq.heappop(queue)
+            if node == end:
+                path = [end]
+                while path[-1] != start:
+                    path.append(previous[path[-1]])
+                return tuple(reversed(path))
+            if cost > costs[node]:
+                continue
+            for next_node, step_cost in self.edges.get(node, {}).items():
+                if cost + step_cost < costs.get(next_node, cost + step_cost + 1):
+                    costs[next_node] = cost + step_cost
+                    previous[next_node] = node
+                    heapq.heappush(queue, (cost + step_cost, next_node))
+        return ()
+
+    def add_node(self, node):
+        """
+        Add a node to the graph unless it's already in it
+
+        - node -- (Tuple. Mandatory) The node: (room number, x, y)
+
+        Returns: None
+        """
+        if node not in self.edges:
+            self.edges[node] = {}
+            self.nodes.setdefault(node[0], []).append(node)
+
+    def floor_nodes(self, room_no):
+        """
+        List the nodes on the floors of a room
+
+        - room_no -- (Integer. Mandatory) The room number
+
+        Returns: List. The nodes
+        """
+        return [node for nodes in self.floors.get(room_no, {}).values() for node in nodes]
+
+    def nearest_node(self, room_no, x_pos, y_pos):
+        """
+        Find the node closest to a position. Nodes on or below the position are preferred since that is where a sprite
+        in the air will end up.
+
+        - room_no -- (Integer. Mandatory) The room number
+        - x_pos -- (Integer. Mandatory) The horizontal center of the sprite
+        - y_pos -- (Integer. Mandatory) The bottom of the sprite
+
+        Returns: Tuple or None. The node or None if the room has no nodes.
+        """
+        nodes = self.nodes.get(room_no, [])
+        below = [n for n in nodes if n[2] >= y_pos - NAV_GRID_PIX]
+        nodes = below if below else nodes
+        if not nodes:
+            return None
+        return min(nodes, key=lambda n: (n[1] - x_pos) ** 2 + (n[2] - y_pos) ** 2)
+
+    def path(self, from_room, from_pos, to_room, to_pos):
+        """
+        Find the shortest path between two positions in the mine
+
+        - from_room -- (Integer. Mandatory) The room to start in
+        - from_pos -- (Tuple. Mandatory) The horizontal center and bottom of the sprite to start from
+        - to_room -- (Integer. Mandatory) The room to go to
+        - to_pos -- (Tuple. Mandatory) The horizontal center and bottom of the sprite to go to
+
+        Returns: Tuple. The nodes along the path. Empty if there is no path.
+        """
+        start = self.nearest_node(from_room, *from_pos)
+        end = self.nearest_node(to_room, *to_pos)
+        if not start or not end:
+            return ()
+        return self.shortest_path(start, end)
+
+    def is_reachable(self, from_room, from_pos, to_room, to_pos):
+        """
+        Check whether a position in the mine can be reached from another
+
+        - from_room -- (Integer. Mandatory) The room to start in
+        - from_pos -- (Tuple. Mandatory) The horizontal center and bottom of the sprite to start from
+        - to_room -- (Integer. Mandatory) The room to go to
+        - to_pos -- (Tuple. Mandatory) The horizontal center and bottom of the sprite to go to
+
+        Returns: Boolean
+        """
+        start = self.nearest_node(from_room, *from_pos)
+        end = self.nearest_node(to_room, *to_pos)
+        return bool(start and end) and end in self.reachable(start)
+
+
 class OnScreenTexts(object):
 
     def __init__(self, text, center=None, x=None, y=None, right=None, bottom=None, size=30):
@@ -1359,11 +3720,11 @@ class OnScreenTexts(object):
         - bottom -- (Integer. Optional. Defaults to None) Position of text
         - size -- (Integer. Optional. Defaults to 30) The font size
         """
-        default_font = "comicsansms"
-        font_name = default_font if default_font in pygame.font.get_fonts() else "freesansbold.ttf"
-        self.font = pygame.font.SysFont(font_name, size)
-        self.font.set_bold(True)
+        self.font = load_font(size)
+        self.glyph_atlas = load_glyph_atlas(size)
         self.original_text = text
+        self.original_parts = list(string.Formatter().parse(text))
+        self.renders = {}
         self.text = self.font.render(text, True, Color.GREEN)
         self.rect = self.text.get_rect()
         self.rect.center = center if center else self.rect.center
@@ -1372,9 +3733,32 @@ class OnScreenTexts(object):
         self.rect.right = right if right else self.rect.right
         self.rect.bottom = bottom if bottom else self.rect.bottom
 
+    def render(self, *args):
+        """
+        Render the original text formatted with the given values. The parts of the original text are rendered once and
+        the values are composed from the glyph atlas. Renders are cached per formatted text.
+
+        - args -- (Objects. Optional) The values to put in the original text
+
+        Returns: pygame.Surface
+        """
+        text = self.original_text.format(*args)
+        if text not in self.renders:
+            if len(self.renders) >= TEXT_CACHE_SIZE:
+                self.renders.clear()
+            values = iter(args)
+            parts = []
+            for literal, field, spec, conversion in self.original_parts:
+                if literal:
+                    parts.append(self.glyph_atlas.render_text(literal))
+                if field is not None:
+                    parts.extend(self.glyph_atlas.compose(format(next(values), spec)))
+            self.renders[text] = self.glyph_atlas.join(parts)
+        return self.renders[text]
+
     def update(self, *args, get_rect=False):
         """Updates and returns a formatted copy of the original text"""
-        self.text = self.font.render(self.original_text.format(*args), True, Color.GREEN)
+        self.text = self.render(*args)
         if get_rect:
             center = self.rect.center
             self.rect = self.text.get_rect()
@@ -1382,8 +3766,525 @@ class OnScreenTexts(object):
         return self.text
 
 
+class Display(object):
+    """
+    Updates the display, either by flipping the whole screen every frame or, when drawing dirty rectangles, by only
+    restoring the background under and updating the parts of the screen that were drawn on in this or the previous frame
+    """
+
+    def __init__(self, dirty_rects=DIRTY_RECTS):
+        """
+        - dirty_rects -- (Boolean. Optional. Defaults to DIRTY_RECTS constant value) Draw dirty rectangles instead of
+            flipping the whole screen
+        """
+        self.dirty_rects = dirty_rects
+        self.background = None
+        self.overlay = None
+        self.previous_rects = []
+        self.rects = []
+        self.previous_room = None
+        self.previous_positions = {}
+        self.progress = 1
+
+    def blit(self, source, position):
+        """
+        Draw an image on the screen and remember the area drawn on
+
+        - source -- (Surface. Mandatory) The image to draw
+        - position -- (Tuple or Rect. Mandatory) Where to draw the image
+
+        Returns: None
+        """
+        self.rects.append(screen.blit(source, position))
+
+    def draw(self, group):
+        """
+        Draw all sprites in a group on the screen and remember the areas drawn on
+
+        - group -- (Object. Mandatory) A sprite group
+
+        Returns: None
+        """
+        self.rects.extend(screen.blits([(spr.image, self.position(spr)) for spr in group.sprites()]))
+
+    def draw_background(self, background):
+        """
+        Start a new frame by drawing the background. When drawing dirty rectangles on the same background as in the
+        previous frame only the areas drawn on in the previous frame are restored.
+
+        - background -- (Surface. Mandatory) A full screen background
+
+        Returns: None
+        """
+        if self.dirty_rects and background is self.background:
+            for rect in self.previous_rects:
+                screen.blit(background, rect, rect)
+        else:
+            screen.blit(background, (0, 0))
+            self.previous_rects = [screen.get_rect()]
+        self.background = background
+        self.overlay = None
+
+    def position(self, sprite):
+        """
+        Get where to draw a sprite. Sprites are drawn between where they were before and after the last simulation
+        step, as far as the simulation has progressed towards the next step, so that they move smoothly when the display
+        is updated more often than the game is simulated. Sprites that jump, e.g. when the player enters another room,
+        are drawn where they are.
+
+        - sprite -- (Object. Mandatory) The sprite
+
+        Returns: Tuple or Rect
+        """
+        previous = self.previous_positions.get(sprite)
+        if not previous or self.previous_room != mine.room:
+            return sprite.rect
+        dx = sprite.rect.x - previous[0]
+        dy = sprite.rect.y - previous[1]
+        if abs(dx) > INTERPOLATION_MAX_PIX or abs(dy) > INTERPOLATION_MAX_PIX:
+            return sprite.rect
+        return previous[0] + round(dx * self.progress), previous[1] + round(dy * self.progress)
+
+    def remember_positions(self, groups):
+        """
+        Remember where the sprites in the current room are before the next simulation step
+
+        - groups -- (List. Mandatory) The sprite groups that are drawn
+
+        Returns: None
+        """
+        self.previous_room = mine.room
+        self.previous_positions = {spr: spr.rect.topleft for group in groups for spr in group.sprites()}
+
+    def show_overlay(self, overlay):
+        """
+        Check whether an overlay, e.g. the pause or the game over screen, has to be drawn. When drawing dirty
+        rectangles an overlay is only drawn once since it doesn't change while it's shown.
+
+        - overlay -- (Object. Mandatory) Anything that identifies the overlay, e.g. its on-screen text
+
+        Returns: Boolean
+        """
+        if self.dirty_rects and overlay is self.overlay:
+            return False
+        self.overlay = overlay
+        self.background = None
+        return True
+
+    def update(self):
+        """Update the display with the frame drawn since the background was drawn"""
+        if self.dirty_rects:
+            pygame.display.update(self.previous_rects + self.rects)
+            self.previous_rects = self.rects
+        else:
+            pygame.display.flip()
+        self.rects = []
+
+
+class GlyphAtlas(object):
+    """
+    The glyphs of the characters that numbers are made of, rendered once to a single surface. Numbers that change all
+    the time, e.g. the time left, are composed from these glyphs instead of being rendered by the font.
+    """
+
+    def __init__(self, font, characters="0123456789,.-/ "):
+        """
+        - font -- (pygame.font.Font. Mandatory) The font to render the glyphs with
+        - characters -- (String. Optional. Defaults to digits, separators and signs) The characters to put in the atlas
+        """
+        self.font = font
+        self.texts = {}
+        glyphs = [font.render(c, True, Color.GREEN) for c in characters]
+        self.surface = pygame.Surface(
+            (sum(g.get_width() for g in glyphs), max(g.get_height() for g in glyphs)), flags=pygame.SRCALPHA)
+        self.glyphs = {}
+        x = 0
+        for c, glyph in zip(characters, glyphs):
+            self.surface.blit(glyph, (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            self.glyphs[c] = self.surface.subsurface((x, 0) + glyph.get_size())
+            x += glyph.get_width()
+
+    def compose(self, text):
+        """
+        Get the glyphs a text is made of. Texts with characters missing from the atlas are rendered by the font.
+
+        - text -- (String. Mandatory) The text, e.g. a number
+
+        Returns: List. Surfaces to join
+        """
+        if all(c in self.glyphs for c in text):
+            return [self.glyphs[c] for c in text]
+        return [self.render_text(text)]
+
+    def join(self, parts):
+        """
+        Put rendered texts and glyphs next to each other on a new surface
+
+        - parts -- (List. Mandatory) Rendered texts and glyphs
+
+        Returns: pygame.Surface
+        """
+        x = 0
+        height = 0
+        blits = []
+        for part in parts:
+            blits.append((part, (x, 0), None, pygame.BLEND_RGBA_MAX))
+            x += part.get_width()
+            height = max(height, part.get_height())
+        joined = pygame.Surface((x, height), flags=pygame.SRCALPHA)
+        joined.blits(blits, doreturn=False)
+        return joined
+
+    def render_text(self, text):
+        """
+        Render a text by the font. Each text is only rendered once.
+
+        - text -- (String. Mandatory) The text
+
+        Returns: pygame.Surface
+        """
+        if text not in self.texts:
+            self.texts[text] = self.font.render(text, True, Color.GREEN)
+        return self.texts[text]
+
+
+class GameClock(object):
+    """
+    Clock that all game timers refer to. The game is simulated in fixed time steps of 1/FPS seconds and the game clock
+    advances one step at a time, no matter how often the display is updated or how long a step takes to simulate.
+    """
+
+    def __init__(self, step_ms=1000 // FPS):
+        """
+        - step_ms -- (Integer. Optional. Defaults to 1/FPS seconds) The number of milliseconds of a simulation step
+        """
+        self.clock = pygame.time.Clock()
+        self.step_ms = step_ms
+        self.ticks = 0
+        self.time = 0
+
+    def tick(self):
+        """
+        Advance the game clock one simulation step. Should be called once per step.
+
+        Returns: Integer. The number of milliseconds the clock was advanced
+        """
+        self.time = self.step_ms
+        self.ticks += self.time
+        return self.time
+
+    def wait(self, framerate=0):
+        """
+        Wait for the next display frame
+
+        - framerate -- (Integer. Optional. Defaults to 0) Limit the frame rate. 0 means no limit.
+
+        Returns: Integer. The number of real milliseconds passed since the previous frame
+        """
+        return self.clock.tick(framerate)
+
+    def get_ticks(self):
+        """Returns the number of game milliseconds passed since the clock was created"""
+        return self.ticks
+
+    def get_time(self):
+        """Returns the number of milliseconds the clock was advanced on the last tick"""
+        return self.time
+
+
+class Timers(object):
+    """
+    Priority queue of timers that run on the game clock. A timer calls a callback when it's up, so nothing needs to
+    check the clock every frame while waiting for it.
+    """
+
+    def __init__(self):
+        self.queue = []
+        self.counter = itertools.count()
+
+    def run(self):
+        """Call the callbacks of all timers that are up, in the order they were due. Should be called once per frame."""
+        now = clock.get_ticks()
+        while self.queue and self.queue[0][0] <= now:
+            due, _, callback, args = heapq.heappop(self.queue)
+            if callback:
+                callback(*args)
+
+    def start(self, delay_ms, callback, *args):
+        """
+        Start a timer
+
+        - delay_ms -- (Integer. Mandatory) The number of game milliseconds until the timer is up
+        - callback -- (Callable. Mandatory) Called when the timer is up
+        - args -- (Objects. Optional) Arguments to call the callback with
+
+        Returns: List. The timer. Use it to stop the timer.
+        """
+        timer = [clock.get_ticks() + delay_ms, next(self.counter), callback, args]
+        heapq.heappush(self.queue, timer)
+        return timer
+
+    def stop(self, timer):
+        """
+        Stop a timer. It's left in the queue but won't call its callback.
+
+        - timer -- (List. Mandatory) A timer returned by start
+
+        Returns: None
+        """
+        timer[2] = None
+
+
+class InputLog(object):
+    """
+    Log of the player's input in every simulation step and the seed of the random number generator, so that a game
+    session can be played again exactly as it was played. The log is stored as a header (magic, version, seed, start
+    mine) followed by runs of steps with the same input (input, number of steps). The input is one byte with a bit per
+    arrow key and one for the interact keys.
+    """
+    HEADER = struct.Struct("<4sHQB")
+    RUN = struct.Struct("<BH")
+    KEYS = (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_UP, pygame.K_DOWN)
+    INTERACT = 1 << len(KEYS)
+
+    def __init__(self, seed, mine_=START_MINE, runs=None):
+        """
+        - seed -- (Integer. Mandatory) The seed of the random number generator
+        - mine_ -- (Integer. Optional. Defaults to START_MINE) The mine the session starts in
+        - runs -- (List. Optional. Defaults to None) Runs of steps with the same input: [input, number of steps]
+        """
+        self.seed = seed
+        self.mine = mine_
+        self.runs = runs or []
+        self.file = None
+
+    def open(self, path):
+        """
+        Start writing the log to a file. Every run of steps is written as soon as it's over so that as much as possible
+        of the log is kept if the game crashes.
+
+        - path -- (String. Mandatory) The file
+
+        Returns: InputLog. Itself
+        """
+        self.file = open(path, "wb")
+        self.file.write(self.HEADER.pack(INPUT_LOG_MAGIC, INPUT_LOG_VERSION, self.seed, self.mine))
+        self.file.flush()
+        return self
+
+    def close(self):
+        """Write the last run of steps and close the file"""
+        if self.file:
+            if self.runs:
+                self.file.write(self.RUN.pack(*self.runs[-1]))
+            self.file.close()
+            self.file = None
+
+    def record(self, key_press, interact_key_pressed):
+        """
+        Add the input of one simulation step
+
+        - key_press -- (Sequence. Mandatory) The state of all keys, indexed by key
+        - interact_key_pressed -- (Boolean. Mandatory) True if the player has pressed an interact key
+
+        Returns: None
+        """
+        value = sum(1 << i for i, key in enumerate(self.KEYS) if key_press[key])
+        value |= self.INTERACT if interact_key_pressed else 0
+        if self.runs and self.runs[-1][0] == value and self.runs[-1][1] < 0xFFFF:
+            self.runs[-1][1] += 1
+            return
+        if self.runs and self.file:
+            self.file.write(self.RUN.pack(*self.runs[-1]))
+            self.file.flush()
+        self.runs.append([value, 1])
+
+    def replay(self):
+        """
+        Generator function that plays the input back, one simulation step at a time
+
+        Yields: Tuple. (key presses, True if an interact key is pressed) for key_presses
+        """
+        key_press = collections.defaultdict(bool)
+        for value, steps in self.runs:
+            key_press.clear()
+            key_press.update({key: True for i, key in enumerate(self.KEYS) if value & (1 << i)})
+            for _ in range(steps):
+                yield key_press, bool(value & self.INTERACT)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a log from a file
+
+        - path -- (String. Mandatory) The file
+
+        Returns: InputLog
+        """
+        with open(path, "rb") as file:
+            data = file.read()
+        if len(data) < cls.HEADER.size:
+            raise ValueError(f"{path} is not an input log")
+        magic, version, seed, mine_ = cls.HEADER.unpack_from(data)
+        if magic != INPUT_LOG_MAGIC or version != INPUT_LOG_VERSION:
+            raise ValueError(f"{path} is not an input log of version {INPUT_LOG_VERSION}")
+        body = data[cls.HEADER.size:len(data) - (len(data) - cls.HEADER.size) % cls.RUN.size]
+        return cls(seed, mine_, [list(run) for run in cls.RUN.iter_unpack(body)])
+
+
+class StateTrace(object):
+    """
+    Trace of the world state after every simulation step, to prove that a change doesn't change how the game plays.
+    Every step is written as a rolling hash of the world state so far followed by a hash of each field of the state in
+    that step, so that two traces can be compared to find the first step and the fields that differ. The hashes are
+    CRC-32s, which are cheap enough to compute in every step.
+    """
+    HEADER = struct.Struct("<4sHB")
+    FIELDS = (
+        "rect", "activity", "h_direction", "v_direction", "fall_pix", "carries_gold_sacks", "in_room", "timers",
+        "mine")
+    GROUPS = ("players", "miners", "gold_sacks", "trucks", "wheelbarrows", "elevators")
+    RECORD = struct.Struct(f"<{len(FIELDS) + 1}I")
+
+    def __init__(self):
+        self.file = None
+        self.hash = 0
+
+    def open(self, path):
+        """
+        Start writing the trace to a file
+
+        - path -- (String. Mandatory) The file
+
+        Returns: StateTrace. Itself
+        """
+        self.file = open(path, "wb")
+        self.file.write(self.HEADER.pack(STATE_TRACE_MAGIC, STATE_TRACE_VERSION, len(self.FIELDS)))
+        return self
+
+    def close(self):
+        """Close the file"""
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def hash_fields(self):
+        """
+        Hash each field of the world state: the sprites in all rooms of the mine, the timers and the state of the mine
+
+        Returns: List. A CRC-32 per field, in the order of FIELDS
+        """
+        sprites = [
+            spr for r in sorted(mine.rooms, key=int) for group in self.GROUPS for spr in mine.rooms[r][group].sprites()]
+        values = (
+            [v for spr in sprites for v in spr.rect],
+            [spr.activity for spr in sprites],
+            [spr.h_direction for spr in sprites],
+            [spr.v_direction for spr in sprites],
+            [spr.fall_pix for spr in sprites],
+            [spr.carries_gold_sacks for spr in sprites],
+            [int(spr.in_room or 0) for spr in sprites])
+        hashes = [zlib.crc32(array.array("d", v).tobytes()) for v in values]
+        hashes.append(zlib.crc32(repr([
+            (name, timer[0]) for spr in sprites for name, timer in sorted(spr.timers.items())]).encode()))
+        hashes.append(zlib.crc32(array.array("d", (
+            mine.mine, mine.room, mine.bonus, mine.gold_delivered, mine.times_caught, mine.seconds_remaining,
+            mine.player.lives, clock.get_ticks())).tobytes()))
+        return hashes
+
+    def write(self):
+        """Write the hashes of the world state after a simulation step. Should be called once per step."""
+        hashes = self.hash_fields()
+        self.hash = zlib.crc32(self.RECORD.pack(self.hash, *hashes))
+        self.file.write(self.RECORD.pack(self.hash, *hashes))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a trace from a file
+
+        - path -- (String. Mandatory) The file
+
+        Returns: List. A tuple per step: (rolling hash, the hash of each field)
+        """
+        with open(path, "rb") as file:
+            data = file.read()
+        if len(data) < cls.HEADER.size:
+            raise ValueError(f"{path} is not a world state trace")
+        magic, version, fields = cls.HEADER.unpack_from(data)
+        if magic != STATE_TRACE_MAGIC or version != STATE_TRACE_VERSION or fields != len(cls.FIELDS):
+            raise ValueError(f"{path} is not a world state trace of version {STATE_TRACE_VERSION}")
+        body = data[cls.HEADER.size:len(data) - (len(data) - cls.HEADER.size) % cls.RECORD.size]
+        return list(cls.RECORD.iter_unpack(body))
+
+
 # Enums
 class Activity(object):
+    """
+    Activity codes. The low bits tell the activities apart and the high bits are traits shared by several activities,
+    e.g. all activities where the sprite carries a gold sack, so that checking for a trait is a single bit test. The
+    animation of an activity and the name used for it in the mine files is the Animation enum with the same name.
+    """
+
+    # Traits
+    CLIMBS = 1 << 8
+    FALLS = 1 << 9
+    IDLES = 1 << 10
+    WALKS = 1 << 11
+    WITH_GOLD = 1 << 12
+    WITH_EMPTY_WHEELBARROW = 1 << 13
+    WITH_LOADED_01_WHEELBARROW = 1 << 14
+    WITH_LOADED_02_WHEELBARROW = 1 << 15
+    WITH_LOADED_03_WHEELBARROW = 1 << 16
+    LOADED = 1 << 17
+    WITH_LOADED_WHEELBARROW = WITH_LOADED_01_WHEELBARROW | WITH_LOADED_02_WHEELBARROW | WITH_LOADED_03_WHEELBARROW
+    WITH_WHEELBARROW = WITH_EMPTY_WHEELBARROW | WITH_LOADED_WHEELBARROW
+    CARRIES = WITH_GOLD | WITH_WHEELBARROW
+
+    # Activities. Static sprites have no activity.
+    NONE = 0
+    CLIMBING = 1 | CLIMBS
+    CLIMBING_UP = 2
+    CLIMBING_DOWN = 3
+    CLIMBING_WITH_GOLD = 4 | CLIMBS | WITH_GOLD
+    FALLING = 5 | FALLS
+    FALLING_WITH_GOLD = 6 | FALLS | WITH_GOLD
+    FALLING_WITH_EMPTY_WHEELBARROW = 7 | FALLS | WITH_EMPTY_WHEELBARROW
+    FALLING_WITH_LOADED_01_WHEELBARROW = 8 | FALLS | WITH_LOADED_01_WHEELBARROW | LOADED
+    FALLING_WITH_LOADED_02_WHEELBARROW = 9 | FALLS | WITH_LOADED_02_WHEELBARROW | LOADED
+    FALLING_WITH_LOADED_03_WHEELBARROW = 10 | FALLS | WITH_LOADED_03_WHEELBARROW | LOADED
+    IDLE = 11 | IDLES
+    IDLE_CLIMBING = 12 | IDLES | CLIMBS
+    IDLE_CLIMBING_WITH_GOLD = 13 | IDLES | CLIMBS | WITH_GOLD
+    IDLE_RIDING_ELEVATOR = 14
+    IDLE_WITH_EMPTY_WHEELBARROW = 15 | IDLES | WITH_EMPTY_WHEELBARROW
+    IDLE_WITH_GOLD = 16 | IDLES | WITH_GOLD
+    IDLE_WITH_LOADED_01_WHEELBARROW = 17 | IDLES | WITH_LOADED_01_WHEELBARROW | LOADED
+    IDLE_WITH_LOADED_02_WHEELBARROW = 18 | IDLES | WITH_LOADED_02_WHEELBARROW | LOADED
+    IDLE_WITH_LOADED_03_WHEELBARROW = 19 | IDLES | WITH_LOADED_03_WHEELBARROW | LOADED
+    LOADED_01 = 20 | LOADED
+    LOADED_02 = 21 | LOADED
+    LOADED_03 = 22 | LOADED
+    LOADED_04 = 23 | LOADED
+    LOADED_05 = 24 | LOADED
+    PAUSED = 25
+    PASSED_OUT = 26
+    PULLING_UP = 27
+    PUSHING_EMPTY_WHEELBARROW = 28 | WALKS | WITH_EMPTY_WHEELBARROW
+    PUSHING_LOADED_01_WHEELBARROW = 29 | WALKS | WITH_LOADED_01_WHEELBARROW | LOADED
+    PUSHING_LOADED_02_WHEELBARROW = 30 | WALKS | WITH_LOADED_02_WHEELBARROW | LOADED
+    PUSHING_LOADED_03_WHEELBARROW = 31 | WALKS | WITH_LOADED_03_WHEELBARROW | LOADED
+    RIDING_CART = 32
+    RIDING_ELEVATOR_WITH_GOLD = 33 | WITH_GOLD
+    RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW = 34 | WITH_EMPTY_WHEELBARROW
+    RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW = 35 | WITH_LOADED_01_WHEELBARROW | LOADED
+    RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW = 36 | WITH_LOADED_02_WHEELBARROW | LOADED
+    RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW = 37 | WITH_LOADED_03_WHEELBARROW | LOADED
+    WALKING = 38 | WALKS
+    WALKING_WITH_GOLD = 39 | WALKS | WITH_GOLD
+
+
+class Animation(object):
     CLIMBING = "climbing"
     CLIMBING_UP = "climbing_up"
     CLIMBING_DOWN = "climbing_down"
@@ -1425,10 +4326,6 @@ class Activity(object):
     WALKING_WITH_GOLD = "walking_with_gold"
 
 
-class Animation(Activity):
-    pass
-
-
 class Color(object):
     BLACK = (0, 0, 0)
     BLUE = (0, 0, 255)
@@ -1437,54 +4334,69 @@ class Color(object):
     WHITE = (255, 255, 255)
 
 
+class Context(object):
+    FLOOR = 0
+    LADDER = 1
+    ELEVATOR = 2
+
+
+class Control(object):
+    NONE = 0
+    HORIZONTAL = 1
+    VERTICAL = 2
+
+
 class Direction(object):
-    DOWN = "down"
-    LEFT = "left"
-    RIGHT = "right"
-    UP = "up"
-    NONE = "none"
+    DOWN = 1
+    LEFT = 2
+    RIGHT = 4
+    UP = 8
+    NONE = 16
+    HORIZONTAL = LEFT | RIGHT
+    VERTICAL = UP | DOWN
 
 
 class Folder(object):
+    ASSET_CACHE = "cache" + os.sep
     IMAGES = "images" + os.sep
     LAYOUTS = IMAGES + "layouts" + os.sep
     MINES = "mines" + os.sep
     SPRITES = IMAGES + "sprites" + os.sep
     TEXTURES = IMAGES + "textures" + os.sep
-    CLIMBING_IMGS = SPRITES + "{}" + os.sep + Activity.CLIMBING + os.sep
-    CLIMBING_UP_IMGS = SPRITES + "{}" + os.sep + Activity.CLIMBING_UP + os.sep
-    CLIMBING_DOWN_IMGS = SPRITES + "{}" + os.sep + Activity.CLIMBING_DOWN + os.sep
-    CLIMBING_WITH_GOLD_IMGS = SPRITES + "{}" + os.sep + Activity.CLIMBING_WITH_GOLD + os.sep
-    IDLE_IMGS = SPRITES + "{}" + os.sep + Activity.IDLE + os.sep
-    IDLE_CLIMBING_IMGS = SPRITES + "{}" + os.sep + Activity.IDLE_CLIMBING + os.sep
-    IDLE_CLIMBING_WITH_GOLD_IMGS = SPRITES + "{}" + os.sep + Activity.IDLE_CLIMBING_WITH_GOLD + os.sep
-    IDLE_RIDING_ELEVATOR_IMGS = SPRITES + "{}" + os.sep + Activity.IDLE_RIDING_ELEVATOR + os.sep
-    IDLE_WITH_EMPTY_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Activity.IDLE_WITH_EMPTY_WHEELBARROW + os.sep
-    IDLE_WITH_GOLD_IMGS = SPRITES + "{}" + os.sep + Activity.IDLE_WITH_GOLD + os.sep
-    IDLE_WITH_LOADED_01_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Activity.IDLE_WITH_LOADED_01_WHEELBARROW + os.sep
-    IDLE_WITH_LOADED_02_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Activity.IDLE_WITH_LOADED_02_WHEELBARROW + os.sep
-    IDLE_WITH_LOADED_03_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Activity.IDLE_WITH_LOADED_03_WHEELBARROW + os.sep
-    LOADED_01 = SPRITES + "{}" + os.sep + Activity.LOADED_01 + os.sep
-    LOADED_02 = SPRITES + "{}" + os.sep + Activity.LOADED_02 + os.sep
-    LOADED_03 = SPRITES + "{}" + os.sep + Activity.LOADED_03 + os.sep
-    LOADED_04 = SPRITES + "{}" + os.sep + Activity.LOADED_04 + os.sep
-    LOADED_05 = SPRITES + "{}" + os.sep + Activity.LOADED_05 + os.sep
-    PUSHING_EMPTY_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Activity.PUSHING_EMPTY_WHEELBARROW + os.sep
-    PUSHING_LOADED_01_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Activity.PUSHING_LOADED_01_WHEELBARROW + os.sep
-    PUSHING_LOADED_02_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Activity.PUSHING_LOADED_02_WHEELBARROW + os.sep
-    PUSHING_LOADED_03_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Activity.PUSHING_LOADED_03_WHEELBARROW + os.sep
-    PASSED_OUT_IMGS = SPRITES + "{}" + os.sep + Activity.PASSED_OUT + os.sep
+    CLIMBING_IMGS = SPRITES + "{}" + os.sep + Animation.CLIMBING + os.sep
+    CLIMBING_UP_IMGS = SPRITES + "{}" + os.sep + Animation.CLIMBING_UP + os.sep
+    CLIMBING_DOWN_IMGS = SPRITES + "{}" + os.sep + Animation.CLIMBING_DOWN + os.sep
+    CLIMBING_WITH_GOLD_IMGS = SPRITES + "{}" + os.sep + Animation.CLIMBING_WITH_GOLD + os.sep
+    IDLE_IMGS = SPRITES + "{}" + os.sep + Animation.IDLE + os.sep
+    IDLE_CLIMBING_IMGS = SPRITES + "{}" + os.sep + Animation.IDLE_CLIMBING + os.sep
+    IDLE_CLIMBING_WITH_GOLD_IMGS = SPRITES + "{}" + os.sep + Animation.IDLE_CLIMBING_WITH_GOLD + os.sep
+    IDLE_RIDING_ELEVATOR_IMGS = SPRITES + "{}" + os.sep + Animation.IDLE_RIDING_ELEVATOR + os.sep
+    IDLE_WITH_EMPTY_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Animation.IDLE_WITH_EMPTY_WHEELBARROW + os.sep
+    IDLE_WITH_GOLD_IMGS = SPRITES + "{}" + os.sep + Animation.IDLE_WITH_GOLD + os.sep
+    IDLE_WITH_LOADED_01_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Animation.IDLE_WITH_LOADED_01_WHEELBARROW + os.sep
+    IDLE_WITH_LOADED_02_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Animation.IDLE_WITH_LOADED_02_WHEELBARROW + os.sep
+    IDLE_WITH_LOADED_03_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Animation.IDLE_WITH_LOADED_03_WHEELBARROW + os.sep
+    LOADED_01 = SPRITES + "{}" + os.sep + Animation.LOADED_01 + os.sep
+    LOADED_02 = SPRITES + "{}" + os.sep + Animation.LOADED_02 + os.sep
+    LOADED_03 = SPRITES + "{}" + os.sep + Animation.LOADED_03 + os.sep
+    LOADED_04 = SPRITES + "{}" + os.sep + Animation.LOADED_04 + os.sep
+    LOADED_05 = SPRITES + "{}" + os.sep + Animation.LOADED_05 + os.sep
+    PUSHING_EMPTY_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Animation.PUSHING_EMPTY_WHEELBARROW + os.sep
+    PUSHING_LOADED_01_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Animation.PUSHING_LOADED_01_WHEELBARROW + os.sep
+    PUSHING_LOADED_02_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Animation.PUSHING_LOADED_02_WHEELBARROW + os.sep
+    PUSHING_LOADED_03_WHEELBARROW_IMGS = SPRITES + "{}" + os.sep + Animation.PUSHING_LOADED_03_WHEELBARROW + os.sep
+    PASSED_OUT_IMGS = SPRITES + "{}" + os.sep + Animation.PASSED_OUT + os.sep
     RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW_IMGS = \
-        SPRITES + "{}" + os.sep + Activity.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW + os.sep
-    RIDING_ELEVATOR_WITH_GOLD_IMGS = SPRITES + "{}" + os.sep + Activity.RIDING_ELEVATOR_WITH_GOLD + os.sep
+        SPRITES + "{}" + os.sep + Animation.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW + os.sep
+    RIDING_ELEVATOR_WITH_GOLD_IMGS = SPRITES + "{}" + os.sep + Animation.RIDING_ELEVATOR_WITH_GOLD + os.sep
     RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW_IMGS = \
-        SPRITES + "{}" + os.sep + Activity.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW + os.sep
+        SPRITES + "{}" + os.sep + Animation.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW + os.sep
     RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW_IMGS = \
-        SPRITES + "{}" + os.sep + Activity.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW + os.sep
+        SPRITES + "{}" + os.sep + Animation.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW + os.sep
     RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW_IMGS = \
-        SPRITES + "{}" + os.sep + Activity.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW + os.sep
-    WALKING_IMGS = SPRITES + "{}" + os.sep + Activity.WALKING + os.sep
-    WALKING_WITH_GOLD_IMGS = SPRITES + "{}" + os.sep + Activity.WALKING_WITH_GOLD + os.sep
+        SPRITES + "{}" + os.sep + Animation.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW + os.sep
+    WALKING_IMGS = SPRITES + "{}" + os.sep + Animation.WALKING + os.sep
+    WALKING_WITH_GOLD_IMGS = SPRITES + "{}" + os.sep + Animation.WALKING_WITH_GOLD + os.sep
 
 
 class FileName(object):
@@ -1492,6 +4404,11 @@ class FileName(object):
     PLACEHOLDER_IMG = Folder.IDLE_IMGS.format("placeholder") + "001.png"
 
 
+class Policy(object):
+    IDLE = "idle"
+    RANDOM = "random"
+
+
 class SpriteName(object):
     CART = "cart"
     ELEVATOR = "elevator"
@@ -1530,96 +4447,90 @@ class Text(object):
     OUT_OF_TIME = "TIME'S UP!"
 
 
-# Load sprite animation images and store in a dict
-SPRITE_ANIMATIONS = {
-    SpriteName.ELEVATOR: {
-        Animation.IDLE: load_images(Animation.IDLE, SpriteName.ELEVATOR)},
-    SpriteName.GOLD: {
-        Animation.IDLE: load_images(Animation.IDLE, SpriteName.GOLD),
-        Animation.FALLING: load_images(Animation.IDLE, SpriteName.GOLD)},
-    SpriteName.MINER: {
-        Animation.CLIMBING: load_images(Animation.CLIMBING, SpriteName.MINER),
-        Animation.FALLING: load_images(Animation.IDLE, SpriteName.MINER),
-        Animation.IDLE: load_images(Animation.IDLE, SpriteName.MINER),
-        Animation.PASSED_OUT: load_images(Animation.PASSED_OUT, SpriteName.MINER),
-        Animation.WALKING: load_images(Animation.WALKING, SpriteName.MINER)},
-    SpriteName.PLAYER: {
-        Animation.CLIMBING: load_images(Animation.CLIMBING, SpriteName.PLAYER),
-        Animation.CLIMBING_WITH_GOLD: load_images(Animation.CLIMBING_WITH_GOLD, SpriteName.PLAYER),
-        Animation.FALLING: load_images(Animation.IDLE, SpriteName.PLAYER),
-        Animation.FALLING_WITH_GOLD: load_images(Animation.IDLE_WITH_GOLD, SpriteName.PLAYER),
-        Animation.FALLING_WITH_EMPTY_WHEELBARROW: load_images(
-            Animation.IDLE_WITH_EMPTY_WHEELBARROW, SpriteName.PLAYER, multiply_x_by=2),
-        Animation.FALLING_WITH_LOADED_01_WHEELBARROW: load_images(
-            Animation.IDLE_WITH_LOADED_01_WHEELBARROW, SpriteName.PLAYER, multiply_x_by=2),
-        Animation.FALLING_WITH_LOADED_02_WHEELBARROW: load_images(
-            Animation.IDLE_WITH_LOADED_02_WHEELBARROW, SpriteName.PLAYER, multiply_x_by=2),
-        Animation.FALLING_WITH_LOADED_03_WHEELBARROW: load_images(
-            Animation.IDLE_WITH_LOADED_03_WHEELBARROW, SpriteName.PLAYER, multiply_x_by=2),
-        Animation.IDLE: load_images(Animation.IDLE, SpriteName.PLAYER),
-        Animation.IDLE_CLIMBING: load_images(Animation.IDLE_CLIMBING, SpriteName.PLAYER),
-        Animation.IDLE_CLIMBING_WITH_GOLD: load_images(Animation.IDLE_CLIMBING_WITH_GOLD, SpriteName.PLAYER),
-        Animation.IDLE_RIDING_ELEVATOR: load_images(Animation.IDLE_RIDING_ELEVATOR, SpriteName.PLAYER),
-        Animation.IDLE_WITH_EMPTY_WHEELBARROW: load_images(
-            Animation.IDLE_WITH_EMPTY_WHEELBARROW, SpriteName.PLAYER, multiply_x_by=2),
-        Animation.IDLE_WITH_GOLD: load_images(Animation.IDLE_WITH_GOLD, SpriteName.PLAYER),
-        Animation.IDLE_WITH_LOADED_01_WHEELBARROW: load_images(
-            Animation.IDLE_WITH_LOADED_01_WHEELBARROW, SpriteName.PLAYER, multiply_x_by=2),
-        Animation.IDLE_WITH_LOADED_02_WHEELBARROW: load_images(
-            Animation.IDLE_WITH_LOADED_02_WHEELBARROW, SpriteName.PLAYER, multiply_x_by=2),
-        Animation.IDLE_WITH_LOADED_03_WHEELBARROW: load_images(
-            Animation.IDLE_WITH_LOADED_03_WHEELBARROW, SpriteName.PLAYER, multiply_x_by=2),
-        Animation.PASSED_OUT: load_images(Animation.PASSED_OUT, SpriteName.PLAYER),
-        Animation.PUSHING_EMPTY_WHEELBARROW: load_images(
-            Animation.PUSHING_EMPTY_WHEELBARROW, SpriteName.PLAYER, multiply_x_by=2),
-        Animation.PUSHING_LOADED_01_WHEELBARROW: load_images(
-            Animation.PUSHING_LOADED_01_WHEELBARROW, SpriteName.PLAYER, multiply_x_by=2),
-        Animation.PUSHING_LOADED_02_WHEELBARROW: load_images(
-            Animation.PUSHING_LOADED_02_WHEELBARROW, SpriteName.PLAYER, multiply_x_by=2),
-        Animation.PUSHING_LOADED_03_WHEELBARROW: load_images(
-            Animation.PUSHING_LOADED_03_WHEELBARROW, SpriteName.PLAYER, multiply_x_by=2),
-        Animation.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW: load_images(
-            Animation.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW, SpriteName.PLAYER),
-        Animation.RIDING_ELEVATOR_WITH_GOLD: load_images(
-            Animation.RIDING_ELEVATOR_WITH_GOLD, SpriteName.PLAYER),
-        Animation.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW: load_images(
-            Animation.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW, SpriteName.PLAYER),
-        Animation.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW: load_images(
-            Animation.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW, SpriteName.PLAYER),
-        Animation.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW: load_images(
-            Animation.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW, SpriteName.PLAYER),
-        Animation.WALKING: load_images(Animation.WALKING, SpriteName.PLAYER),
-        Animation.WALKING_WITH_GOLD: load_images(Animation.WALKING_WITH_GOLD, SpriteName.PLAYER)},
-    SpriteName.TRUCK: {
-        Animation.IDLE: load_images(Animation.IDLE, SpriteName.TRUCK, multiply_x_by=4, multiply_y_by=4),
-        Animation.LOADED_01: load_images(Animation.LOADED_01, SpriteName.TRUCK, multiply_x_by=4, multiply_y_by=4),
-        Animation.LOADED_02: load_images(Animation.LOADED_02, SpriteName.TRUCK, multiply_x_by=4, multiply_y_by=4),
-        Animation.LOADED_03: load_images(Animation.LOADED_03, SpriteName.TRUCK, multiply_x_by=4, multiply_y_by=4),
-        Animation.LOADED_04: load_images(Animation.LOADED_04, SpriteName.TRUCK, multiply_x_by=4, multiply_y_by=4),
-        Animation.LOADED_05: load_images(Animation.LOADED_05, SpriteName.TRUCK, multiply_x_by=4, multiply_y_by=4)},
-    SpriteName.WARNING: {
-        Animation.CLIMBING_UP: load_images(Animation.CLIMBING_UP, SpriteName.WARNING),
-        Animation.CLIMBING_DOWN: load_images(Animation.CLIMBING_DOWN, SpriteName.WARNING),
-        Animation.WALKING: load_images(Animation.WALKING, SpriteName.WARNING)},
-    SpriteName.WHEELBARROW: {
-        Animation.IDLE: load_images(Animation.IDLE, SpriteName.WHEELBARROW, multiply_x_by=2),
-        Animation.FALLING: load_images(Animation.IDLE, SpriteName.WHEELBARROW, multiply_x_by=2),
-        Animation.LOADED_01: load_images(Animation.LOADED_01, SpriteName.WHEELBARROW, multiply_x_by=2),
-        Animation.LOADED_02: load_images(Animation.LOADED_02, SpriteName.WHEELBARROW, multiply_x_by=2),
-        Animation.LOADED_03: load_images(Animation.LOADED_03, SpriteName.WHEELBARROW, multiply_x_by=2)}}
-
-# Initialize PyGame
-pygame.init()
-
-# Instantiate clock and set game to running state
-clock = pygame.time.Clock()
-game_is_running = True
-game_is_paused = False
-show_start_screen = SHOW_START_SCREEN
-
-# Load mine 1 and room 1
+# Activity and direction codes by the names used in the mine files
+ACTIVITIES = {
+    getattr(Animation, name): code for name, code in vars(Activity).items()
+    if not name.startswith("_") and hasattr(Animation, name)}
+DIRECTIONS = {"down": Direction.DOWN, "left": Direction.LEFT, "right": Direction.RIGHT, "up": Direction.UP,
+              "none": Direction.NONE}
+
+# The activity of a sprite that loses control while falling, by what it carries
+FALLING_ACTIVITIES = {
+    0: Activity.FALLING,
+    Activity.WITH_GOLD: Activity.FALLING_WITH_GOLD,
+    Activity.WITH_EMPTY_WHEELBARROW: Activity.FALLING_WITH_EMPTY_WHEELBARROW,
+    Activity.WITH_LOADED_01_WHEELBARROW: Activity.FALLING_WITH_LOADED_01_WHEELBARROW,
+    Activity.WITH_LOADED_02_WHEELBARROW: Activity.FALLING_WITH_LOADED_02_WHEELBARROW,
+    Activity.WITH_LOADED_03_WHEELBARROW: Activity.FALLING_WITH_LOADED_03_WHEELBARROW}
+
+# The player state machine. The next activity of the player by what the player carries, the control that is used and
+# where the player is. Climbing is only possible with empty hands or a gold sack.
+PLAYER_TRANSITIONS = {
+    (0, Control.NONE, Context.FLOOR): Activity.IDLE,
+    (0, Control.NONE, Context.LADDER): Activity.IDLE_CLIMBING,
+    (0, Control.NONE, Context.ELEVATOR): Activity.IDLE_RIDING_ELEVATOR,
+    (0, Control.HORIZONTAL, Context.FLOOR): Activity.WALKING,
+    (0, Control.HORIZONTAL, Context.LADDER): Activity.CLIMBING,
+    (0, Control.HORIZONTAL, Context.ELEVATOR): Activity.WALKING,
+    (0, Control.VERTICAL, Context.LADDER): Activity.CLIMBING,
+    (Activity.WITH_GOLD, Control.NONE, Context.FLOOR): Activity.IDLE_WITH_GOLD,
+    (Activity.WITH_GOLD, Control.NONE, Context.LADDER): Activity.IDLE_CLIMBING_WITH_GOLD,
+    (Activity.WITH_GOLD, Control.NONE, Context.ELEVATOR): Activity.RIDING_ELEVATOR_WITH_GOLD,
+    (Activity.WITH_GOLD, Control.HORIZONTAL, Context.FLOOR): Activity.WALKING_WITH_GOLD,
+    (Activity.WITH_GOLD, Control.HORIZONTAL, Context.LADDER): Activity.CLIMBING_WITH_GOLD,
+    (Activity.WITH_GOLD, Control.HORIZONTAL, Context.ELEVATOR): Activity.WALKING_WITH_GOLD,
+    (Activity.WITH_GOLD, Control.VERTICAL, Context.LADDER): Activity.CLIMBING_WITH_GOLD,
+    (Activity.WITH_EMPTY_WHEELBARROW, Control.NONE, Context.FLOOR): Activity.IDLE_WITH_EMPTY_WHEELBARROW,
+    (Activity.WITH_EMPTY_WHEELBARROW, Control.NONE, Context.ELEVATOR): Activity.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW,
+    (Activity.WITH_EMPTY_WHEELBARROW, Control.HORIZONTAL, Context.FLOOR): Activity.PUSHING_EMPTY_WHEELBARROW,
+    (Activity.WITH_EMPTY_WHEELBARROW, Control.HORIZONTAL, Context.ELEVATOR):
+        Activity.RIDING_ELEVATOR_WITH_EMPTY_WHEELBARROW,
+    (Activity.WITH_LOADED_01_WHEELBARROW, Control.NONE, Context.FLOOR): Activity.IDLE_WITH_LOADED_01_WHEELBARROW,
+    (Activity.WITH_LOADED_01_WHEELBARROW, Control.NONE, Context.ELEVATOR):
+        Activity.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW,
+    (Activity.WITH_LOADED_01_WHEELBARROW, Control.HORIZONTAL, Context.FLOOR): Activity.PUSHING_LOADED_01_WHEELBARROW,
+    (Activity.WITH_LOADED_01_WHEELBARROW, Control.HORIZONTAL, Context.ELEVATOR):
+        Activity.RIDING_ELEVATOR_WITH_LOADED_01_WHEELBARROW,
+    (Activity.WITH_LOADED_02_WHEELBARROW, Control.NONE, Context.FLOOR): Activity.IDLE_WITH_LOADED_02_WHEELBARROW,
+    (Activity.WITH_LOADED_02_WHEELBARROW, Control.NONE, Context.ELEVATOR):
+        Activity.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW,
+    (Activity.WITH_LOADED_02_WHEELBARROW, Control.HORIZONTAL, Context.FLOOR): Activity.PUSHING_LOADED_02_WHEELBARROW,
+    (Activity.WITH_LOADED_02_WHEELBARROW, Control.HORIZONTAL, Context.ELEVATOR):
+        Activity.RIDING_ELEVATOR_WITH_LOADED_02_WHEELBARROW,
+    (Activity.WITH_LOADED_03_WHEELBARROW, Control.NONE, Context.FLOOR): Activity.IDLE_WITH_LOADED_03_WHEELBARROW,
+    (Activity.WITH_LOADED_03_WHEELBARROW, Control.NONE, Context.ELEVATOR):
+        Activity.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW,
+    (Activity.WITH_LOADED_03_WHEELBARROW, Control.HORIZONTAL, Context.FLOOR): Activity.PUSHING_LOADED_03_WHEELBARROW,
+    (Activity.WITH_LOADED_03_WHEELBARROW, Control.HORIZONTAL, Context.ELEVATOR):
+        Activity.RIDING_ELEVATOR_WITH_LOADED_03_WHEELBARROW}
+
+# Save game records, see Mines.save. Timers and their callbacks are saved by their index in the tuples.
+SAVE_GAME_HEADER = struct.Struct("<4sHB")
+MINE_STATE = struct.Struct("<BIdIIIBB")
+SPRITE_STATE = struct.Struct("<hhIBBhBBBBBBhhibB")
+TIMER_STATE = struct.Struct("<BBi")
+TIMER_NAMES = ("wake_up", "immortality", "expiration")
+TIMER_CALLBACKS = (None, "wake_up", "end_immortality", "kill")
+
+# Initialize the font module so that on-screen texts can be created before the screen is set up
+pygame.font.init()
+
+# Game clock that all timers refer to
+clock = GameClock()
+timers = Timers()
+atlas = SpriteAtlas()
+loader = concurrent.futures.ThreadPoolExecutor()
+image_futures = {}
+
+# Screen. Set up by the setup function.
+screen = None
+display = Display()
+
+# Sprite animations. Each animation is loaded the first time a sprite needs it or when a mine that uses it is loaded.
+SPRITE_ANIMATIONS = load_sprite_animations()
+
+# Mines. Mine 1 and room 1 is loaded by the setup function.
 mine = Mines()
-mine.set(START_MINE, 1)
 
 # On-screen text
 title = OnScreenTexts(Text.TITLE, center=(SCREEN_SIZE[0] // 2, 40))
@@ -1650,99 +4561,39 @@ warnings = pygame.sprite.Group()
 ########################################################################################################################
 # MAIN LOOP
 ########################################################################################################################
-while game_is_running:
-
-    clock.tick(FPS)
-    player_pressed_interact_key = False
-    player_pressed_any_key = False
-    mine.score = int((mine.seconds_remaining * mine.player.lives * mine.bonus))
-
-    # Read events
-    for event in pygame.event.get():
-
-        # Check for quit or pause game request from user
-        game_is_running = \
-            not (event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE))
-        game_is_paused = (not game_is_paused) and (event.type == pygame.KEYUP and event.key == pygame.K_p)
-
-        # Check for specific key presses
-        l_control = event.type == pygame.KEYUP and event.key == pygame.K_LCTRL
-        l_alt = event.type == pygame.KEYUP and event.key == pygame.K_LALT
-        space = event.type == pygame.KEYUP and event.key == pygame.K_SPACE
-        r_control = event.type == pygame.KEYUP and event.key == pygame.K_RCTRL
-        r_alt = event.type == pygame.KEYUP and event.key == pygame.K_RALT
-        player_pressed_interact_key = any((l_control, l_alt, space, r_control, r_alt))
-        player_pressed_any_key = event.type == pygame.KEYDOWN
-
-    # Pause game
-    if game_is_paused:
-        screen.blit(paused.text, paused.rect)
-        pygame.display.flip()
-        continue
-
-    # Check if player has collected all the gold in the mine
-    if mine.is_completed():
-        if player_pressed_any_key:
-            mine.next()
-        continue
-
-    # Open the start screen
-    if show_start_screen:
-        show_start_screen = not player_pressed_any_key
-        start_screen()
-        continue
-
-    # Check if time is up or player has no lives left
-    if mine.is_game_over():
-        game_over()
-        if player_pressed_any_key:
-            mine.reset(START_MINE)
-        continue
-
-    # Check if the player has completed the whole game
-    if mine.is_game_completed():
-        if player_pressed_any_key:
-            mine.scores = {}
-            mine.game_completed = False
-            show_start_screen = True
-        continue
-
-    # Read key presses and move the player
-    key_presses(player_pressed_interact_key)
-
-    # Move miners and apply gravity to all applicable sprites
-    move_sprites()
-
-    # Check if the player is caught by a miner
-    get_caught()
-
-    # Check if the player exits the room
-    exit_room(mine.exits.sprites(), mine.players.sprites())
-
-    # Check if a miner is hit by a falling gold sack
-    hit_miner()
-
-    # Draw background and walls
-    screen.blit(mine.background_img, (0, 0))
-    screen.blit(mine.texture_img, (0, 0))
-
-    # Draw sprites
-    for s in mine.all_sprites:
-        s.draw(screen)
-    warnings.draw(screen)
-    mine.players.draw(screen)
-    mine.elevators.draw(screen)
-
-    # Update remaining time
-    mine.seconds_remaining -= clock.get_time() / 1000
-
-    # Draw text
-    screen.blit(lives.update(mine.player.lives), lives.rect)
-    screen.blit(gold_delivered.update(mine.gold_delivered, mine.no_of_gold_sacks), gold_delivered.rect)
-    screen.blit(seconds_left.update(int(mine.seconds_remaining)), seconds_left.rect)
-    screen.blit(bonus.update(mine.bonus), bonus.rect)
-    screen.blit(title.text, title.rect)
-    screen.blit(mine_no.update(mine.mine), mine_no.rect)
-
-    # Update the screen
-    pygame.display.flip()
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    if arguments.clear_cache:
+        clear_asset_cache()
+    elif arguments.compare_traces:
+        compare_traces(*arguments.compare_traces)
+    elif arguments.batch:
+        batch(arguments.batch, seed=arguments.seed or 0, policy=arguments.policy, frames=arguments.frames,
+              workers=arguments.workers)
+    elif arguments.check_mines:
+        setup(headless=True, seed=arguments.seed)
+        check_mines()
+    elif arguments.check_determinism:
+        setup(headless=True)
+        check_determinism(seed=arguments.seed or 0, policy=arguments.policy, frames=arguments.frames)
+    elif arguments.benchmark_gravity is not None:
+        setup(headless=True)
+        benchmark_gravity(arguments.benchmark_gravity, seed=arguments.seed or 0, frames=arguments.frames)
+    else:
+
+        # A recorded session starts from the seed it was recorded with. A session that is recorded without a seed gets
+        # a random one so that it can be replayed.
+        replay_log = InputLog.load(arguments.replay) if arguments.replay else None
+        seed = replay_log.seed if replay_log else arguments.seed
+        if arguments.record and seed is None:
+            seed = random.randrange(2 ** 32)
+        recorder = InputLog(seed).open(arguments.record) if arguments.record else None
+        tracer = StateTrace().open(arguments.trace) if arguments.trace else None
+        setup(headless=arguments.headless, seed=seed, resume=arguments.resume)
+        try:
+            main(frames=arguments.frames, headless=arguments.headless, dirty_rects=arguments.dirty_rects,
+                 recorder=recorder, replay=replay_log, tracer=tracer, save_path=arguments.save)
+        finally:
+            for log in (recorder, tracer):
+                if log:
+                    log.close()